@@ -0,0 +1,116 @@
+"""Compares the copy strategies of `transfer_products.copy_object` against a local S3 stand-in (moto server):
+
+- managed: the managed transfer with a fixed 100 MiB multipart threshold and part size, constructing a new bucket
+  resource and transfer config for each object, as `transfer_products` did before it chose a strategy by size
+- sized: `copy_object`, which looks up the size of each object with a HEAD request, then copies small objects with
+  one CopyObject request and large objects with a multipart upload of adaptively sized parts
+
+Each strategy copies the same objects one at a time, so the wall time reflects the per-object overhead of each
+strategy rather than the concurrency of `copy_objects`.
+
+Requires moto[server]: python -m pip install 'moto[server]'
+
+Usage: python benchmarks/copy_strategies.py [--small N] [--small-size KIB] [--large N] [--large-size MIB]
+                                           [--latency SECONDS]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO / 'transfer-products' / 'src'))
+
+SOURCE_BUCKET = 'benchmark-source'
+TARGET_BUCKET = 'benchmark-target'
+
+
+def managed_copy(source_key: str, target_key: str, size: int) -> None:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+
+    chunk_size = 100 * 1024 * 1024
+    bucket = boto3.resource('s3').Bucket(TARGET_BUCKET)
+    bucket.copy(
+        CopySource={'Bucket': SOURCE_BUCKET, 'Key': source_key},
+        Key=target_key,
+        Config=TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size),
+        ExtraArgs={'TaggingDirective': 'REPLACE'},
+    )
+
+
+def sized_copy(source_key: str, target_key: str, size: int) -> None:
+    import transfer_products
+    transfer_products.copy_object(SOURCE_BUCKET, source_key, TARGET_BUCKET, target_key)
+
+
+STRATEGIES = {
+    'managed': managed_copy,
+    'sized': sized_copy,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--small', type=int, default=200, help='Number of small objects')
+    parser.add_argument('--small-size', type=int, default=512, help='Size of each small object in KiB')
+    parser.add_argument('--large', type=int, default=2, help='Number of large objects')
+    parser.add_argument('--large-size', type=int, default=300, help='Size of each large object in MiB')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to each S3 request')
+    args = parser.parse_args()
+
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit("This benchmark requires moto[server]: python -m pip install 'moto[server]'")
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update({
+        'AWS_ENDPOINT_URL': f'http://{host}:{port}',
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+    })
+
+    import boto3
+
+    # Every client and resource, including those of transfer_products, is created from the default session
+    boto3.setup_default_session()
+    if args.latency:
+        boto3.DEFAULT_SESSION.events.register('before-send.s3', lambda **kwargs: time.sleep(args.latency))
+
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket=SOURCE_BUCKET)
+    s3.create_bucket(Bucket=TARGET_BUCKET)
+    objects = [(f'small-{i}_VV.tif', args.small_size * 1024) for i in range(args.small)]
+    objects += [(f'large-{i}_rgb.tif', args.large_size * 1024 * 1024) for i in range(args.large)]
+    for key, size in objects:
+        s3.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=b'\0' * size, ContentType='image/tiff')
+
+    print(f'{"strategy":<16}{"small (s)":>12}{"per object (ms)":>18}{"large (s)":>12}{"per object (s)":>17}')
+    try:
+        for name, strategy in STRATEGIES.items():
+            times = {}
+            for kind in ('small', 'large'):
+                selected = [(key, size) for key, size in objects if key.startswith(kind)]
+                start = time.perf_counter()
+                for key, size in selected:
+                    strategy(key, f'{name}/{key}', size)
+                times[kind] = (time.perf_counter() - start, len(selected))
+            small_time, small_count = times['small']
+            large_time, large_count = times['large']
+            print(
+                f'{name:<16}{small_time:>12.2f}{small_time / max(small_count, 1) * 1000:>18.1f}'
+                f'{large_time:>12.2f}{large_time / max(large_count, 1):>17.2f}'
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""Runs `hyp3_floods.main` end to end against local stand-ins for the PDC Hazard API, Earthdata login and the HyP3
+subscriptions API, at increasing numbers of active hazards.
+
+For each number of hazards, a fresh Python process runs `main` twice against the same stand-in servers:
+
+- cold: no subscriptions exist yet, so a subscription is submitted for every hazard
+- warm: the second run in the same process, with every subscription up to date
+
+and reports the wall time and the number of requests of each run, and the peak RSS of the process.
+
+The stand-in servers support a per-request latency, a rate of retryable (HTTP 503) errors (see ERROR_ROUTES), and
+the page size of the HyP3 subscription listing.
+
+Usage: python benchmarks/scale.py [--hazards N [N ...]] [--latency SECONDS] [--error-rate RATE] [--page-size N]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+REPO = Path(__file__).resolve().parent.parent
+
+HAZARD_COUNTS = (10, 100, 1_000, 10_000)
+
+# Routes that fail at the configured error rate. Earthdata login and the HyP3 subscription listing are excluded, as a
+# failure of either fails the whole run.
+ERROR_ROUTES = frozenset({
+    'pdc:get_active_hazards',
+    'pdc:get_aoi',
+    'hyp3:submit_subscription',
+    'hyp3:update_subscription',
+})
+
+SCRIPT = """
+import json
+import resource
+import sys
+import time
+
+import requests
+
+import hyp3_floods
+
+stats_url = sys.argv[1]
+runs = []
+for name in ('cold', 'warm'):
+    requests.get(stats_url, params={'reset': 'true'}).raise_for_status()
+    start = time.perf_counter()
+    try:
+        hyp3_floods.main(dry_run=False)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    wall_time = time.perf_counter() - start
+    runs.append({'run': name, 'wall_time': wall_time, 'requests': requests.get(stats_url).json(), 'error': error})
+
+peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({'runs': runs, 'peak_rss_mb': peak_rss_mb}))
+"""
+
+
+def make_hazard(hazard_id: int, start_date_in_ms: int) -> dict:
+    return {
+        'uuid': f'benchmark-{hazard_id}',
+        'hazard_ID': hazard_id,
+        'type_ID': 'FLOOD',
+        'category_ID': 'EVENT',
+        'severity_ID': 'WARNING',
+        'start_Date': str(start_date_in_ms),
+        'update_Date': str(start_date_in_ms),
+        # Stand-in for the many fields of a real hazard that hyp3_floods discards
+        'hazard_Name': f'Flood - Benchmark {hazard_id}',
+        'description': 'Benchmark hazard. ' * 20,
+        'latitude': -60 + (hazard_id % 120),
+        'longitude': -170 + (hazard_id // 120 % 340),
+    }
+
+
+def make_aoi(hazard_id: int) -> str:
+    x, y = -170 + (hazard_id // 120 % 340), -60 + (hazard_id % 120)
+    return f'POLYGON (({x} {y}, {x + 0.5} {y}, {x + 0.5} {y + 0.5}, {x} {y + 0.5}, {x} {y}))'
+
+
+class StandInServices:
+    """State of the stand-in PDC, Earthdata and HyP3 services, shared by all request handler threads."""
+
+    def __init__(self, hazard_count: int, latency: float, error_rate: float, page_size: int):
+        start_date_in_ms = int((time.time() - 24 * 60 * 60) * 1000)
+        self.hazards = [make_hazard(hazard_id, start_date_in_ms) for hazard_id in range(hazard_count)]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.subscriptions: dict[str, dict] = {}
+        self.request_counts: Counter = Counter()
+        self.lock = threading.Lock()
+
+
+def make_handler(services: StandInServices) -> type:
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Avoids delayed ACKs between the separately written headers and body of each response
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PATCH(self):
+            self._handle('PATCH')
+
+        def _handle(self, method: str) -> None:
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length)) if length else None
+
+            if url.path == '/_stats':
+                with services.lock:
+                    counts = dict(services.request_counts)
+                    if query.get('reset'):
+                        services.request_counts.clear()
+                return self._send_json(counts)
+
+            route = self._get_route(method, url.path)
+            with services.lock:
+                services.request_counts[route] += 1
+            time.sleep(services.latency)
+            if route in ERROR_ROUTES and random.random() < services.error_rate:
+                return self._send(503, b'')
+
+            if route == 'pdc:get_active_hazards':
+                return self._send_json(services.hazards)
+            if route == 'pdc:get_aoi':
+                hazard_id = int(url.path.split('/')[-2])
+                etag = f'"{hazard_id}"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, b'', {'ETag': etag})
+                return self._send_json({'wkt': {'text': make_aoi(hazard_id)}}, {'ETag': etag})
+            if route == 'earthdata:login':
+                expires = formatdate(time.time() + 60 * 60, usegmt=True)
+                return self._send(200, b'', {'Set-Cookie': f'asf-urs=benchmark; Path=/; Expires={expires}'})
+            if route == 'hyp3:get_subscriptions':
+                return self._send_json(self._get_subscriptions(query))
+            if route == 'hyp3:submit_subscription':
+                return self._send_json({'subscription': self._submit_subscription(body)})
+            if route == 'hyp3:update_subscription':
+                return self._update_subscription(url.path.split('/')[-1], body)
+            return self._send(404, b'')
+
+        @staticmethod
+        def _get_route(method: str, path: str) -> str:
+            if path == '/pdc/hp_srv/services/hazards/t/json/get_active_hazards':
+                return 'pdc:get_active_hazards'
+            if re.fullmatch(r'/pdc/hp_srv/services/hazard/\d+/alertGeography', path):
+                return 'pdc:get_aoi'
+            if path == '/earthdata/login':
+                return 'earthdata:login'
+            if path == '/hyp3/subscriptions':
+                return {'GET': 'hyp3:get_subscriptions', 'POST': 'hyp3:submit_subscription'}.get(method, 'unknown')
+            if path.startswith('/hyp3/subscriptions/') and method == 'PATCH':
+                return 'hyp3:update_subscription'
+            return 'unknown'
+
+        def _get_subscriptions(self, query: dict) -> dict:
+            with services.lock:
+                subscriptions = list(services.subscriptions.values())
+            if 'name' in query:
+                return {'subscriptions': [
+                    subscription for subscription in subscriptions
+                    if subscription['job_specification']['name'] == query['name']
+                ]}
+            page = int(query.get('page', 0))
+            response = {'subscriptions': subscriptions[page * services.page_size:(page + 1) * services.page_size]}
+            if (page + 1) * services.page_size < len(subscriptions):
+                response['next'] = f'http://{self.headers["Host"]}/hyp3/subscriptions?page={page + 1}'
+            return response
+
+        @staticmethod
+        def _submit_subscription(body: dict) -> dict:
+            with services.lock:
+                subscription_id = str(len(services.subscriptions))
+                subscription = {
+                    **body['subscription'],
+                    'subscription_id': subscription_id,
+                    'creation_date': datetime.now(tz=timezone.utc).isoformat(),
+                    'enabled': True,
+                }
+                if not body.get('validate_only'):
+                    services.subscriptions[subscription_id] = subscription
+            return subscription
+
+        def _update_subscription(self, subscription_id: str, body: dict) -> None:
+            with services.lock:
+                subscription = services.subscriptions.get(subscription_id)
+                if subscription is None:
+                    return self._send(404, b'')
+                if 'enabled' in body:
+                    subscription['enabled'] = body.pop('enabled')
+                subscription['search_parameters'].update(body)
+            return self._send_json(subscription)
+
+        def _send_json(self, data, headers: dict = None) -> None:
+            self._send(200, json.dumps(data).encode(), {'Content-Type': 'application/json', **(headers or {})})
+
+        def _send(self, status: int, body: bytes, headers: dict = None) -> None:
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def run_benchmark(hazard_count: int, latency: float, error_rate: float, page_size: int) -> dict:
+    services = StandInServices(hazard_count, latency, error_rate, page_size)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(services))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    env = {
+        **os.environ,
+        'PDC_HAZARDS_AUTH_TOKEN': 'benchmark-token',
+        'PDC_URL': f'{base_url}/pdc',
+        'EARTHDATA_LOGIN_URL': f'{base_url}/earthdata/login',
+        'HYP3_URL': f'{base_url}/hyp3',
+        'EARTHDATA_USERNAME': 'benchmark-user',
+        'EARTHDATA_PASSWORD': 'benchmark-pass',
+        'PYTHONPATH': str(REPO / 'hyp3-floods' / 'src'),
+    }
+    for name in ('AOI_CACHE_LOCATION', 'CHECKPOINT_LOCATION', 'SNAPSHOT_LOCATION', 'EARTHDATA_COOKIE_LOCATION'):
+        env.pop(name, None)
+
+    try:
+        output = subprocess.run(
+            [sys.executable, '-c', SCRIPT, f'{base_url}/_stats'], env=env, check=True, capture_output=True, text=True
+        ).stdout
+    finally:
+        server.shutdown()
+        server.server_close()
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hazards', type=int, nargs='+', default=HAZARD_COUNTS)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to each request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail with HTTP 503')
+    parser.add_argument('--page-size', type=int, default=1000, help='HyP3 subscriptions per page')
+    args = parser.parse_args()
+
+    print(f'{"hazards":>8}  {"run":<5}{"wall (s)":>10}{"requests":>10}{"peak RSS (MB)":>15}  requests by route')
+    for hazard_count in args.hazards:
+        result = run_benchmark(hazard_count, args.latency, args.error_rate, args.page_size)
+        for run in result['runs']:
+            by_route = ', '.join(f'{route}={count}' for route, count in sorted(run['requests'].items()))
+            print(
+                f'{hazard_count:>8}  {run["run"]:<5}{run["wall_time"]:>10.2f}{sum(run["requests"].values()):>10}'
+                f'{result["peak_rss_mb"]:>15.1f}  {by_route}'
+            )
+            if run['error']:
+                print(f'{"":>8}  run failed: {run["error"]}')
+
+
+if __name__ == '__main__':
+    main()
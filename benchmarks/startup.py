@@ -0,0 +1,120 @@
+"""Measures the cold start cost of each Lambda handler, including each handler deployed by cloudformation.yml.
+
+Each measurement runs in a fresh Python process and reports:
+
+- import: time to import the handler module
+- first request: time from the start of the import until the handler first tries to resolve a hostname, i.e. until
+  its first outbound request. The request is aborted, so no network access or credentials are needed.
+
+Usage: python benchmarks/startup.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+HYP3_FLOODS_ENV = {
+    'PDC_HAZARDS_AUTH_TOKEN': 'benchmark-token',
+    'SHARD_QUEUE_URL': 'https://sqs.us-west-2.amazonaws.com/123456789012/benchmark-queue',
+    'SHARD_RESULTS_LOCATION': 's3://benchmark-bucket/shard-results',
+}
+
+BENCHMARK_SHARD = {
+    'run_id': 'benchmark-run', 'shard': 0, 'end': '2022-06-15T00:00:00Z', 'dry_run': True, 'hazards': [],
+    'subscription_index': None, 'aois': None,
+}
+
+BENCHMARK_HAZARD = {
+    'uuid': 'benchmark-uuid', 'hazard_ID': 1, 'type_ID': 'FLOOD', 'category_ID': 'EVENT', 'severity_ID': 'WARNING',
+    'start_Date': '0', 'end_Date': '0', 'update_Date': '0',
+}
+
+# Handler -> (environment variables, event)
+HANDLERS = {
+    'hyp3_floods.lambda_handler': (HYP3_FLOODS_ENV, {}),
+    'hyp3_floods.coordinator_handler': (HYP3_FLOODS_ENV, {}),
+    'hyp3_floods.worker_handler': (
+        HYP3_FLOODS_ENV, {'Records': [{'messageId': 'benchmark', 'body': json.dumps(BENCHMARK_SHARD)}]}
+    ),
+    'hyp3_floods.hazard_event_handler': (
+        HYP3_FLOODS_ENV, {'Records': [{'messageId': 'benchmark', 'body': json.dumps(BENCHMARK_HAZARD)}]}
+    ),
+    'transfer_products.lambda_handler': (
+        {'S3_TARGET_BUCKET': 'benchmark-bucket', 'S3_TARGET_PREFIX': 'benchmark-prefix'}, {}
+    ),
+}
+
+COMMON_ENV = {
+    'HYP3_URL': 'https://hyp3-benchmark.asf.alaska.edu',
+    'EARTHDATA_USERNAME': 'benchmark-user',
+    'EARTHDATA_PASSWORD': 'benchmark-pass',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+}
+
+SCRIPT = """
+import json
+import socket
+import sys
+import time
+
+
+class FirstRequest(BaseException):
+    pass
+
+
+def getaddrinfo(host, *args, **kwargs):
+    raise FirstRequest(host)
+
+
+socket.getaddrinfo = getaddrinfo
+
+module_name, handler_name = sys.argv[1].split('.')
+start = time.perf_counter()
+module = __import__(module_name)
+imported = time.perf_counter()
+try:
+    getattr(module, handler_name)(json.loads(sys.argv[2]), None)
+except FirstRequest as e:
+    host = str(e)
+else:
+    host = None
+first_request = time.perf_counter()
+
+print(json.dumps({'import': imported - start, 'first_request': first_request - start, 'host': host}))
+"""
+
+
+def measure(handler: str) -> dict:
+    handler_env, event = HANDLERS[handler]
+    env = {
+        **os.environ,
+        **COMMON_ENV,
+        **handler_env,
+        'PYTHONPATH': os.pathsep.join([str(REPO / 'hyp3-floods' / 'src'), str(REPO / 'transfer-products' / 'src')]),
+    }
+    output = subprocess.run(
+        [sys.executable, '-c', SCRIPT, handler, json.dumps(event)], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"handler":<36}{"import (ms)":>14}{"first request (ms)":>22}  first host')
+    for handler in HANDLERS:
+        results = [measure(handler) for _ in range(args.repeat)]
+        import_ms = statistics.median(result['import'] for result in results) * 1000
+        first_request_ms = statistics.median(result['first_request'] for result in results) * 1000
+        print(f'{handler:<36}{import_ms:>14.1f}{first_request_ms:>22.1f}  {results[-1]["host"]}')
+
+
+if __name__ == '__main__':
+    main()
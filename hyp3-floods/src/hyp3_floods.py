@@ -1,16 +1,45 @@
 import argparse
+import base64
+import codecs
+import email.utils
+import functools
+import gzip
+import inspect
+import hashlib
+import json
+import math
 import os
+import random
+import re
+import threading
 import time
-from datetime import datetime, timedelta, timezone
-from typing import Optional
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Iterable, Iterator, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 PDC_URL = 'https://sentry.pdc.org'
 
+EARTHDATA_LOGIN_URL = 'https://urs.earthdata.nasa.gov/oauth/authorize?response_type=code' \
+                      '&client_id=BO_n7nTIlMljdvU6kRRB3g&redirect_uri=https://auth.asf.alaska.edu/login&app_type=401'
+
+# Cached Earthdata session cookies are discarded this long before they expire.
+# This value was chosen arbitrarily.
+EARTHDATA_COOKIE_EXPIRY_MARGIN = timedelta(minutes=5)
+
 # This value was chosen arbitrarily.
 HAZARD_END_DATE_DELTA = timedelta(hours=3)
 
+# An existing subscription's end datetime is only extended once it falls this far behind the desired end datetime,
+# so that its remaining window never drops below HAZARD_END_DATE_DELTA - HAZARD_END_DATE_REFRESH.
+# This value was chosen arbitrarily.
+HAZARD_END_DATE_REFRESH = timedelta(hours=1)
+
 # Below constants are documented at
 # https://github.com/ASFHyP3/hyp3-flood-monitoring#important-constants
 
@@ -18,6 +47,103 @@ HAZARD_START_DATE_DELTA = timedelta(hours=1)
 
 HAZARD_START_DATE_MINIMUM = datetime(2022, 1, 1, tzinfo=timezone.utc)
 
+# Number of hazards processed concurrently, and the maximum number of in-flight requests to each upstream API.
+# These values were chosen arbitrarily.
+MAX_WORKERS = 8
+PDC_MAX_CONCURRENT_REQUESTS = 4
+HYP3_MAX_CONCURRENT_REQUESTS = 4
+
+# (connect, read) timeouts in seconds, and retry settings for requests to the PDC API.
+# These values were chosen arbitrarily.
+PDC_TIMEOUT = (3.05, 30)
+PDC_MAX_RETRIES = 3
+PDC_BACKOFF_BASE = 0.5
+PDC_BACKOFF_MAX = 10.0
+
+# (connect, read) timeouts in seconds for requests to the HyP3 API and Earthdata login.
+# These values were chosen arbitrarily.
+HYP3_TIMEOUT = (3.05, 30)
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Number of consecutive failed requests after which we stop sending requests to an upstream API for the rest of
+# the run, and the time reserved at the end of a Lambda invocation for finishing in-flight work.
+# These values were chosen arbitrarily.
+CIRCUIT_BREAKER_THRESHOLD = 5
+DEADLINE_MARGIN = timedelta(seconds=60)
+
+SUBSCRIPTION_NAME_PREFIX = 'PDC-hazard-'
+
+# Hazard fields used by this module; all other fields are discarded while streaming the active hazards
+HAZARD_FIELDS = ('uuid', 'hazard_ID', 'type_ID', 'category_ID', 'severity_ID', 'start_Date', 'update_Date')
+
+HAZARD_EVENT_REQUIRED_FIELDS = frozenset(HAZARD_FIELDS) - {'update_Date'}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Decimal places kept when normalizing AOI coordinates, the maximum distance (in degrees) between the boundaries of two
+# AOIs that are considered equal, and the vertex and WKT size budgets above which AOIs are simplified.
+# These values were chosen arbitrarily.
+AOI_PRECISION = 6
+AOI_TOLERANCE = 1e-5
+AOI_MAX_VERTICES = 5000
+AOI_MAX_BYTES = 100_000
+
+# Number of points sampled along each AOI boundary segment, besides its vertices, when comparing AOIs.
+# This value was chosen arbitrarily.
+AOI_EDGE_SAMPLES = 7
+
+# Minimum fraction of a hazard's AOI that must be covered by another hazard's AOI for the hazard to be considered
+# redundant, and the number of sample points per axis used to estimate that fraction.
+# These values were chosen arbitrarily.
+DEDUPLICATION_OVERLAP_THRESHOLD = 0.9
+DEDUPLICATION_SAMPLES = 16
+
+# Maximum fraction by which merging covered hazards' AOIs into a covering hazard's AOI may grow its area.
+# This value was chosen arbitrarily.
+DEDUPLICATION_MERGE_MAX_GROWTH = 0.2
+
+# Subscriptions for hazards that are no longer active are disabled once their end datetime is this far in the past,
+# at most SWEEP_BATCH_SIZE subscriptions per run. The grace period leaves time for late-arriving data acquired within
+# the subscription's date range to be processed.
+# These values were chosen arbitrarily.
+SWEEP_GRACE_PERIOD = timedelta(days=1)
+SWEEP_BATCH_SIZE = 100
+
+# Number of new subscriptions in a plan that are validated by the HyP3 API, and the maximum age of a plan that can be
+# applied.
+# These values were chosen arbitrarily.
+PLAN_VALIDATION_SAMPLE = 5
+PLAN_MAX_AGE = timedelta(hours=1)
+
+# Maximum number of hazards per shard in sharded mode, and how often (in seconds) the coordinator polls for the results
+# of shards dispatched through SQS.
+# These values were chosen arbitrarily.
+SHARD_SIZE = 50
+SHARD_POLL_INTERVAL = 5.0
+
+SQS_MAX_MESSAGE_BYTES = 256 * 1024
+
+# Columns of the hazard history archive, one row per active hazard per run
+HISTORY_COLUMNS = ('run_time', 'uuid', 'hazard_ID', 'severity_ID', 'start_Date', 'update_Date', 'action', 'aoi_hash')
+
+# Name of the file into which the runs of a past day's history partition are compacted
+HISTORY_COMPACTED_NAME = 'runs.json.gz'
+
+# Upper bounds (in milliseconds) of the latency histogram buckets recorded for each instrumented operation, and the
+# CloudWatch namespace of the metrics.
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+METRICS_NAMESPACE = 'hyp3-flood-monitoring'
+
+# Reused across warm Lambda invocations
+_AOI_CACHE: Optional['AOICache'] = None
+_HAZARD_SNAPSHOT: Optional['HazardSnapshot'] = None
+_EARTHDATA_COOKIES: dict[str, list[dict]] = {}
+_PDC_APIS: dict[tuple[str, str], 'PDCHazardsAPI'] = {}
+_HYP3_APIS: dict[tuple[str, str, str, Optional[str]], 'HyP3SubscriptionsAPI'] = {}
+_S3_CLIENT = None
+_S3_CLIENT_LOCK = threading.Lock()
+
 
 class MissingEnvVar(Exception):
     pass
@@ -27,57 +153,1394 @@ class DuplicateSubscriptionNames(Exception):
     pass
 
 
+class CircuitOpen(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class InvalidGeometry(Exception):
+    pass
+
+
+class StalePlan(Exception):
+    pass
+
+
+class InvalidHazardEvent(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast once an upstream API has failed `failure_threshold` times in a row.
+
+    A failure is a connection error, timeout or retryable HTTP status; any other response resets the count.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_BREAKER_THRESHOLD):
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._consecutive_failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._consecutive_failures >= self._failure_threshold
+
+    def check(self) -> None:
+        if self.is_open:
+            raise CircuitOpen(f'{self._name} API circuit breaker is open after {self._consecutive_failures} '
+                              'consecutive failures')
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures == self._failure_threshold:
+                print(f'Opening {self._name} API circuit breaker after {self._consecutive_failures} consecutive '
+                      'failures')
+
+    def record_response(self, response: requests.Response) -> None:
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def reset(self) -> None:
+        self.record_success()
+
+
+def get_request_timeout(timeout: tuple[float, float], deadline: Optional[float]) -> tuple[float, float]:
+    """Caps the (connect, read) timeouts of a request at the time left before the `deadline` (in `time.monotonic()`
+    seconds), so that in-flight requests finish or time out before the deadline.
+    """
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded('Not sending request after the deadline')
+    return min(timeout[0], remaining), min(timeout[1], remaining)
+
+
+@dataclass
+class OperationMetrics:
+    calls: int = 0
+    errors: int = 0
+    bytes: int = 0
+    total_ms: float = 0.0
+    min_ms: float = math.inf
+    max_ms: float = 0.0
+    # One count per LATENCY_BUCKETS_MS bucket, plus one for latencies above the last bucket
+    bucket_counts: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+
+class Metrics:
+    """Thread-safe latency histograms, call counts, bytes received and error counts per operation.
+
+    Bytes received are attributed to the innermost operation being measured by the current thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._operations: dict[str, OperationMetrics] = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._operations = {}
+
+    @contextmanager
+    def measure(self, operation: str) -> Iterator[None]:
+        previous_operation = getattr(self._local, 'operation', None)
+        self._local.operation = operation
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._local.operation = previous_operation
+            self._record(operation, (time.perf_counter() - start) * 1000, error)
+
+    def add_bytes(self, count: int) -> None:
+        operation = getattr(self._local, 'operation', None)
+        if operation is not None:
+            with self._lock:
+                self._operations.setdefault(operation, OperationMetrics()).bytes += count
+
+    def _record(self, operation: str, latency_ms: float, error: bool) -> None:
+        bucket = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS_MS) if latency_ms <= bound), len(LATENCY_BUCKETS_MS)
+        )
+        with self._lock:
+            metrics = self._operations.setdefault(operation, OperationMetrics())
+            metrics.calls += 1
+            metrics.errors += error
+            metrics.total_ms += latency_ms
+            metrics.min_ms = min(metrics.min_ms, latency_ms)
+            metrics.max_ms = max(metrics.max_ms, latency_ms)
+            metrics.bucket_counts[bucket] += 1
+
+    def get_operations(self) -> dict[str, OperationMetrics]:
+        with self._lock:
+            return {operation: replace(metrics, bucket_counts=list(metrics.bucket_counts))
+                    for operation, metrics in self._operations.items()}
+
+    def to_emf(self, timestamp_ms: int) -> list[dict]:
+        """Returns one CloudWatch embedded metric format document per operation."""
+        documents = []
+        for operation, metrics in sorted(self.get_operations().items()):
+            # Latencies above the last bucket are represented by the maximum latency
+            bounds = [*LATENCY_BUCKETS_MS, metrics.max_ms]
+            histogram = [(bound, count) for bound, count in zip(bounds, metrics.bucket_counts) if count]
+            documents.append({
+                '_aws': {
+                    'Timestamp': timestamp_ms,
+                    'CloudWatchMetrics': [{
+                        'Namespace': METRICS_NAMESPACE,
+                        'Dimensions': [['Operation']],
+                        'Metrics': [
+                            {'Name': 'Latency', 'Unit': 'Milliseconds'},
+                            {'Name': 'Calls', 'Unit': 'Count'},
+                            {'Name': 'Errors', 'Unit': 'Count'},
+                            {'Name': 'Bytes', 'Unit': 'Bytes'},
+                        ],
+                    }],
+                },
+                'Operation': operation,
+                'Latency': {
+                    'Values': [float(bound) for bound, _ in histogram],
+                    'Counts': [count for _, count in histogram],
+                    'Max': metrics.max_ms,
+                    'Min': metrics.min_ms,
+                    'Sum': metrics.total_ms,
+                    'Count': metrics.calls,
+                },
+                'Calls': metrics.calls,
+                'Errors': metrics.errors,
+                'Bytes': metrics.bytes,
+            })
+        return documents
+
+
+METRICS = Metrics()
+
+
+def instrumented(operation: str) -> Callable[[Callable], Callable]:
+    """Decorator that measures each call to the decorated function (or each iteration of a generator) as `operation`.
+    """
+    def decorator(func: Callable) -> Callable:
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with METRICS.measure(operation):
+                    yield from func(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.measure(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def print_metrics() -> None:
+    for document in METRICS.to_emf(int(time.time() * 1000)):
+        print(json.dumps(document))
+
+
+@dataclass(frozen=True)
+class GeometryOptions:
+    tolerance: float = AOI_TOLERANCE
+    max_vertices: Optional[int] = AOI_MAX_VERTICES
+    max_bytes: Optional[int] = AOI_MAX_BYTES
+
+
+@dataclass(frozen=True)
+class HazardResult:
+    uuid: str
+    action: Optional[str] = None
+    error: Optional[Exception] = None
+
+    @property
+    def unfinished(self) -> bool:
+        return self.action == 'skipped' or isinstance(self.error, (CircuitOpen, DeadlineExceeded))
+
+    def to_dict(self) -> dict:
+        return {
+            'uuid': self.uuid,
+            'action': self.action,
+            'error': str(self.error) if self.error is not None else None,
+            'unfinished': self.unfinished,
+        }
+
+
 class HyP3SubscriptionsAPI:
 
-    def __init__(self, api_url: str, username: str, password: str):
+    def __init__(
+            self,
+            api_url: str,
+            username: str,
+            password: str,
+            max_concurrent_requests: int = HYP3_MAX_CONCURRENT_REQUESTS,
+            cookie_location: Optional[str] = None,
+            timeout: tuple[float, float] = HYP3_TIMEOUT):
         self._url = api_url
-        self._session = self._get_hyp3_api_session(username, password)
+        self._username = username
+        self._password = password
+        self._cookie_location = cookie_location
+        self._session = self._get_hyp3_api_session(username, password, cookie_location)
+        self._semaphore = threading.BoundedSemaphore(max_concurrent_requests)
+        self._auth_lock = threading.Lock()
+        self._timeout = timeout
+        self.circuit_breaker = CircuitBreaker('HyP3')
+        # Requests are not sent, and their timeouts are capped, after this `time.monotonic()` deadline
+        self.deadline: Optional[float] = None
+
+    @staticmethod
+    def _get_hyp3_api_session(username: str, password: str, cookie_location: Optional[str] = None) -> requests.Session:
+        cookies = get_cached_earthdata_cookies(username, cookie_location)
+        if cookies is None:
+            return HyP3SubscriptionsAPI._log_in(username, password, cookie_location)
+
+        print('Reusing cached Earthdata session')
+        session = requests.Session()
+        for cookie in cookies:
+            session.cookies.set(**cookie)
+        return session
 
     @staticmethod
-    def _get_hyp3_api_session(username: str, password: str) -> requests.Session:
-        url = 'https://urs.earthdata.nasa.gov/oauth/authorize?response_type=code&client_id=BO_n7nTIlMljdvU6kRRB3g' \
-              '&redirect_uri=https://auth.asf.alaska.edu/login&app_type=401'
+    @instrumented('earthdata_login')
+    def _log_in(username: str, password: str, cookie_location: Optional[str]) -> requests.Session:
         session = requests.Session()
-        response = session.get(url, auth=(username, password))
+        response = session.get(
+            os.getenv('EARTHDATA_LOGIN_URL', EARTHDATA_LOGIN_URL), auth=(username, password), timeout=HYP3_TIMEOUT
+        )
+        METRICS.add_bytes(len(response.content))
         response.raise_for_status()
+        cache_earthdata_cookies(username, session.cookies, cookie_location)
         return session
 
+    @instrumented('get_subscriptions_by_name')
     def get_subscriptions_by_name(self, name: str) -> dict:
         url = f'{self._url}/subscriptions'
-        response = self._session.get(url, params={'name': name})
+        response = self._request('get', url, params={'name': name})
         response.raise_for_status()
         return response.json()
 
+    @instrumented('get_all_subscriptions')
+    def get_all_subscriptions(self, **params) -> list[dict]:
+        url = f'{self._url}/subscriptions'
+        subscriptions = []
+        while url:
+            response = self._request('get', url, params=params)
+            response.raise_for_status()
+            page = response.json()
+            subscriptions.extend(page['subscriptions'])
+            # The next page URL already includes the query parameters
+            url, params = page.get('next'), None
+        return subscriptions
+
+    @instrumented('submit_subscription')
     def submit_subscription(self, subscription: dict, validate_only=False) -> dict:
         url = f'{self._url}/subscriptions'
         payload = {'subscription': subscription, 'validate_only': validate_only}
-        response = self._session.post(url, json=payload)
+        response = self._request('post', url, json=payload)
         response.raise_for_status()
         return response.json()
 
+    @instrumented('update_subscription')
     def update_subscription(self, subscription_id: str, **kwargs) -> dict:
         url = f'{self._url}/subscriptions/{subscription_id}'
-        response = self._session.patch(url, json=kwargs)
+        response = self._request('patch', url, json=kwargs)
         response.raise_for_status()
         return response.json()
 
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        self.circuit_breaker.check()
+        session = self._session
+        response = self._send(session, method, url, **kwargs)
+        if response.status_code == 401:
+            self._refresh_session(session)
+            response = self._send(self._session, method, url, **kwargs)
+        self.circuit_breaker.record_response(response)
+        return response
+
+    def _send(self, session: requests.Session, method: str, url: str, **kwargs) -> requests.Response:
+        try:
+            with self._semaphore:
+                timeout = get_request_timeout(self._timeout, self.deadline)
+                response = getattr(session, method)(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.circuit_breaker.record_failure()
+            raise
+        METRICS.add_bytes(len(response.content))
+        return response
+
+    def _refresh_session(self, stale_session: requests.Session) -> None:
+        # Only the first thread to see the stale session logs in again
+        with self._auth_lock:
+            if self._session is stale_session:
+                print('Earthdata session was rejected; logging in again')
+                self._session = self._log_in(self._username, self._password, self._cookie_location)
+
+
+def get_hyp3_api(
+        api_url: str, username: str, password: str, cookie_location: Optional[str] = None) -> HyP3SubscriptionsAPI:
+    """Returns a HyP3 API client, reusing the client (and its authenticated session) from a previous warm invocation."""
+    key = (api_url, username, password, cookie_location)
+    hyp3 = _HYP3_APIS.get(key)
+    if hyp3 is None:
+        hyp3 = HyP3SubscriptionsAPI(api_url, username, password, cookie_location=cookie_location)
+        _HYP3_APIS[key] = hyp3
+    else:
+        print('Reusing HyP3 API client from a previous invocation')
+        hyp3.circuit_breaker.reset()
+    return hyp3
+
+
+def get_cached_earthdata_cookies(username: str, location: Optional[str]) -> Optional[list[dict]]:
+    """Returns the cached Earthdata session cookies for the user, or None if there are none or any have expired."""
+    cookies = _EARTHDATA_COOKIES.get(username)
+    if cookies is None and location:
+        state = load_state(location)
+        if state and state['username'] == username:
+            cookies = _EARTHDATA_COOKIES[username] = state['cookies']
+
+    if not cookies:
+        return None
+    expiry_threshold = time.time() + EARTHDATA_COOKIE_EXPIRY_MARGIN.total_seconds()
+    if any(cookie['expires'] is not None and cookie['expires'] < expiry_threshold for cookie in cookies):
+        return None
+    return cookies
+
+
+def cache_earthdata_cookies(
+        username: str, cookie_jar: requests.cookies.RequestsCookieJar, location: Optional[str]) -> None:
+    cookies = [
+        {'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+         'expires': cookie.expires}
+        for cookie in cookie_jar
+    ]
+    _EARTHDATA_COOKIES[username] = cookies
+    if location:
+        save_state(location, {'username': username, 'cookies': cookies})
+
+
+class PDCHazardsAPI:
+
+    def __init__(
+            self,
+            auth_token: str,
+            api_url: str = PDC_URL,
+            pool_size: int = PDC_MAX_CONCURRENT_REQUESTS,
+            timeout: tuple[float, float] = PDC_TIMEOUT,
+            max_retries: int = PDC_MAX_RETRIES):
+        self._url = api_url
+        self._session = self._get_pdc_api_session(auth_token, pool_size)
+        self._semaphore = threading.BoundedSemaphore(pool_size)
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.circuit_breaker = CircuitBreaker('PDC')
+        # Requests are not sent or retried, and their timeouts are capped, after this `time.monotonic()` deadline
+        self.deadline: Optional[float] = None
+
+    @staticmethod
+    def _get_pdc_api_session(auth_token: str, pool_size: int) -> requests.Session:
+        session = requests.Session()
+        session.headers['Authorization'] = f'Bearer {auth_token}'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @instrumented('get_active_hazards')
+    def iter_active_hazards(self) -> Iterator[dict]:
+        """Fetches the active hazards, parsing the response incrementally and yielding one hazard at a time."""
+        url = f'{self._url}/hp_srv/services/hazards/t/json/get_active_hazards'
+        with self._get(url, stream=True) as response:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            chunks = (
+                decoder.decode(chunk) for chunk in _count_bytes(response.iter_content(chunk_size=STREAM_CHUNK_SIZE))
+            )
+            yield from iter_json_array(chunks)
+
+    def get_aoi(self, hazard_id: int) -> str:
+        aoi, _ = self.get_aoi_if_modified(hazard_id, etag=None)
+        return aoi
+
+    @instrumented('get_aoi')
+    def get_aoi_if_modified(self, hazard_id: int, etag: Optional[str]) -> tuple[Optional[str], Optional[str]]:
+        """Returns the AOI and its ETag, or (None, etag) if the AOI has not changed since the given ETag."""
+        url = f'{self._url}/hp_srv/services/hazard/{hazard_id}/alertGeography'
+        response = self._get(url, headers={'If-None-Match': etag} if etag else None)
+        if etag and response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return response.json()['wkt']['text'], response.headers.get('ETag')
+
+    def _get(self, url: str, headers: Optional[dict] = None, stream: bool = False) -> requests.Response:
+        self.circuit_breaker.check()
+        for attempt in range(self._max_retries + 1):
+            try:
+                with self._semaphore:
+                    timeout = get_request_timeout(self._timeout, self.deadline)
+                    response = self._session.get(url, headers=headers, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self._get_backoff(attempt)
+                if attempt == self._max_retries or not self._can_retry_after(delay):
+                    self.circuit_breaker.record_failure()
+                    raise
+                print(f'Retrying {url} in {delay:.2f}s after error: {e}')
+            else:
+                delay = None
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    delay = _get_retry_after(response)
+                    if delay is None:
+                        delay = self._get_backoff(attempt)
+                    delay = min(delay, PDC_BACKOFF_MAX)
+                if delay is None or attempt == self._max_retries or not self._can_retry_after(delay):
+                    self.circuit_breaker.record_response(response)
+                    if not stream:
+                        METRICS.add_bytes(len(response.content))
+                    return response
+                print(f'Retrying {url} in {delay:.2f}s after HTTP {response.status_code}')
+                # Returns the connection of a streamed response to the pool
+                response.close()
+            with self._lock:
+                self.retries += 1
+            time.sleep(delay)
+        raise AssertionError('unreachable')
+
+    def _can_retry_after(self, delay: float) -> bool:
+        return self.deadline is None or time.monotonic() + delay < self.deadline
+
+    @staticmethod
+    def _get_backoff(attempt: int) -> float:
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(PDC_BACKOFF_MAX, PDC_BACKOFF_BASE * 2 ** attempt))
+
+
+def get_pdc_api(auth_token: str, api_url: str = PDC_URL) -> PDCHazardsAPI:
+    """Returns a PDC API client, reusing the client (and its connection pool) from a previous warm invocation."""
+    key = (auth_token, api_url)
+    pdc = _PDC_APIS.get(key)
+    if pdc is None:
+        pdc = PDCHazardsAPI(auth_token, api_url=api_url)
+        _PDC_APIS[key] = pdc
+    else:
+        print('Reusing PDC API client from a previous invocation')
+        pdc.circuit_breaker.reset()
+        pdc.retries = 0
+    return pdc
+
+
+def _count_bytes(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    for chunk in chunks:
+        METRICS.add_bytes(len(chunk))
+        yield chunk
+
+
+def _get_retry_after(response: requests.Response) -> Optional[float]:
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_datetime = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_datetime - datetime.now(tz=timezone.utc)).total_seconds(), 0.0)
+
+
+class AOICache:
+    """Cache of hazard AOIs, keyed by hazard ID and invalidated when the hazard's update date changes.
+
+    Entries are kept in memory and, if a location is given, persisted to a local JSON file or an
+    ``s3://bucket/key`` object between runs.
+    """
+
+    def __init__(self, location: Optional[str] = None):
+        self._location = location
+        self._entries: dict[str, dict] = (load_state(location) or {}) if location else {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+
+    def get_aoi(self, pdc: PDCHazardsAPI, hazard: dict) -> str:
+        key = str(hazard['hazard_ID'])
+        update_date = hazard.get('update_Date')
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and update_date is not None and entry['update_date'] == str(update_date):
+            with self._lock:
+                self.hits += 1
+            return entry['aoi']
+
+        aoi, etag = pdc.get_aoi_if_modified(hazard['hazard_ID'], etag=entry['etag'] if entry else None)
+        with self._lock:
+            if aoi is None:
+                self.not_modified += 1
+                aoi = entry['aoi']
+            else:
+                self.misses += 1
+            if update_date is not None:
+                self._entries[key] = {'update_date': str(update_date), 'aoi': aoi, 'etag': etag}
+        return aoi
+
+    def peek(self, hazard: dict) -> Optional[str]:
+        """Returns the cached AOI of the hazard if it is current for the hazard's update date, without fetching it."""
+        update_date = hazard.get('update_Date')
+        with self._lock:
+            entry = self._entries.get(str(hazard['hazard_ID']))
+        if entry and update_date is not None and entry['update_date'] == str(update_date):
+            return entry['aoi']
+        return None
+
+    def evict(self, active_hazard_ids: set[str]) -> int:
+        with self._lock:
+            inactive_keys = [key for key in self._entries if key not in active_hazard_ids]
+            for key in inactive_keys:
+                del self._entries[key]
+        return len(inactive_keys)
+
+    def save(self) -> None:
+        if self._location:
+            with self._lock:
+                save_state(self._location, self._entries)
+
+
+def get_aoi_cache(location: Optional[str]) -> AOICache:
+    global _AOI_CACHE
+    if _AOI_CACHE is None or _AOI_CACHE._location != location:
+        _AOI_CACHE = AOICache(location)
+    return _AOI_CACHE
+
+
+@dataclass(frozen=True)
+class HazardDelta:
+    new: list[dict]
+    changed: list[dict]
+    unchanged: list[dict]
+    disappeared: list[str]
+
+
+class HazardSnapshot:
+    """Compact record of the active hazards as of the last run: uuid -> start date, update date and the hash of the
+    AOI (as returned by the PDC API) last applied to the hazard's subscription.
+
+    If a location is given, the snapshot is persisted to a local JSON file or an ``s3://bucket/key`` object between
+    runs. Hazards that fail to process keep their previous entry, so that they are retried by the next run.
+    """
+
+    def __init__(self, location: Optional[str] = None):
+        self._location = location
+        self._entries: dict[str, dict] = (load_state(location) or {}) if location else {}
+        self._updates: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def diff(self, hazards: list[dict], aoi_cache: Optional[AOICache] = None) -> HazardDelta:
+        """Compares the hazards against the snapshot. A hazard whose dates are unchanged is still considered changed
+        if the AOI cache holds a different AOI for it than the AOI last applied.
+        """
+        delta = HazardDelta(new=[], changed=[], unchanged=[], disappeared=[])
+        for hazard in hazards:
+            entry = self._entries.get(hazard['uuid'])
+            if entry is None:
+                delta.new.append(hazard)
+            elif (entry['start_date'], entry['update_date']) != _get_snapshot_dates(hazard) or \
+                    self._aoi_changed(entry, hazard, aoi_cache):
+                delta.changed.append(hazard)
+            else:
+                delta.unchanged.append(hazard)
+        active_uuids = {hazard['uuid'] for hazard in hazards}
+        delta.disappeared.extend(uuid for uuid in self._entries if uuid not in active_uuids)
+        return delta
+
+    @staticmethod
+    def _aoi_changed(entry: dict, hazard: dict, aoi_cache: Optional[AOICache]) -> bool:
+        if aoi_cache is None or entry.get('aoi_hash') is None:
+            return False
+        cached_aoi = aoi_cache.peek(hazard)
+        return cached_aoi is not None and get_aoi_hash(cached_aoi) != entry['aoi_hash']
+
+    def record(self, hazard: dict, aoi: Optional[str]) -> None:
+        """Records the hazard and the AOI (as returned by the PDC API, if known) applied to its subscription."""
+        start_date, update_date = _get_snapshot_dates(hazard)
+        entry = {
+            'start_date': start_date,
+            'update_date': update_date,
+            'aoi_hash': get_aoi_hash(aoi) if aoi is not None else None,
+        }
+        with self._lock:
+            self._updates[hazard['uuid']] = entry
+
+    def get_updates(self) -> dict[str, dict]:
+        with self._lock:
+            return dict(self._updates)
+
+    def merge(self, updates: dict[str, dict]) -> None:
+        """Adds entries recorded by another snapshot, e.g. by a worker processing one shard of the run."""
+        with self._lock:
+            self._updates.update(updates)
+
+    def save(self, active_hazards: list[dict]) -> None:
+        with self._lock:
+            entries = {**self._entries, **self._updates}
+            self._entries = {
+                hazard['uuid']: entries[hazard['uuid']] for hazard in active_hazards if hazard['uuid'] in entries
+            }
+            self._updates = {}
+        if self._location:
+            save_state(self._location, self._entries)
+
+
+def get_aoi_hash(aoi: str) -> str:
+    return hashlib.sha1(aoi.encode()).hexdigest()
+
+
+def _get_snapshot_dates(hazard: dict) -> tuple[str, Optional[str]]:
+    update_date = hazard.get('update_Date')
+    return str(hazard['start_Date']), str(update_date) if update_date is not None else None
+
+
+def get_hazard_snapshot(location: Optional[str]) -> HazardSnapshot:
+    global _HAZARD_SNAPSHOT
+    if _HAZARD_SNAPSHOT is None or _HAZARD_SNAPSHOT._location != location:
+        _HAZARD_SNAPSHOT = HazardSnapshot(location)
+    return _HAZARD_SNAPSHOT
+
+
+@dataclass(frozen=True)
+class PreparedRun:
+    active_hazards: list[dict]
+    hazards_to_process: list[dict]
+    end: str
+    subscription_index: dict[str, list[dict]]
+    aoi_cache: AOICache
+    snapshot: HazardSnapshot
+    geometry: GeometryOptions
+    aois: Optional[dict[str, str]]
+
+
+def get_s3_client():
+    """Returns the S3 client shared by the state helpers, creating it on first use. boto3 clients are thread-safe once
+    created, but creating them is not, hence the lock.
+    """
+    global _S3_CLIENT
+    with _S3_CLIENT_LOCK:
+        if _S3_CLIENT is None:
+            import boto3
+            _S3_CLIENT = boto3.client('s3')
+    return _S3_CLIENT
+
+
+def load_state(location: str) -> Optional[dict]:
+    if location.startswith('s3://'):
+        bucket, _, key = location.removeprefix('s3://').partition('/')
+        s3 = get_s3_client()
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key)
+        except s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    if not os.path.exists(location):
+        return None
+    with open(location) as f:
+        return json.load(f)
+
+
+def save_state(location: str, state: dict) -> None:
+    if location.startswith('s3://'):
+        bucket, _, key = location.removeprefix('s3://').partition('/')
+        get_s3_client().put_object(Bucket=bucket, Key=key, Body=json.dumps(state).encode())
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+    tmp_location = f'{location}.tmp'
+    with open(tmp_location, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_location, location)
+
+
+def _list_locations(prefix: str) -> list[str]:
+    """Returns the local files or S3 objects under the given local directory or ``s3://bucket/prefix``."""
+    if prefix.startswith('s3://'):
+        bucket, _, key_prefix = prefix.removeprefix('s3://').partition('/')
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        return [
+            f's3://{bucket}/{obj["Key"]}'
+            for page in paginator.paginate(Bucket=bucket, Prefix=f'{key_prefix.rstrip("/")}/')
+            for obj in page.get('Contents', [])
+        ]
+    if not os.path.isdir(prefix):
+        return []
+    return sorted(os.path.join(prefix, name) for name in os.listdir(prefix))
+
+
+def _read_bytes(location: str) -> bytes:
+    if location.startswith('s3://'):
+        bucket, _, key = location.removeprefix('s3://').partition('/')
+        return get_s3_client().get_object(Bucket=bucket, Key=key)['Body'].read()
+    with open(location, 'rb') as f:
+        return f.read()
+
+
+def _write_bytes(location: str, data: bytes) -> None:
+    if location.startswith('s3://'):
+        bucket, _, key = location.removeprefix('s3://').partition('/')
+        get_s3_client().put_object(Bucket=bucket, Key=key, Body=data)
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+    with open(location, 'wb') as f:
+        f.write(data)
+
+
+def _delete_locations(locations: list[str]) -> None:
+    s3_keys: dict[str, list[str]] = {}
+    for location in locations:
+        if location.startswith('s3://'):
+            bucket, _, key = location.removeprefix('s3://').partition('/')
+            s3_keys.setdefault(bucket, []).append(key)
+        else:
+            os.remove(location)
+    for bucket, keys in s3_keys.items():
+        for start in range(0, len(keys), 1000):
+            get_s3_client().delete_objects(
+                Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True}
+            )
 
-def get_aoi(pdc_auth_token: str, hazard_id: int) -> str:
-    url = f'{PDC_URL}/hp_srv/services/hazard/{hazard_id}/alertGeography'
-    response = requests.get(url, headers={'Authorization': f'Bearer {pdc_auth_token}'})
-    response.raise_for_status()
-    return response.json()['wkt']['text']
 
+def get_history_partition(location: str, partition_date: date) -> str:
+    return f'{location.rstrip("/")}/date={partition_date.isoformat()}'
+
+
+def archive_run(
+        location: str,
+        run_time: datetime,
+        hazards: list[dict],
+        actions: dict[str, Optional[str]],
+        aoi_hashes: dict[str, str]) -> str:
+    """Appends one run's active hazards, and the action taken for each, to the hazard history archive.
+
+    The archive holds one gzipped, column-oriented JSON file per run, partitioned by date (see `HISTORY_COLUMNS`),
+    in a local directory or under an ``s3://bucket/prefix``; see `compact_history` for past days' partitions. Returns
+    the location of the new file.
+    """
+    run_time_str = str_from_datetime(run_time)
+    columns: dict[str, list] = {name: [] for name in HISTORY_COLUMNS}
+    for hazard in hazards:
+        row = {
+            **{name: hazard.get(name) for name in HISTORY_COLUMNS},
+            'run_time': run_time_str,
+            'action': actions.get(hazard['uuid']),
+            'aoi_hash': aoi_hashes.get(hazard['uuid']),
+        }
+        for name in HISTORY_COLUMNS:
+            columns[name].append(row[name])
+
+    run_location = f'{get_history_partition(location, run_time.date())}/run-{run_time.strftime("%H%M%S%f")}.json.gz'
+    _write_bytes(run_location, gzip.compress(json.dumps({'columns': columns}).encode()))
+    return run_location
+
+
+def compact_history(location: str, partition_date: date) -> Optional[str]:
+    """Combines the run files of one day's history partition into a single file, named `HISTORY_COMPACTED_NAME`, so
+    that reading the history takes one request per day rather than one per run. The compacted file lists the run files
+    it includes, so that run files left behind by an interrupted compaction are not read twice.
+
+    Returns the location of the compacted file, or None if there were no run files to compact.
+    """
+    partition = get_history_partition(location, partition_date)
+    compacted_location = f'{partition}/{HISTORY_COMPACTED_NAME}'
+    locations = _list_locations(partition)
+    compacted = {'runs': [], 'sources': []}
+    if compacted_location in locations:
+        compacted = _read_history_file(compacted_location)
+    run_locations = sorted(
+        run_location for run_location in locations
+        if run_location != compacted_location and os.path.basename(run_location) not in compacted['sources']
+    )
+    if run_locations:
+        compacted['runs'].extend(_read_history_file(run_location)['columns'] for run_location in run_locations)
+        compacted['sources'].extend(os.path.basename(run_location) for run_location in run_locations)
+        _write_bytes(compacted_location, gzip.compress(json.dumps(compacted).encode()))
+    stale_locations = [run_location for run_location in locations if run_location != compacted_location]
+    _delete_locations(stale_locations)
+    return compacted_location if run_locations else None
+
+
+def _read_history_file(location: str) -> dict:
+    return json.loads(gzip.decompress(_read_bytes(location)))
+
+
+def iter_history(
+        location: str, start_date: date, end_date: date, max_workers: int = MAX_WORKERS) -> Iterator[dict[str, list]]:
+    """Yields the columns of each archived run from `start_date` to `end_date` (inclusive), in order.
+
+    Compacted partitions (see `compact_history`) are read with one request each, and the files are read concurrently.
+    """
+    history_locations = []
+    partition_date = start_date
+    while partition_date <= end_date:
+        # The compacted file comes first, so that its runs precede any runs archived after the compaction
+        history_locations.extend(sorted(
+            _list_locations(get_history_partition(location, partition_date)),
+            key=lambda history_location: (not history_location.endswith(f'/{HISTORY_COMPACTED_NAME}'),
+                                          history_location),
+        ))
+        partition_date += timedelta(days=1)
+
+    if location.startswith('s3://'):
+        # Create the client before starting the threads, rather than in each of them
+        get_s3_client()
+
+    compacted_sources: set[str] = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for history_location, history_file in zip(
+                history_locations, executor.map(_read_history_file, history_locations)):
+            if 'runs' in history_file:
+                compacted_sources.update(history_file['sources'])
+                yield from history_file['runs']
+            elif os.path.basename(history_location) not in compacted_sources:
+                yield history_file['columns']
+
+
+def summarize_history(location: str, start_date: date, end_date: date) -> dict:
+    """Answers common questions about hazard churn from the hazard history archive: how long hazards stay active,
+    how often their AOIs change, and how many subscriptions are created per day.
+    """
+    first_seen: dict[str, str] = {}
+    last_seen: dict[str, str] = {}
+    aoi_hashes: dict[str, str] = {}
+    aoi_changes: dict[str, int] = {}
+    runs = 0
+    submitted_per_day: dict[str, int] = {}
+
+    for columns in iter_history(location, start_date, end_date):
+        runs += 1
+        for run_time, uuid, action, aoi_hash in zip(
+                columns['run_time'], columns['uuid'], columns['action'], columns['aoi_hash']):
+            first_seen.setdefault(uuid, run_time)
+            last_seen[uuid] = run_time
+            if aoi_hash is not None:
+                if uuid in aoi_hashes and aoi_hashes[uuid] != aoi_hash:
+                    aoi_changes[uuid] = aoi_changes.get(uuid, 0) + 1
+                aoi_hashes[uuid] = aoi_hash
+            if action == 'submitted':
+                day = run_time[:10]
+                submitted_per_day[day] = submitted_per_day.get(day, 0) + 1
+
+    active_hours = sorted(
+        (datetime_from_str(last_seen[uuid]) - datetime_from_str(first_seen[uuid])).total_seconds() / 3600
+        for uuid in first_seen
+    )
+    return {
+        'runs': runs,
+        'hazards': len(first_seen),
+        'active_hours_median': active_hours[len(active_hours) // 2] if active_hours else None,
+        'active_hours_max': active_hours[-1] if active_hours else None,
+        'hazards_with_aoi_changes': len(aoi_changes),
+        'aoi_changes': sum(aoi_changes.values()),
+        'subscriptions_submitted_per_day': dict(sorted(submitted_per_day.items())),
+    }
+
+
+Point = tuple[float, float]
+Ring = list[Point]
+Polygon = list[Ring]
+
+_WKT_TOKEN = re.compile(r'\(|\)|,|[^\s(),]+')
+
+
+def parse_wkt(wkt: str) -> list[Polygon]:
+    """Parses a POLYGON or MULTIPOLYGON WKT string into a list of polygons, each a list of rings (exterior first).
+
+    Rings are returned without the closing vertex.
+    """
+    geometry_type, paren, body = wkt.strip().partition('(')
+    geometry_type = geometry_type.strip().upper()
+    if geometry_type not in ('POLYGON', 'MULTIPOLYGON') or not paren:
+        raise InvalidGeometry(f'Unsupported geometry: {wkt[:50]}')
+
+    stack: list[list] = [[]]
+    coordinates: list[float] = []
+    for token in _WKT_TOKEN.findall(paren + body):
+        if token == '(':
+            stack.append([])
+        elif token in (',', ')'):
+            if coordinates:
+                if len(coordinates) != 2:
+                    raise InvalidGeometry(f'Expected 2 coordinates per vertex, got {len(coordinates)}')
+                stack[-1].append((coordinates[0], coordinates[1]))
+                coordinates = []
+            if token == ')':
+                if len(stack) < 2:
+                    raise InvalidGeometry('Unbalanced parentheses')
+                nested = stack.pop()
+                stack[-1].append(nested)
+        else:
+            try:
+                coordinates.append(float(token))
+            except ValueError:
+                raise InvalidGeometry(f'Invalid coordinate: {token}')
+
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise InvalidGeometry('Unbalanced parentheses')
+    polygons = [stack[0][0]] if geometry_type == 'POLYGON' else stack[0][0]
+    try:
+        return [[_open_ring(ring) for ring in polygon] for polygon in polygons]
+    except (TypeError, ValueError):
+        raise InvalidGeometry(f'Invalid {geometry_type} structure')
+
+
+def _open_ring(ring: Ring) -> Ring:
+    ring = [(float(x), float(y)) for x, y in ring]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring = ring[:-1]
+    return ring
+
+
+def to_wkt(polygons: list[Polygon]) -> str:
+    def ring_wkt(ring: Ring) -> str:
+        return '(' + ', '.join(f'{x!r} {y!r}' for x, y in ring + ring[:1]) + ')'
+
+    def polygon_wkt(polygon: Polygon) -> str:
+        return '(' + ', '.join(ring_wkt(ring) for ring in polygon) + ')'
+
+    if len(polygons) == 1:
+        return 'POLYGON ' + polygon_wkt(polygons[0])
+    return 'MULTIPOLYGON (' + ', '.join(polygon_wkt(polygon) for polygon in polygons) + ')'
+
+
+def normalize_polygons(polygons: list[Polygon], precision: int = AOI_PRECISION) -> list[Polygon]:
+    """Rounds coordinates and puts rings and polygons in a canonical order, so that equal geometries compare equal.
+
+    Exterior rings are oriented counter-clockwise and holes clockwise, each ring starts at its minimum vertex, and
+    polygons are sorted by their exterior ring.
+    """
+    def normalize_ring(ring: Ring, counter_clockwise: bool) -> Ring:
+        rounded: Ring = []
+        for x, y in ring:
+            point = (round(x, precision) + 0.0, round(y, precision) + 0.0)
+            if not rounded or rounded[-1] != point:
+                rounded.append(point)
+        if len(rounded) > 1 and rounded[0] == rounded[-1]:
+            rounded.pop()
+        area = _signed_area(rounded)
+        if area != 0 and (area > 0) != counter_clockwise:
+            rounded.reverse()
+        if rounded:
+            start = rounded.index(min(rounded))
+            rounded = rounded[start:] + rounded[:start]
+        return rounded
+
+    normalized = [
+        [normalize_ring(polygon[0], counter_clockwise=True)]
+        + sorted(normalize_ring(hole, counter_clockwise=False) for hole in polygon[1:])
+        for polygon in polygons
+    ]
+    return sorted(normalized)
+
+
+def normalize_wkt(wkt: str, precision: int = AOI_PRECISION) -> str:
+    return to_wkt(normalize_polygons(parse_wkt(wkt), precision))
+
+
+def aois_equal(aoi1: str, aoi2: str, tolerance: float = AOI_TOLERANCE) -> bool:
+    """Compares two AOIs by the Hausdorff distance between their boundaries and by their areas, falling back to
+    string comparison for invalid WKT.
+
+    Each vertex of one AOI, and `AOI_EDGE_SAMPLES` points along each of its boundary segments, must be within
+    `tolerance` of the other AOI's boundary, and vice versa. The areas must also differ by no more than a band of width
+    `tolerance` along both boundaries, which rejects AOIs with the same boundary points but different interiors (e.g. a
+    square and a bow-tie with the same vertices). The comparison does not depend on the starting vertex, orientation or
+    ring order, nor on redundant collinear vertices.
+    """
+    try:
+        polygons1 = parse_wkt(aoi1)
+        polygons2 = parse_wkt(aoi2)
+    except InvalidGeometry:
+        return aoi1 == aoi2
+    segments1, segments2 = _get_segments(polygons1), _get_segments(polygons2)
+    perimeter = sum(math.dist(*segment) for segment in segments1 + segments2)
+    return (
+        abs(_get_area(polygons1) - _get_area(polygons2)) <= tolerance * perimeter
+        and _within_distance(segments1, segments2, tolerance)
+        and _within_distance(segments2, segments1, tolerance)
+    )
 
-def get_active_hazards(pdc_auth_token: str) -> list[dict]:
-    url = f'{PDC_URL}/hp_srv/services/hazards/t/json/get_active_hazards'
-    response = requests.get(url, headers={'Authorization': f'Bearer {pdc_auth_token}'})
-    response.raise_for_status()
-    return response.json()
 
+Segment = tuple[Point, Point]
 
-def filter_hazards(hazards: list[dict], current_time_in_ms: int) -> list[dict]:
-    return [hazard for hazard in hazards if is_valid_hazard(hazard, current_time_in_ms)]
+
+def _get_segments(polygons: list[Polygon]) -> list[Segment]:
+    return [
+        (point1, point2)
+        for polygon in polygons for ring in polygon for point1, point2 in zip(ring, ring[1:] + ring[:1])
+    ]
+
+
+def _get_area(polygons: list[Polygon]) -> float:
+    return sum(
+        abs(_signed_area(polygon[0])) - sum(abs(_signed_area(hole)) for hole in polygon[1:]) for polygon in polygons
+    )
+
+
+def _within_distance(segments: list[Segment], other_segments: list[Segment], tolerance: float) -> bool:
+    tree = STRtree([
+        (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)) for (x1, y1), (x2, y2) in other_segments
+    ])
+    for (x1, y1), (x2, y2) in segments:
+        for i in range(AOI_EDGE_SAMPLES + 1):
+            t = i / (AOI_EDGE_SAMPLES + 1)
+            x, y = x1 + t * (x2 - x1), y1 + t * (y2 - y1)
+            candidates = tree.query((x - tolerance, y - tolerance, x + tolerance, y + tolerance))
+            if not any(_segment_distance((x, y), *other_segments[j]) <= tolerance for j in candidates):
+                return False
+    return True
+
+
+def _segment_distance(point: Point, start: Point, end: Point) -> float:
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    length_squared = dx * dx + dy * dy
+    t = 0.0 if length_squared == 0 else max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length_squared))
+    return math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+
+
+def simplify_polygons(
+        polygons: list[Polygon], max_vertices: Optional[int] = None, max_bytes: Optional[int] = None) -> list[Polygon]:
+    """Reduces the number of vertices until the geometry fits the given budgets, without reducing its coverage.
+
+    Each step covers the previous one: holes are dropped, then each polygon is replaced by its convex hull (unless any
+    two of the hulls would touch or overlap, which is not a valid MULTIPOLYGON), then all polygons are replaced by a
+    single convex hull, and finally by their bounding box.
+    """
+    def fits(candidate: list[Polygon]) -> bool:
+        return (
+            (max_vertices is None or count_vertices(candidate) <= max_vertices)
+            and (max_bytes is None or len(to_wkt(candidate)) <= max_bytes)
+        )
+
+    if fits(polygons):
+        return polygons
+
+    candidate = [polygon[:1] for polygon in polygons]
+    if fits(candidate):
+        return candidate
+
+    candidate = [[convex_hull(polygon[0])] for polygon in polygons]
+    if fits(candidate) and not any(
+            _convex_rings_intersect(candidate[i][0], candidate[j][0])
+            for i in range(len(candidate)) for j in range(i + 1, len(candidate))):
+        return candidate
+
+    points = [point for polygon in polygons for point in polygon[0]]
+    candidate = [[convex_hull(points)]]
+    if fits(candidate):
+        return candidate
+
+    xs, ys = [x for x, _ in points], [y for _, y in points]
+    return [[[(min(xs), min(ys)), (max(xs), min(ys)), (max(xs), max(ys)), (min(xs), max(ys))]]]
+
+
+def prepare_aoi(aoi: str, options: GeometryOptions) -> str:
+    """Normalizes the AOI and simplifies it to the configured budgets, returning it unchanged if it cannot be parsed."""
+    try:
+        polygons = normalize_polygons(parse_wkt(aoi))
+    except InvalidGeometry as e:
+        print(f'Not normalizing AOI: {e}')
+        return aoi
+    vertices = count_vertices(polygons)
+    polygons = simplify_polygons(polygons, options.max_vertices, options.max_bytes)
+    if count_vertices(polygons) != vertices:
+        print(f'Simplified AOI from {vertices} to {count_vertices(polygons)} vertices')
+    return to_wkt(polygons)
+
+
+def count_vertices(polygons: list[Polygon]) -> int:
+    return sum(len(ring) for polygon in polygons for ring in polygon)
+
+
+def convex_hull(points: list[Point]) -> Ring:
+    """Returns the convex hull of the points in counter-clockwise order (Andrew's monotone chain)."""
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+
+    def cross(o: Point, a: Point, b: Point) -> float:
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower: Ring = []
+    for point in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+    upper: Ring = []
+    for point in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], point) <= 0:
+            upper.pop()
+        upper.append(point)
+    return lower[:-1] + upper[:-1]
+
+
+def _convex_rings_intersect(ring1: Ring, ring2: Ring) -> bool:
+    """Returns whether two convex rings touch or overlap, i.e. no edge normal of either ring separates them."""
+    for ring in (ring1, ring2):
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            normal = (y1 - y2, x2 - x1)
+            projections1 = [normal[0] * x + normal[1] * y for x, y in ring1]
+            projections2 = [normal[0] * x + normal[1] * y for x, y in ring2]
+            if max(projections1) < min(projections2) or max(projections2) < min(projections1):
+                return False
+    return True
+
+
+def _signed_area(ring: Ring) -> float:
+    return sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1])) / 2
+
+
+BBox = tuple[float, float, float, float]
+
+
+def get_bbox(polygons: list[Polygon]) -> BBox:
+    xs = [x for polygon in polygons for x, _ in polygon[0]]
+    ys = [y for polygon in polygons for _, y in polygon[0]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def bboxes_intersect(bbox1: BBox, bbox2: BBox) -> bool:
+    return bbox1[0] <= bbox2[2] and bbox2[0] <= bbox1[2] and bbox1[1] <= bbox2[3] and bbox2[1] <= bbox1[3]
+
+
+class STRtree:
+    """Sort-Tile-Recursive packed R-tree for querying which bounding boxes intersect a given bounding box."""
+
+    def __init__(self, bboxes: list[BBox], node_capacity: int = 10):
+        self._node_capacity = node_capacity
+        nodes: list[tuple[BBox, list]] = [(bbox, [i]) for i, bbox in enumerate(bboxes)]
+        self._leaf_count = len(nodes)
+        self._levels = [nodes]
+        while len(nodes) > 1:
+            nodes = self._pack(nodes)
+            self._levels.append(nodes)
+
+    def _pack(self, nodes: list[tuple[BBox, list]]) -> list[tuple[BBox, list]]:
+        node_count = math.ceil(len(nodes) / self._node_capacity)
+        slice_count = math.ceil(math.sqrt(node_count))
+        slice_size = slice_count * self._node_capacity
+
+        def center(node: tuple[BBox, list], axis: int) -> float:
+            return (node[0][axis] + node[0][axis + 2]) / 2
+
+        by_x = sorted(range(len(nodes)), key=lambda i: center(nodes[i], 0))
+        packed = []
+        for slice_start in range(0, len(by_x), slice_size):
+            by_y = sorted(by_x[slice_start:slice_start + slice_size], key=lambda i: center(nodes[i], 1))
+            for start in range(0, len(by_y), self._node_capacity):
+                children = by_y[start:start + self._node_capacity]
+                child_bboxes = [nodes[i][0] for i in children]
+                bbox = (
+                    min(b[0] for b in child_bboxes), min(b[1] for b in child_bboxes),
+                    max(b[2] for b in child_bboxes), max(b[3] for b in child_bboxes),
+                )
+                packed.append((bbox, children))
+        return packed
+
+    def query(self, bbox: BBox) -> list[int]:
+        if not self._leaf_count:
+            return []
+        candidates = [0]
+        for level in range(len(self._levels) - 1, 0, -1):
+            nodes = self._levels[level]
+            candidates = [
+                child for i in candidates if bboxes_intersect(nodes[i][0], bbox) for child in nodes[i][1]
+            ]
+        leaves = self._levels[0]
+        return sorted(i for i in candidates if bboxes_intersect(leaves[i][0], bbox))
+
+
+def point_in_polygons(point: Point, polygons: list[Polygon]) -> bool:
+    return any(
+        _point_in_ring(point, polygon[0]) and not any(_point_in_ring(point, hole) for hole in polygon[1:])
+        for polygon in polygons
+    )
+
+
+def _point_in_ring(point: Point, ring: Ring) -> bool:
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+def covered_fraction(
+        polygons: list[Polygon], other_polygons: list[Polygon], samples: int = DEDUPLICATION_SAMPLES) -> float:
+    """Estimates the fraction of `polygons` covered by `other_polygons` by sampling a regular grid of points."""
+    min_x, min_y, max_x, max_y = get_bbox(polygons)
+    points = [
+        (min_x + (max_x - min_x) * (i + 0.5) / samples, min_y + (max_y - min_y) * (j + 0.5) / samples)
+        for i in range(samples) for j in range(samples)
+    ]
+    inside = [point for point in points if point_in_polygons(point, polygons)]
+    if not inside:
+        return 0.0
+    return sum(point_in_polygons(point, other_polygons) for point in inside) / len(inside)
+
+
+def deduplicate_hazards(
+        hazards: list[dict],
+        aois: dict[str, str],
+        mode: str,
+        threshold: float = DEDUPLICATION_OVERLAP_THRESHOLD,
+        max_growth: float = DEDUPLICATION_MERGE_MAX_GROWTH) -> tuple[list[dict], dict[str, str], dict[str, str]]:
+    """Finds hazards whose AOI is mostly covered by another hazard's AOI.
+
+    Hazards are considered from largest to smallest AOI, and each hazard that is at least `threshold` covered by a
+    larger, non-redundant hazard is removed. In ``merge`` mode, if the hazards it covers are not entirely covered, the
+    covering hazard's AOI is replaced by the convex hull of its AOI and theirs, which is a single valid polygon that
+    covers all of them, unless that grows its area by more than `max_growth` (e.g. for a concave AOI such as a river
+    corridor). Otherwise, the covering hazard's AOI is kept unchanged.
+
+    Returns the remaining hazards (in their original order), the possibly merged AOIs, and a mapping from each
+    removed hazard's uuid to the uuid of the hazard that covers it.
+    """
+    assert mode in ('skip', 'merge')
+    geometries = {}
+    for hazard in hazards:
+        try:
+            geometries[hazard['uuid']] = parse_wkt(aois[hazard['uuid']])
+        except (KeyError, InvalidGeometry):
+            continue
+
+    uuids = list(geometries)
+    bboxes = [get_bbox(geometries[uuid]) for uuid in uuids]
+    tree = STRtree(bboxes)
+
+    def area(i: int) -> float:
+        return sum(abs(_signed_area(polygon[0])) for polygon in geometries[uuids[i]])
+
+    kept: set[int] = set()
+    covered_by: dict[str, str] = {}
+    partially_covered: set[str] = set()
+    for i in sorted(range(len(uuids)), key=area, reverse=True):
+        for j in tree.query(bboxes[i]):
+            if j not in kept:
+                continue
+            fraction = covered_fraction(geometries[uuids[i]], geometries[uuids[j]])
+            if fraction >= threshold:
+                covered_by[uuids[i]] = uuids[j]
+                if fraction < 1:
+                    partially_covered.add(uuids[i])
+                break
+        else:
+            kept.add(i)
+
+    merged_aois = dict(aois)
+    if mode == 'merge':
+        merged: dict[str, list[Point]] = {}
+        for uuid, covering_uuid in covered_by.items():
+            if uuid not in partially_covered:
+                continue
+            points = merged.setdefault(
+                covering_uuid, [point for polygon in geometries[covering_uuid] for point in polygon[0]]
+            )
+            points.extend(point for polygon in geometries[uuid] for point in polygon[0])
+        for uuid, points in merged.items():
+            hull = convex_hull(points)
+            growth = abs(_signed_area(hull)) / _get_area(geometries[uuid]) - 1
+            if growth > max_growth:
+                print(f'Not merging AOIs into hazard {uuid}, which would grow its area by {growth:.0%}')
+                continue
+            merged_aois[uuid] = to_wkt(normalize_polygons([[hull]]))
+
+    return [hazard for hazard in hazards if hazard['uuid'] not in covered_by], merged_aois, covered_by
+
+
+def fetch_aois(
+        pdc: PDCHazardsAPI,
+        hazards: list[dict],
+        aoi_cache: Optional[AOICache],
+        geometry: Optional[GeometryOptions],
+        max_workers: int = 1) -> dict[str, str]:
+    """Fetches the AOI for each hazard, omitting hazards whose AOI could not be fetched."""
+    def fetch(hazard: dict) -> Optional[str]:
+        try:
+            aoi = aoi_cache.get_aoi(pdc, hazard) if aoi_cache is not None else pdc.get_aoi(hazard['hazard_ID'])
+        except (requests.RequestException, CircuitOpen, DeadlineExceeded) as e:
+            print(f'Error while fetching AOI for hazard {hazard["uuid"]}: {e}')
+            return None
+        return prepare_aoi(aoi, geometry) if geometry is not None else aoi
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        aois = list(executor.map(fetch, hazards))
+    return {hazard['uuid']: aoi for hazard, aoi in zip(hazards, aois) if aoi is not None}
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """Yields the elements of a JSON array as they are parsed from the given chunks of text."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError(f'Expected a JSON array, got {buffer[pos:pos + 20]!r}')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element is incomplete, so wait for the next chunk
+                break
+            if end == len(buffer) and not isinstance(value, (dict, list)):
+                # A number could continue in the next chunk
+                break
+            yield value
+            pos = end
+        buffer = buffer[pos:]
+    raise ValueError('Unexpected end of JSON array')
+
+
+def fetch_active_hazards(pdc: PDCHazardsAPI, current_time_in_ms: int) -> list[dict]:
+    """Streams the active hazards, keeping only the `HAZARD_FIELDS` of the valid hazards."""
+    hazard_count = 0
+    active_hazards = []
+    for hazard in pdc.iter_active_hazards():
+        hazard_count += 1
+        if is_valid_hazard(hazard, current_time_in_ms):
+            active_hazards.append({field: hazard[field] for field in HAZARD_FIELDS if field in hazard})
+    print(f'Active hazards (before filtering): {hazard_count}')
+    print(f'Active hazards (after filtering): {len(active_hazards)}')
+    return active_hazards
 
 
 def is_valid_hazard(hazard: dict, current_time_in_ms: int) -> bool:
@@ -89,62 +1552,367 @@ def is_valid_hazard(hazard: dict, current_time_in_ms: int) -> bool:
     )
 
 
-def get_existing_subscription(hyp3: HyP3SubscriptionsAPI, name: str) -> Optional[dict]:
-    response = hyp3.get_subscriptions_by_name(name)
-    subscriptions = response['subscriptions']
+def get_subscription_index(hyp3: HyP3SubscriptionsAPI) -> dict[str, list[dict]]:
+    subscription_index: dict[str, list[dict]] = {}
+    for subscription in hyp3.get_all_subscriptions():
+        name = subscription['job_specification']['name']
+        if name.startswith(SUBSCRIPTION_NAME_PREFIX):
+            subscription_index.setdefault(name, []).append(subscription)
+    return subscription_index
+
+
+def get_existing_subscription(
+        hyp3: HyP3SubscriptionsAPI,
+        name: str,
+        subscription_index: Optional[dict[str, list[dict]]] = None) -> Optional[dict]:
+    if subscription_index is not None:
+        subscriptions = subscription_index.get(name, [])
+    else:
+        subscriptions = hyp3.get_subscriptions_by_name(name)['subscriptions']
     if len(subscriptions) > 1:
+        # Duplicates disabled by resolve_duplicate_subscriptions are ignored
+        enabled_subscriptions = [subscription for subscription in subscriptions if subscription.get('enabled')]
+        if len(enabled_subscriptions) == 1:
+            return enabled_subscriptions[0]
         raise DuplicateSubscriptionNames(f'Got {len(subscriptions)} subscriptions with name {name} (expected 0 or 1)')
     return subscriptions[0] if subscriptions else None
 
 
+def resolve_duplicate_subscriptions(hyp3: HyP3SubscriptionsAPI, name: str, dry_run: bool) -> dict:
+    """Keeps the oldest subscription with the given name and disables the others.
+
+    Duplicates arise when the periodic sweep and the event handler submit a subscription for the same new hazard at
+    the same time. Every caller picks the same subscription to keep, so concurrent callers agree.
+    """
+    subscriptions = hyp3.get_subscriptions_by_name(name)['subscriptions']
+    keep = min(subscriptions, key=lambda subscription: (subscription['creation_date'], subscription['subscription_id']))
+    for subscription in subscriptions:
+        if subscription is not keep and subscription['enabled']:
+            print(f'Disabling duplicate subscription {subscription["subscription_id"]} with name {name}')
+            if not dry_run:
+                hyp3.update_subscription(subscription_id=subscription['subscription_id'], enabled=False)
+    return keep
+
+
+def find_stale_subscriptions(
+        subscription_index: dict[str, list[dict]],
+        active_hazards: list[dict],
+        now: datetime,
+        grace_period: timedelta = SWEEP_GRACE_PERIOD) -> list[dict]:
+    """Returns the enabled subscriptions whose hazard is no longer active and whose end datetime is at least
+    `grace_period` in the past, oldest end datetime first.
+    """
+    active_names = {subscription_name_from_hazard_uuid(hazard['uuid']) for hazard in active_hazards}
+    stale_subscriptions = [
+        subscription
+        for name, subscriptions in subscription_index.items() if name not in active_names
+        for subscription in subscriptions
+        if subscription['enabled']
+        and datetime_from_str(subscription['search_parameters']['end']) <= now - grace_period
+    ]
+    return sorted(stale_subscriptions, key=lambda subscription: subscription['search_parameters']['end'])
+
+
+def sweep_subscriptions(
+        hyp3: HyP3SubscriptionsAPI,
+        subscription_index: dict[str, list[dict]],
+        active_hazards: list[dict],
+        now: datetime,
+        dry_run: bool,
+        batch_size: int = SWEEP_BATCH_SIZE,
+        max_workers: int = 1) -> dict:
+    """Disables up to `batch_size` stale subscriptions (see `find_stale_subscriptions`) concurrently, and returns a
+    report. In a dry run, the report lists the subscriptions that would have been disabled.
+    """
+    stale_subscriptions = find_stale_subscriptions(subscription_index, active_hazards, now)
+    batch = stale_subscriptions[:batch_size]
+
+    def disable(subscription: dict) -> Optional[Exception]:
+        if dry_run:
+            return None
+        try:
+            hyp3.update_subscription(subscription_id=subscription['subscription_id'], enabled=False)
+        except (requests.RequestException, CircuitOpen, DeadlineExceeded) as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = list(executor.map(disable, batch))
+
+    report = {
+        'stale': len(stale_subscriptions),
+        'deferred': len(stale_subscriptions) - len(batch),
+        'disabled': [],
+        'errors': {},
+    }
+    for subscription, error in zip(batch, errors):
+        subscription_id = subscription['subscription_id']
+        name = subscription['job_specification']['name']
+        if error is None:
+            report['disabled'].append(subscription_id)
+            print(f'{"Would disable" if dry_run else "Disabled"} subscription {subscription_id} with name {name} '
+                  f'(ended {subscription["search_parameters"]["end"]})')
+        else:
+            report['errors'][subscription_id] = str(error)
+            print(f'Error while disabling subscription {subscription_id}: {error}')
+
+    print(
+        f'Stale subscriptions: {report["stale"]} ({len(report["disabled"])} '
+        f'{"would be disabled" if dry_run else "disabled"}, {len(report["errors"])} errors, '
+        f'{report["deferred"]} deferred to the next run)'
+    )
+    return report
+
+
+def prioritize_hazards(
+        hazards: list[dict], subscription_index: dict[str, list[dict]], checkpoint: set[str]) -> list[dict]:
+    """Orders hazards by urgency, so that the most urgent work is done first if the run does not finish.
+
+    Hazards left unfinished by the previous run (the checkpoint) come first, then hazards without a subscription, then
+    hazards whose subscription is closest to expiring. The original order is otherwise preserved.
+    """
+    def priority(hazard: dict) -> tuple[bool, bool, datetime]:
+        subscriptions = subscription_index.get(subscription_name_from_hazard_uuid(hazard['uuid']))
+        if subscriptions:
+            end = datetime_from_str(subscriptions[0]['search_parameters']['end'])
+        else:
+            end = datetime.min.replace(tzinfo=timezone.utc)
+        return hazard['uuid'] not in checkpoint, bool(subscriptions), end
+
+    return sorted(hazards, key=priority)
+
+
+def select_hazards_to_process(
+        hazards: list[dict],
+        delta: HazardDelta,
+        subscription_index: dict[str, list[dict]],
+        end: str,
+        end_date_refresh: timedelta) -> list[dict]:
+    """Selects new and changed hazards, plus unchanged hazards whose subscription is missing or due for extension."""
+    def is_due(hazard: dict) -> bool:
+        subscriptions = subscription_index.get(subscription_name_from_hazard_uuid(hazard['uuid']))
+        return not subscriptions or any(
+            subscription_is_due(subscription, end, end_date_refresh) for subscription in subscriptions
+        )
+
+    unchanged_uuids = {hazard['uuid'] for hazard in delta.unchanged}
+    return [hazard for hazard in hazards if hazard['uuid'] not in unchanged_uuids or is_due(hazard)]
+
+
+def load_checkpoint(location: str) -> set[str]:
+    checkpoint = load_state(location)
+    return set(checkpoint['unfinished']) if checkpoint else set()
+
+
+def save_checkpoint(location: str, unfinished: list[str]) -> None:
+    save_state(location, {'unfinished': unfinished})
+
+
 def process_active_hazards(
-        pdc_auth_token: str,
+        pdc: PDCHazardsAPI,
         hyp3: HyP3SubscriptionsAPI,
         active_hazards: list[dict],
         end: str,
-        dry_run: bool) -> None:
-    for count, hazard in enumerate(active_hazards, start=1):
-        print(f'({count}/{len(active_hazards)}) Processing hazard {hazard["uuid"]}')
-        try:
-            process_active_hazard(pdc_auth_token, hyp3, hazard, end, dry_run=dry_run)
-        except (requests.HTTPError, DuplicateSubscriptionNames) as e:
-            print(f'Error while processing hazard {hazard["uuid"]}: {e}')
+        dry_run: bool,
+        max_workers: int = 1,
+        subscription_index: Optional[dict[str, list[dict]]] = None,
+        aoi_cache: Optional[AOICache] = None,
+        end_date_refresh: Optional[timedelta] = None,
+        deadline: Optional[float] = None,
+        snapshot: Optional[HazardSnapshot] = None,
+        geometry: Optional[GeometryOptions] = None,
+        aois: Optional[dict[str, str]] = None,
+        resolve_duplicates: bool = False) -> list[HazardResult]:
+    """Processes each hazard, skipping any hazards not yet started by the `deadline` (in `time.monotonic()` seconds)
+    and failing fast once an upstream API's circuit breaker opens.
+    """
+    def process(hazard: dict) -> str:
+        return process_active_hazard(
+            pdc,
+            hyp3,
+            hazard,
+            end,
+            dry_run=dry_run,
+            subscription_index=subscription_index,
+            aoi_cache=aoi_cache,
+            end_date_refresh=end_date_refresh,
+            snapshot=snapshot,
+            geometry=geometry,
+            aoi=aois.get(hazard['uuid']) if aois is not None else None,
+            resolve_duplicates=resolve_duplicates,
+        )
+
+    # Hazards are independent of each other, so they are processed concurrently. Results are returned in the same
+    # order as the input hazards, and an error for one hazard does not affect any of the others.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _process_active_hazard_isolated, f'({count}/{len(active_hazards)})', hazard, process, deadline
+            )
+            for count, hazard in enumerate(active_hazards, start=1)
+        ]
+        results = [future.result() for future in futures]
+
+    errors = [result for result in results if result.error is not None]
+    print(f'Processed {len(results)} hazards with {len(errors)} errors')
+    for result in errors:
+        print(f'Error while processing hazard {result.uuid}: {result.error}')
+
+    skipped_updates = sum(result.action == 'unchanged' for result in results)
+    print(f'Skipped {skipped_updates} redundant subscription updates')
+
+    skipped = [result.uuid for result in results if result.unfinished]
+    if skipped:
+        print(f'Skipped {len(skipped)} hazards due to the deadline or an open circuit breaker: {", ".join(skipped)}')
+
+    return results
+
+
+def _process_active_hazard_isolated(
+        progress: str, hazard: dict, process: Callable[[dict], str], deadline: Optional[float]) -> HazardResult:
+    if deadline is not None and time.monotonic() >= deadline:
+        return HazardResult(hazard['uuid'], action='skipped')
+    print(f'{progress} Processing hazard {hazard["uuid"]}')
+    try:
+        action = process(hazard)
+    except (requests.RequestException, DuplicateSubscriptionNames, CircuitOpen, DeadlineExceeded) as e:
+        print(f'Error while processing hazard {hazard["uuid"]}: {e}')
+        return HazardResult(hazard['uuid'], error=e)
+    return HazardResult(hazard['uuid'], action=action)
 
 
 def process_active_hazard(
-        pdc_auth_token: str,
+        pdc: PDCHazardsAPI,
         hyp3: HyP3SubscriptionsAPI,
         hazard: dict,
         end: str,
-        dry_run: bool) -> None:
+        dry_run: bool,
+        subscription_index: Optional[dict[str, list[dict]]] = None,
+        aoi_cache: Optional[AOICache] = None,
+        end_date_refresh: Optional[timedelta] = None,
+        snapshot: Optional[HazardSnapshot] = None,
+        geometry: Optional[GeometryOptions] = None,
+        aoi: Optional[str] = None,
+        resolve_duplicates: bool = False) -> str:
     name = subscription_name_from_hazard_uuid(hazard['uuid'])
     start = get_start_datetime_str(int(hazard['start_Date']))
 
-    print(f'Fetching AOI for hazard ID: {hazard["hazard_ID"]}')
-    aoi = get_aoi(pdc_auth_token, hazard['hazard_ID'])
+    if aoi is None:
+        print(f'Fetching AOI for hazard ID: {hazard["hazard_ID"]}')
+        if aoi_cache is not None:
+            aoi = aoi_cache.get_aoi(pdc, hazard)
+        else:
+            aoi = pdc.get_aoi(hazard['hazard_ID'])
+        pdc_aoi = aoi
+    else:
+        # The given AOI may already be prepared or merged, so the AOI as returned by the PDC API comes from the cache
+        pdc_aoi = aoi_cache.peek(hazard) if aoi_cache is not None else None
 
-    print(f'Fetching existing subscription with name: {name}')
-    existing_subscription = get_existing_subscription(hyp3, name)
+    tolerance = None
+    if geometry is not None:
+        aoi = prepare_aoi(aoi, geometry)
+        tolerance = geometry.tolerance
 
-    if not existing_subscription:
+    print(f'Fetching existing subscription with name: {name}')
+    try:
+        existing_subscription = get_existing_subscription(hyp3, name, subscription_index)
+    except DuplicateSubscriptionNames as e:
+        if not resolve_duplicates:
+            raise
+        print(f'{e}; resolving')
+        existing_subscription = resolve_duplicate_subscriptions(hyp3, name, dry_run)
+
+    change = plan_subscription_change(hazard, aoi, existing_subscription, end, end_date_refresh, tolerance)
+    if change['action'] == 'create':
         print(f'No existing subscription; submitting new subscription with name: {name}')
-        new_subscription = prepare_new_subscription(start, end, aoi, name)
-        response = hyp3.submit_subscription(new_subscription, validate_only=dry_run)
+        response = hyp3.submit_subscription(change['subscription'], validate_only=dry_run)
         subscription_id = response['subscription']['subscription_id']
         print(f'Got subscription id: {subscription_id}')
+        action = 'submitted'
+    elif change['action'] == 'noop':
+        print(f'Subscription {change["subscription_id"]} is up to date; skipping update')
+        action = 'unchanged'
     else:
-        log_updates(existing_subscription, start, aoi)
+        log_updates(existing_subscription, start, aoi, tolerance)
         if not dry_run:
-            hyp3.update_subscription(
-                subscription_id=existing_subscription['subscription_id'],
-                start=start,
-                end=end,
-                intersectsWith=aoi,
-                enabled=True,
-            )
+            hyp3.update_subscription(subscription_id=change['subscription_id'], **change['changes'])
+        action = 'updated'
+
+    if snapshot is not None:
+        snapshot.record(hazard, pdc_aoi)
+    return action
+
+
+def plan_subscription_change(
+        hazard: dict,
+        aoi: str,
+        existing_subscription: Optional[dict],
+        end: str,
+        end_date_refresh: Optional[timedelta] = None,
+        aoi_tolerance: Optional[float] = None) -> dict:
+    """Returns the change needed to bring the hazard's subscription up to date: a JSON-serializable dict whose
+    `action` is `create`, `update` or `noop`.
+    """
+    name = subscription_name_from_hazard_uuid(hazard['uuid'])
+    start = get_start_datetime_str(int(hazard['start_Date']))
+
+    if not existing_subscription:
+        return {
+            'action': 'create',
+            'hazard_uuid': hazard['uuid'],
+            'name': name,
+            'subscription': prepare_new_subscription(start, end, aoi, name),
+        }
+    if end_date_refresh is not None and not subscription_needs_update(
+            existing_subscription, start, end, aoi, end_date_refresh, aoi_tolerance):
+        return {
+            'action': 'noop',
+            'hazard_uuid': hazard['uuid'],
+            'subscription_id': existing_subscription['subscription_id'],
+        }
+    return {
+        'action': 'update',
+        'hazard_uuid': hazard['uuid'],
+        'subscription_id': existing_subscription['subscription_id'],
+        'changes': {'start': start, 'end': end, 'intersectsWith': aoi, 'enabled': True},
+    }
+
+
+def subscription_needs_update(
+        existing_subscription: dict,
+        start: str,
+        end: str,
+        aoi: str,
+        end_date_refresh: timedelta,
+        aoi_tolerance: Optional[float] = None) -> bool:
+    """Returns True if any field other than the end datetime has changed, or if the existing end datetime has fallen
+    at least `end_date_refresh` behind the desired end datetime.
+
+    If `aoi_tolerance` is given, AOIs are compared as geometries rather than as strings.
+    """
+    search_parameters = existing_subscription['search_parameters']
+    return (
+        search_parameters['start'] != start
+        or not _aois_match(search_parameters['intersectsWith'], aoi, aoi_tolerance)
+        or subscription_is_due(existing_subscription, end, end_date_refresh)
+    )
 
 
-def log_updates(existing_subscription: dict, new_start: str, new_aoi: str) -> None:
+def subscription_is_due(existing_subscription: dict, end: str, end_date_refresh: timedelta) -> bool:
+    """Returns True if the existing subscription is disabled or its end datetime needs extending."""
+    existing_end = existing_subscription['search_parameters']['end']
+    return (
+        not existing_subscription['enabled']
+        or datetime_from_str(end) - datetime_from_str(existing_end) >= end_date_refresh
+    )
+
+
+def _aois_match(aoi1: str, aoi2: str, tolerance: Optional[float]) -> bool:
+    return aoi1 == aoi2 if tolerance is None else aois_equal(aoi1, aoi2, tolerance)
+
+
+def log_updates(
+        existing_subscription: dict, new_start: str, new_aoi: str, aoi_tolerance: Optional[float] = None) -> None:
     subscription_id = existing_subscription['subscription_id']
     print(f'Updating subscription with id: {subscription_id}')
 
@@ -154,10 +1922,394 @@ def log_updates(existing_subscription: dict, new_start: str, new_aoi: str) -> No
     if existing_start != new_start:
         print(f'Updating start datetime for subscription {subscription_id} from {existing_start} to {new_start}')
 
-    if existing_aoi != new_aoi:
+    if not _aois_match(existing_aoi, new_aoi, aoi_tolerance):
         print(f'Updating AOI for subscription {subscription_id} from {existing_aoi} to {new_aoi}')
 
 
+def make_plan(
+        pdc: PDCHazardsAPI,
+        hyp3: HyP3SubscriptionsAPI,
+        run: PreparedRun,
+        now: datetime,
+        validation_sample: int = PLAN_VALIDATION_SAMPLE) -> dict:
+    """Computes every change that a run would make, without making any changes.
+
+    Existing subscriptions come from the run's subscription index, and AOIs are only fetched for the hazards that the
+    run would process, so no per-hazard HyP3 requests are sent other than validating a sample of the new
+    subscriptions. Returns a JSON-serializable plan for `apply_plan`.
+    """
+    if run.aois is not None:
+        aois = run.aois
+    else:
+        aois = fetch_aois(pdc, run.hazards_to_process, run.aoi_cache, run.geometry, max_workers=MAX_WORKERS)
+
+    uuids_to_process = {hazard['uuid'] for hazard in run.hazards_to_process}
+    changes = []
+    errors = {}
+    for hazard in run.active_hazards:
+        name = subscription_name_from_hazard_uuid(hazard['uuid'])
+        try:
+            existing_subscription = get_existing_subscription(hyp3, name, run.subscription_index)
+        except DuplicateSubscriptionNames as e:
+            errors[hazard['uuid']] = str(e)
+            continue
+        if hazard['uuid'] not in uuids_to_process:
+            if existing_subscription:
+                changes.append({
+                    'action': 'noop',
+                    'hazard_uuid': hazard['uuid'],
+                    'subscription_id': existing_subscription['subscription_id'],
+                })
+            continue
+        if hazard['uuid'] not in aois:
+            errors[hazard['uuid']] = 'AOI could not be fetched'
+            continue
+        changes.append(plan_subscription_change(
+            hazard, aois[hazard['uuid']], existing_subscription, run.end, HAZARD_END_DATE_REFRESH,
+            run.geometry.tolerance,
+        ))
+
+    for subscription in find_stale_subscriptions(run.subscription_index, run.active_hazards, now)[:SWEEP_BATCH_SIZE]:
+        changes.append({
+            'action': 'disable',
+            'subscription_id': subscription['subscription_id'],
+            'name': subscription['job_specification']['name'],
+        })
+
+    return {
+        'created': str_from_datetime(now),
+        'end': run.end,
+        'changes': changes,
+        'errors': errors,
+        'validation': validate_plan(hyp3, changes, validation_sample),
+    }
+
+
+def validate_plan(hyp3: HyP3SubscriptionsAPI, changes: list[dict], sample_size: int) -> dict[str, Optional[str]]:
+    """Validates a random sample of the new subscriptions in the plan, returning the error (if any) for each."""
+    creates = [change for change in changes if change['action'] == 'create']
+    validation = {}
+    for change in random.sample(creates, min(sample_size, len(creates))):
+        try:
+            hyp3.submit_subscription(change['subscription'], validate_only=True)
+        except (requests.RequestException, CircuitOpen, DeadlineExceeded) as e:
+            validation[change['name']] = str(e)
+        else:
+            validation[change['name']] = None
+    return validation
+
+
+def summarize_plan(plan: dict) -> dict[str, int]:
+    counts = {'create': 0, 'update': 0, 'noop': 0, 'disable': 0}
+    for change in plan['changes']:
+        counts[change['action']] += 1
+    return counts
+
+
+def apply_plan(
+        hyp3: HyP3SubscriptionsAPI, plan: dict, now: datetime, dry_run: bool, max_workers: int = 1) -> dict:
+    """Makes the changes in a plan from `make_plan`, and returns a report.
+
+    New subscriptions whose name has been taken since the plan was made are skipped, as are updates to subscriptions
+    that no longer exist. In a dry run, changes that would be made are reported as ``would_apply`` rather than
+    ``applied``. Raises `StalePlan` if the plan is older than PLAN_MAX_AGE.
+    """
+    age = now - datetime_from_str(plan['created'])
+    if age > PLAN_MAX_AGE:
+        raise StalePlan(f'Plan was created {age} ago (maximum {PLAN_MAX_AGE})')
+
+    subscription_index = get_subscription_index(hyp3)
+    subscription_ids = {
+        subscription['subscription_id']
+        for subscriptions in subscription_index.values() for subscription in subscriptions
+    }
+
+    def apply(change: dict) -> str:
+        if change['action'] == 'noop':
+            return 'noop'
+        if change['action'] == 'create' and change['name'] in subscription_index:
+            return 'skipped'
+        if change['action'] in ('update', 'disable') and change['subscription_id'] not in subscription_ids:
+            return 'skipped'
+        if dry_run:
+            return 'would_apply'
+        try:
+            if change['action'] == 'create':
+                hyp3.submit_subscription(change['subscription'])
+            elif change['action'] == 'update':
+                hyp3.update_subscription(subscription_id=change['subscription_id'], **change['changes'])
+            else:
+                hyp3.update_subscription(subscription_id=change['subscription_id'], enabled=False)
+        except (requests.RequestException, CircuitOpen, DeadlineExceeded) as e:
+            print(f'Error while applying {change["action"]} change {_describe_change(change)}: {e}')
+            return 'error'
+        return 'applied'
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        outcomes = list(executor.map(apply, plan['changes']))
+
+    report: dict[str, dict[str, int]] = {}
+    for change, outcome in zip(plan['changes'], outcomes):
+        if outcome != 'noop':
+            report.setdefault(outcome, {}).setdefault(change['action'], 0)
+            report[outcome][change['action']] += 1
+        if outcome == 'skipped':
+            print(f'Skipped {change["action"]} change {_describe_change(change)}, which no longer applies')
+    return report
+
+
+def _describe_change(change: dict) -> str:
+    return change.get('name') or change['subscription_id']
+
+
+def plan_main(plan_location: str) -> dict:
+    """Writes a plan of every change that a run would make to a local file or ``s3://bucket/key`` object."""
+    pdc, hyp3 = get_api_clients()
+    run = prepare_run(pdc, hyp3)
+    plan = make_plan(pdc, hyp3, run, datetime.now(tz=timezone.utc))
+    run.aoi_cache.save()
+
+    save_state(plan_location, plan)
+    print(f'Plan: {json.dumps(summarize_plan(plan))}')
+    print(f'Hazards that could not be planned: {len(plan["errors"])}')
+    print(f'Validated new subscriptions: {json.dumps(plan["validation"])}')
+    print(f'Wrote plan to {plan_location}')
+    return plan
+
+
+def apply_main(plan_location: str, dry_run: bool) -> dict:
+    if dry_run:
+        print('(DRY RUN)')
+    plan = load_state(plan_location)
+    if plan is None:
+        raise FileNotFoundError(plan_location)
+    print(f'Applying plan from {plan_location}: {json.dumps(summarize_plan(plan))}')
+
+    _, hyp3 = get_api_clients()
+    report = apply_plan(hyp3, plan, datetime.now(tz=timezone.utc), dry_run=dry_run, max_workers=MAX_WORKERS)
+    print(f'Applied plan: {json.dumps(report)}')
+    return report
+
+
+def shard_hazards(hazards: list[dict], shard_size: int = SHARD_SIZE) -> list[list[dict]]:
+    """Splits the hazards into shards of at most `shard_size` hazards.
+
+    Hazards are dealt to the shards round-robin, so that the most urgent hazards are spread across the workers and
+    each shard keeps the original priority order.
+    """
+    shard_count = math.ceil(len(hazards) / shard_size)
+    return [hazards[i::shard_count] for i in range(shard_count)]
+
+
+def prepare_shards(run: PreparedRun, run_id: str, dry_run: bool, shard_size: int = SHARD_SIZE) -> list[dict]:
+    shards = []
+    for number, hazards in enumerate(shard_hazards(run.hazards_to_process, shard_size)):
+        uuids = [hazard['uuid'] for hazard in hazards]
+        names = [subscription_name_from_hazard_uuid(uuid) for uuid in uuids]
+        shards.append({
+            'run_id': run_id,
+            'shard': number,
+            'end': run.end,
+            'dry_run': dry_run,
+            'hazards': hazards,
+            'subscription_index': {name: run.subscription_index[name] for name in names
+                                   if name in run.subscription_index},
+            'aois': {uuid: run.aois[uuid] for uuid in uuids if uuid in run.aois} if run.aois is not None else None,
+        })
+    return shards
+
+
+def process_shard(shard: dict, deadline: Optional[float] = None) -> dict:
+    """Processes one shard of a run and returns its result, which is JSON-serializable.
+
+    If the shard has no subscription index (see `SQSShardQueue`), each hazard's subscription is queried by name. The
+    AOI cache at `AOI_CACHE_LOCATION` is read but not saved, since workers run concurrently; the coordinator saves it.
+    """
+    pdc, hyp3 = get_api_clients(deadline)
+    snapshot = HazardSnapshot()
+    results = process_active_hazards(
+        pdc,
+        hyp3,
+        shard['hazards'],
+        shard['end'],
+        dry_run=shard['dry_run'],
+        max_workers=MAX_WORKERS,
+        subscription_index=shard['subscription_index'],
+        aoi_cache=get_aoi_cache(os.getenv('AOI_CACHE_LOCATION')),
+        end_date_refresh=HAZARD_END_DATE_REFRESH,
+        deadline=deadline,
+        snapshot=snapshot,
+        geometry=GeometryOptions(),
+        aois=shard['aois'],
+        resolve_duplicates=True,
+    )
+    return {
+        'run_id': shard['run_id'],
+        'shard': shard['shard'],
+        'results': [result.to_dict() for result in results],
+        'snapshot': snapshot.get_updates(),
+    }
+
+
+def summarize_shard_results(shards: list[dict], shard_results: list[dict]) -> dict:
+    """Aggregates the shard results into one run summary. Hazards in shards without a result count as unfinished."""
+    reported = {shard_result['shard'] for shard_result in shard_results}
+    results = [result for shard_result in shard_results for result in shard_result['results']]
+    pending = [hazard['uuid'] for shard in shards if shard['shard'] not in reported for hazard in shard['hazards']]
+
+    actions: dict[str, int] = {}
+    for result in results:
+        if result['action'] is not None:
+            actions[result['action']] = actions.get(result['action'], 0) + 1
+
+    return {
+        'shards': len(shards),
+        'pending_shards': len(shards) - len(reported),
+        'hazards': sum(len(shard['hazards']) for shard in shards),
+        'actions': actions,
+        'errors': {result['uuid']: result['error'] for result in results if result['error'] is not None},
+        'unfinished': [result['uuid'] for result in results if result['unfinished']] + pending,
+    }
+
+
+def get_shard_result_location(location: str, run_id: str, shard: int) -> str:
+    return f'{location.rstrip("/")}/{run_id}/shard-{shard}.json'
+
+
+class ShardQueue(ABC):
+    @abstractmethod
+    def dispatch(self, shards: list[dict], deadline: Optional[float]) -> list[dict]:
+        """Dispatches the shards to workers and returns the results of the shards that finish by the deadline."""
+
+    def collect_late_results(self) -> list[dict]:
+        """Returns the results of shards from a previous dispatch that finished after its deadline."""
+        return []
+
+
+class InProcessShardQueue(ShardQueue):
+    """Processes the shards one at a time in the calling process. Intended for local runs and tests."""
+
+    def __init__(self, worker: Callable[[dict, Optional[float]], dict] = process_shard):
+        self._worker = worker
+
+    def dispatch(self, shards: list[dict], deadline: Optional[float]) -> list[dict]:
+        return [self._worker(shard, deadline) for shard in shards]
+
+
+class MultiprocessingShardQueue(ShardQueue):
+    """Processes the shards concurrently in a pool of local processes. Intended for local runs and tests."""
+
+    def __init__(
+            self, processes: Optional[int] = None, worker: Callable[[dict, Optional[float]], dict] = process_shard):
+        self._processes = processes
+        self._worker = worker
+
+    def dispatch(self, shards: list[dict], deadline: Optional[float]) -> list[dict]:
+        executor = ProcessPoolExecutor(max_workers=self._processes)
+        futures = [executor.submit(self._worker, shard, deadline) for shard in shards]
+        timeout = max(deadline - time.monotonic(), 0) if deadline is not None else None
+        done, _ = wait(futures, timeout=timeout)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        results = []
+        for shard, future in zip(shards, futures):
+            if future not in done:
+                continue
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f'Error while processing shard {shard["shard"]}: {e}')
+        return results
+
+
+class SQSShardQueue(ShardQueue):
+    """Sends each shard to an SQS queue consumed by `worker_handler`, then waits for the workers to save their results
+    to the results location (see `worker_handler`).
+
+    Shards that would exceed the SQS message size limit are sent without their subscription index and, if still too
+    large, without their AOIs, in which case the worker queries them itself. Shards that cannot be sent have no result.
+    Shards still running at the deadline are recorded, and their results returned by the next dispatch's
+    `collect_late_results`.
+    """
+
+    def __init__(self, queue_url: str, results_location: str, poll_interval: float = SHARD_POLL_INTERVAL):
+        self._queue_url = queue_url
+        self._results_location = results_location
+        self._poll_interval = poll_interval
+
+    def dispatch(self, shards: list[dict], deadline: Optional[float]) -> list[dict]:
+        import boto3
+        from botocore.exceptions import BotoCoreError, ClientError
+        sqs = boto3.client('sqs')
+        sent = []
+        for shard in shards:
+            body = self._get_message_body(shard)
+            if body is None:
+                print(f'Shard {shard["shard"]} exceeds the SQS message size limit; not sending it')
+                continue
+            try:
+                sqs.send_message(QueueUrl=self._queue_url, MessageBody=body)
+            except (BotoCoreError, ClientError) as e:
+                print(f'Error while sending shard {shard["shard"]}: {e}')
+                continue
+            sent.append(shard)
+        return self._collect(sent, deadline)
+
+    @staticmethod
+    def _get_message_body(shard: dict) -> Optional[str]:
+        for omitted in ([], ['subscription_index'], ['subscription_index', 'aois']):
+            body = json.dumps({**shard, **{key: None for key in omitted}})
+            if len(body.encode()) <= SQS_MAX_MESSAGE_BYTES:
+                if omitted:
+                    print(f'Sending shard {shard["shard"]} without {" and ".join(omitted)} to fit the SQS message size')
+                return body
+        return None
+
+    def _collect(self, shards: list[dict], deadline: Optional[float]) -> list[dict]:
+        pending = {shard['shard']: shard['run_id'] for shard in shards}
+        results = []
+        while True:
+            for number, run_id in list(pending.items()):
+                result = load_state(get_shard_result_location(self._results_location, run_id, number))
+                if result is not None:
+                    results.append(result)
+                    del pending[number]
+            if not pending or (deadline is not None and time.monotonic() + self._poll_interval >= deadline):
+                break
+            time.sleep(self._poll_interval)
+        if pending:
+            print(f'Shards without a result by the deadline: {", ".join(str(number) for number in sorted(pending))}')
+        save_state(self._get_pending_location(), {
+            'shards': [{'run_id': run_id, 'shard': number} for number, run_id in sorted(pending.items())]
+        })
+        return sorted(results, key=lambda result: result['shard'])
+
+    def collect_late_results(self) -> list[dict]:
+        pending = load_state(self._get_pending_location()) or {'shards': []}
+        results = []
+        for shard in pending['shards']:
+            result = load_state(get_shard_result_location(self._results_location, shard['run_id'], shard['shard']))
+            if result is None:
+                print(f'Shard {shard["shard"]} of run {shard["run_id"]} never saved a result')
+            else:
+                results.append(result)
+        return results
+
+    def _get_pending_location(self) -> str:
+        return f'{self._results_location.rstrip("/")}/pending.json'
+
+
+def get_shard_queue(name: Optional[str] = None) -> ShardQueue:
+    name = name or os.getenv('SHARD_QUEUE', 'sqs')
+    if name == 'sqs':
+        return SQSShardQueue(get_env_var('SHARD_QUEUE_URL'), get_env_var('SHARD_RESULTS_LOCATION'))
+    if name == 'multiprocessing':
+        return MultiprocessingShardQueue()
+    if name == 'in-process':
+        return InProcessShardQueue()
+    raise ValueError(f'Invalid shard queue: {name}')
+
+
 def str_from_datetime(date_time: datetime) -> str:
     assert date_time.tzinfo == timezone.utc
     datetime_str = date_time.isoformat()
@@ -165,6 +2317,12 @@ def str_from_datetime(date_time: datetime) -> str:
     return datetime_str.removesuffix('+00:00') + 'Z'
 
 
+def datetime_from_str(datetime_str: str) -> datetime:
+    date_time = datetime.fromisoformat(datetime_str.replace('Z', '+00:00'))
+    assert date_time.tzinfo == timezone.utc
+    return date_time
+
+
 def get_start_datetime_str(
         timestamp_in_ms: int,
         delta: timedelta = HAZARD_START_DATE_DELTA,
@@ -181,7 +2339,7 @@ def get_end_datetime_str(current_time_in_ms: int, delta: timedelta = HAZARD_END_
 
 
 def subscription_name_from_hazard_uuid(uuid: str) -> str:
-    return f'PDC-hazard-{uuid}'
+    return f'{SUBSCRIPTION_NAME_PREFIX}{uuid}'
 
 
 def prepare_new_subscription(start: str, end: str, aoi: str, name: str) -> dict:
@@ -224,35 +2382,375 @@ def get_current_time_in_ms() -> int:
     return int(time.time() * 1000)
 
 
-def lambda_handler(event, context) -> None:
-    main(dry_run=False)
-
+def get_deadline(context, margin: timedelta = DEADLINE_MARGIN) -> float:
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000
+    return time.monotonic() + remaining_seconds - margin.total_seconds()
 
-def main(dry_run: bool) -> None:
-    if dry_run:
-        print('(DRY RUN)')
 
+def get_api_clients(deadline: Optional[float] = None) -> tuple[PDCHazardsAPI, HyP3SubscriptionsAPI]:
     pdc_auth_token = get_env_var('PDC_HAZARDS_AUTH_TOKEN')
     hyp3_url = get_env_var('HYP3_URL')
     earthdata_username = get_env_var('EARTHDATA_USERNAME')
     earthdata_password = get_env_var('EARTHDATA_PASSWORD')
 
-    print(f'PDC API URL: {PDC_URL}')
+    pdc_url = os.getenv('PDC_URL', PDC_URL)
+
+    print(f'PDC API URL: {pdc_url}')
     print(f'HyP3 API URL: {hyp3_url}')
     print(f'Earthdata user: {earthdata_username}')
 
-    hyp3 = HyP3SubscriptionsAPI(hyp3_url, earthdata_username, earthdata_password)
+    pdc = get_pdc_api(pdc_auth_token, pdc_url)
+    hyp3 = get_hyp3_api(
+        hyp3_url, earthdata_username, earthdata_password, cookie_location=os.getenv('EARTHDATA_COOKIE_LOCATION')
+    )
+    pdc.deadline = hyp3.deadline = deadline
+    return pdc, hyp3
 
-    print('Fetching active hazards')
-    active_hazards = get_active_hazards(pdc_auth_token)
-    print(f'Active hazards (before filtering): {len(active_hazards)}')
 
+def prepare_run(pdc: PDCHazardsAPI, hyp3: HyP3SubscriptionsAPI) -> PreparedRun:
+    """Fetches the active hazards and existing subscriptions, and selects the hazards to process, in priority order."""
+    print('Fetching active hazards')
     current_time_in_ms = get_current_time_in_ms()
-    active_hazards = filter_hazards(active_hazards, current_time_in_ms)
-    print(f'Active hazards (after filtering): {len(active_hazards)}')
+    active_hazards = fetch_active_hazards(pdc, current_time_in_ms)
+
+    print('Fetching existing subscriptions')
+    subscription_index = get_subscription_index(hyp3)
+    print(f'Existing subscriptions: {sum(len(subscriptions) for subscriptions in subscription_index.values())}')
+
+    checkpoint_location = os.getenv('CHECKPOINT_LOCATION')
+    checkpoint = load_checkpoint(checkpoint_location) if checkpoint_location else set()
+    print(f'Hazards left unfinished by the previous run: {len(checkpoint)}')
+    active_hazards = prioritize_hazards(active_hazards, subscription_index, checkpoint)
+
+    aoi_cache = get_aoi_cache(os.getenv('AOI_CACHE_LOCATION'))
+    snapshot = get_hazard_snapshot(os.getenv('SNAPSHOT_LOCATION'))
+
+    end = get_end_datetime_str(current_time_in_ms)
+
+    delta = snapshot.diff(active_hazards, aoi_cache)
+    print(
+        f'Hazards since the last run: {len(delta.new)} new, {len(delta.changed)} changed, '
+        f'{len(delta.unchanged)} unchanged, {len(delta.disappeared)} disappeared'
+    )
+    hazards_to_process = select_hazards_to_process(
+        active_hazards, delta, subscription_index, end, HAZARD_END_DATE_REFRESH
+    )
 
+    geometry = GeometryOptions()
+    aois = None
+    deduplication_mode = os.getenv('DEDUPLICATION_MODE')
+    if deduplication_mode:
+        print(f'Deduplicating overlapping hazards (mode: {deduplication_mode})')
+        aois = fetch_aois(pdc, active_hazards, aoi_cache, geometry, max_workers=MAX_WORKERS)
+        _, aois, covered_by = deduplicate_hazards(active_hazards, aois, deduplication_mode)
+        # In merge mode, hazards that absorbed another hazard's AOI must be processed so that the merged AOI is applied
+        uuids_to_process = {hazard['uuid'] for hazard in hazards_to_process}
+        if deduplication_mode == 'merge':
+            uuids_to_process.update(covered_by.values())
+        hazards_to_process = [
+            hazard for hazard in active_hazards
+            if hazard['uuid'] in uuids_to_process and hazard['uuid'] not in covered_by
+        ]
+        for uuid, covering_uuid in covered_by.items():
+            print(f'Hazard {uuid} is covered by hazard {covering_uuid}')
+        print(f'Avoided {len(covered_by)} duplicate subscriptions')
+
+    print(f'Hazards to process: {len(hazards_to_process)}')
+
+    return PreparedRun(
+        active_hazards=active_hazards,
+        hazards_to_process=hazards_to_process,
+        end=end,
+        subscription_index=subscription_index,
+        aoi_cache=aoi_cache,
+        snapshot=snapshot,
+        geometry=geometry,
+        aois=aois,
+    )
+
+
+def sweep_stale_subscriptions(
+        hyp3: HyP3SubscriptionsAPI, run: PreparedRun, dry_run: bool, deadline: Optional[float]) -> None:
+    if deadline is not None and time.monotonic() >= deadline:
+        print('Skipping the stale subscription sweep due to the deadline')
+        return
+    print('Sweeping stale subscriptions')
+    sweep_subscriptions(
+        hyp3,
+        run.subscription_index,
+        run.active_hazards,
+        datetime.now(tz=timezone.utc),
+        dry_run=dry_run,
+        max_workers=MAX_WORKERS,
+    )
+
+
+def archive_history(run: PreparedRun, results: list[dict], dry_run: bool) -> None:
+    """Appends the run to the hazard history archive at `HISTORY_LOCATION`, if set. Must be called before the
+    snapshot is saved.
+    """
+    location = os.getenv('HISTORY_LOCATION')
+    if not location or dry_run:
+        return
+    actions = {result['uuid']: result['action'] if result['error'] is None else 'error' for result in results}
+    aoi_hashes = {uuid: entry['aoi_hash'] for uuid, entry in run.snapshot.get_updates().items()}
+    now = datetime.now(tz=timezone.utc)
+    run_location = archive_run(location, now, run.active_hazards, actions, aoi_hashes)
+    print(f'Archived {len(run.active_hazards)} hazards to {run_location}')
+
+    compacted_location = compact_history(location, now.date() - timedelta(days=1))
+    if compacted_location:
+        print(f'Compacted the previous day of the hazard history to {compacted_location}')
+
+
+def finish_run(pdc: PDCHazardsAPI, run: PreparedRun, unfinished: list[str], dry_run: bool) -> None:
+    """Persists the snapshot, checkpoint and AOI cache at the end of a run."""
+    if not dry_run:
+        run.snapshot.save(run.active_hazards)
+        checkpoint_location = os.getenv('CHECKPOINT_LOCATION')
+        if checkpoint_location:
+            save_checkpoint(checkpoint_location, unfinished)
+
+    evicted = run.aoi_cache.evict({str(hazard['hazard_ID']) for hazard in run.active_hazards})
+    print(
+        f'AOI cache: {run.aoi_cache.hits} hits, {run.aoi_cache.not_modified} not modified, '
+        f'{run.aoi_cache.misses} misses, {evicted} evicted'
+    )
+    run.aoi_cache.save()
+
+    print(f'PDC API retries: {pdc.retries}')
+
+
+def lambda_handler(event, context) -> None:
+    main(dry_run=False, deadline=get_deadline(context) if context else None, profile=True)
+
+
+def hazard_event_handler(event, context) -> Any:
+    """Processes the hazards in a PDC hazard change event as soon as it arrives.
+
+    The event may be an SQS event, an API Gateway or Lambda function URL request, or a direct invocation; see
+    `get_hazard_events`. The periodic `lambda_handler` remains the reconciliation sweep. Both are idempotent, and
+    duplicate subscriptions from the two racing to submit the same new hazard are resolved, so they can run
+    concurrently. Prints the per-operation metrics (see `Metrics`) at the end of each invocation.
+    """
+    METRICS.reset()
+    try:
+        return _handle_hazard_event(event, context)
+    finally:
+        print_metrics()
+
+
+def _handle_hazard_event(event: dict, context) -> Any:
+    events = get_hazard_events(event)
+    if 'body' in event and events[0][1] is None:
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid hazard event'})}
+
+    valid_events = [(message_id, hazard) for message_id, hazard in events if hazard is not None]
+    with METRICS.measure('phase:process'):
+        results = process_hazard_events(
+            [hazard for _, hazard in valid_events], dry_run=False, deadline=get_deadline(context) if context else None
+        )
+
+    if 'Records' in event:
+        # Failed and invalid messages are returned to the queue, which moves them to its dead-letter queue after
+        # repeated failures; requires ReportBatchItemFailures on the event source
+        failed = {message_id for message_id, hazard in events if hazard is None}
+        failed.update(
+            message_id for (message_id, _), result in zip(valid_events, results)
+            if result.error is not None or result.unfinished
+        )
+        return {'batchItemFailures': [
+            {'itemIdentifier': message_id} for message_id, _ in events if message_id in failed
+        ]}
+
+    summary = [result.to_dict() for result in results]
+    if 'body' in event:
+        if any(result.action == 'invalid' for result in results):
+            return {'statusCode': 400, 'body': json.dumps(summary)}
+        failed = any(result.error is not None or result.unfinished for result in results)
+        return {'statusCode': 500 if failed else 200, 'body': json.dumps(summary)}
+    return summary
+
+
+def get_hazard_events(event: dict) -> list[tuple[Optional[str], Optional[dict]]]:
+    """Returns (message ID, hazard) for each hazard in the event, with a hazard of None for each SQS message or HTTP
+    request body that cannot be parsed.
+
+    The payload (an SQS message body, an HTTP request body, or the event itself) is a PDC hazard, optionally nested
+    under a `hazard` key.
+    """
+    if 'Records' in event:
+        records = [(record.get('messageId'), record.get('body'), False) for record in event['Records']]
+    elif 'body' in event:
+        records = [(None, event['body'], event.get('isBase64Encoded', False))]
+    else:
+        return [(None, parse_hazard_event(event))]
+
+    events = []
+    for message_id, body, is_base64_encoded in records:
+        try:
+            if is_base64_encoded:
+                body = base64.b64decode(body).decode()
+            hazard = parse_hazard_event(json.loads(body))
+        except (TypeError, ValueError, InvalidHazardEvent) as e:
+            print(f'Invalid hazard event{f" in message {message_id}" if message_id else ""}: {e}')
+            hazard = None
+        events.append((message_id, hazard))
+    return events
+
+
+def parse_hazard_event(payload: Any) -> dict:
+    hazard = payload.get('hazard', payload) if isinstance(payload, dict) else payload
+    if not isinstance(hazard, dict):
+        raise InvalidHazardEvent(f'Expected a hazard object, got {type(hazard).__name__}')
+    return hazard
+
+
+def process_hazard_events(hazards: list[dict], dry_run: bool, deadline: Optional[float] = None) -> list[HazardResult]:
+    pdc, hyp3 = get_api_clients(deadline)
+    current_time_in_ms = get_current_time_in_ms()
     end = get_end_datetime_str(current_time_in_ms)
-    process_active_hazards(pdc_auth_token, hyp3, active_hazards, end, dry_run=dry_run)
+    aoi_cache = get_aoi_cache(os.getenv('AOI_CACHE_LOCATION'))
+
+    def process(hazard: dict) -> str:
+        # Subscriptions are queried by name rather than from an index, so that a concurrent sweep's changes are seen
+        return process_active_hazard(
+            pdc,
+            hyp3,
+            hazard,
+            end,
+            dry_run=dry_run,
+            aoi_cache=aoi_cache,
+            end_date_refresh=HAZARD_END_DATE_REFRESH,
+            geometry=GeometryOptions(),
+            resolve_duplicates=True,
+        )
+
+    results = []
+    for count, hazard in enumerate(hazards, start=1):
+        hazard = {field: hazard[field] for field in HAZARD_FIELDS if field in hazard}
+        try:
+            valid = HAZARD_EVENT_REQUIRED_FIELDS <= hazard.keys() and is_valid_hazard(hazard, current_time_in_ms)
+        except (TypeError, ValueError) as e:
+            print(f'Invalid event for hazard {hazard.get("uuid")}: {e}')
+            results.append(HazardResult(hazard.get('uuid', ''), action='invalid', error=e))
+            continue
+        if not valid:
+            print(f'Ignoring event for hazard {hazard.get("uuid")}, which is not an active flood warning')
+            results.append(HazardResult(hazard.get('uuid', ''), action='ignored'))
+            continue
+        results.append(_process_active_hazard_isolated(f'({count}/{len(hazards)})', hazard, process, deadline))
+    return results
+
+
+def coordinator_handler(event, context) -> None:
+    coordinate(
+        dry_run=False, queue=get_shard_queue(), deadline=get_deadline(context) if context else None, profile=True
+    )
+
+
+def worker_handler(event, context) -> None:
+    """Processes the shards in an SQS event, saving each shard's result to `SHARD_RESULTS_LOCATION`. Prints the
+    per-operation metrics (see `Metrics`) at the end of each invocation.
+    """
+    deadline = get_deadline(context) if context else None
+    results_location = get_env_var('SHARD_RESULTS_LOCATION')
+    METRICS.reset()
+    try:
+        for record in event['Records']:
+            shard = json.loads(record['body'])
+            with METRICS.measure('phase:process'):
+                result = process_shard(shard, deadline)
+            save_state(get_shard_result_location(results_location, shard['run_id'], shard['shard']), result)
+    finally:
+        print_metrics()
+
+
+def main(dry_run: bool, deadline: Optional[float] = None, profile: bool = False) -> None:
+    """Runs one periodic sweep. If `profile` is set, prints the per-operation metrics (see `Metrics`) at the end."""
+    if dry_run:
+        print('(DRY RUN)')
+    METRICS.reset()
+
+    pdc, hyp3 = get_api_clients(deadline)
+    with METRICS.measure('phase:prepare'):
+        run = prepare_run(pdc, hyp3)
+
+    with METRICS.measure('phase:process'):
+        results = process_active_hazards(
+            pdc,
+            hyp3,
+            run.hazards_to_process,
+            run.end,
+            dry_run=dry_run,
+            max_workers=MAX_WORKERS,
+            subscription_index=run.subscription_index,
+            aoi_cache=run.aoi_cache,
+            end_date_refresh=HAZARD_END_DATE_REFRESH,
+            deadline=deadline,
+            snapshot=run.snapshot,
+            geometry=run.geometry,
+            aois=run.aois,
+            resolve_duplicates=True,
+        )
+
+    with METRICS.measure('phase:sweep'):
+        sweep_stale_subscriptions(hyp3, run, dry_run, deadline)
+    with METRICS.measure('phase:finish'):
+        archive_history(run, [result.to_dict() for result in results], dry_run)
+        finish_run(pdc, run, [result.uuid for result in results if result.unfinished], dry_run)
+
+    if profile:
+        print_metrics()
+
+
+def coordinate(
+        dry_run: bool,
+        queue: ShardQueue,
+        deadline: Optional[float] = None,
+        shard_size: int = SHARD_SIZE,
+        profile: bool = False) -> dict:
+    """Like `main`, but splits the hazards to process into shards and dispatches them to workers through `queue`,
+    then aggregates the shard results into one run summary.
+    """
+    if dry_run:
+        print('(DRY RUN)')
+    METRICS.reset()
+
+    pdc, hyp3 = get_api_clients(deadline)
+    with METRICS.measure('phase:prepare'):
+        run = prepare_run(pdc, hyp3)
+
+    run_id = datetime.now(tz=timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    shards = prepare_shards(run, run_id, dry_run, shard_size)
+    # Late results are merged before this run's results, so that the latter take precedence in the snapshot
+    late_results = queue.collect_late_results()
+    for late_result in late_results:
+        print(f'Late result of shard {late_result["shard"]} of run {late_result["run_id"]}: '
+              f'{json.dumps(late_result["results"])}')
+        run.snapshot.merge(late_result['snapshot'])
+
+    print(f'Dispatching {len(run.hazards_to_process)} hazards in {len(shards)} shards (run {run_id})')
+    with METRICS.measure('phase:process'):
+        shard_results = queue.dispatch(shards, deadline)
+
+    summary = summarize_shard_results(shards, shard_results)
+    summary['late_shards'] = len(late_results)
+    print(f'Run summary: {json.dumps(summary)}')
+
+    for shard_result in shard_results:
+        run.snapshot.merge(shard_result['snapshot'])
+    with METRICS.measure('phase:sweep'):
+        sweep_stale_subscriptions(hyp3, run, dry_run, deadline)
+    with METRICS.measure('phase:finish'):
+        archive_history(
+            run, [result for shard_result in shard_results for result in shard_result['results']], dry_run
+        )
+        finish_run(pdc, run, summary['unfinished'], dry_run)
+
+    if profile:
+        print_metrics()
+    return summary
 
 
 if __name__ == '__main__':
@@ -261,7 +2759,27 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('dotenv_path')
     parser.add_argument('--no-dry-run', action='store_true')
+    parser.add_argument('--sharded', choices=['in-process', 'multiprocessing', 'sqs'],
+                        help='Process the hazards in shards dispatched through the given queue')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print per-operation latency, call, byte and error metrics at the end of the run')
+    plan_group = parser.add_mutually_exclusive_group()
+    plan_group.add_argument('--plan', metavar='PLAN_LOCATION',
+                            help='Write the changes that a run would make to a plan file, without making them')
+    plan_group.add_argument('--apply', metavar='PLAN_LOCATION', help='Make the changes in a plan file')
+    plan_group.add_argument('--history-since', metavar='YYYY-MM-DD', type=date.fromisoformat,
+                            help='Summarize the hazard history archive at HISTORY_LOCATION since the given date')
     args = parser.parse_args()
 
     load_dotenv(dotenv_path=args.dotenv_path)
-    main(dry_run=(not args.no_dry_run))
+    if args.history_since:
+        today = datetime.now(tz=timezone.utc).date()
+        print(json.dumps(summarize_history(get_env_var('HISTORY_LOCATION'), args.history_since, today), indent=2))
+    elif args.plan:
+        plan_main(args.plan)
+    elif args.apply:
+        apply_main(args.apply, dry_run=(not args.no_dry_run))
+    elif args.sharded:
+        coordinate(dry_run=(not args.no_dry_run), queue=get_shard_queue(args.sharded), profile=args.profile)
+    else:
+        main(dry_run=(not args.no_dry_run), profile=args.profile)
@@ -1,8 +1,12 @@
+import json
 import os
-from datetime import datetime, timedelta, timezone
-from unittest.mock import NonCallableMock, patch, MagicMock, call
+import time
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import ANY, NonCallableMock, patch, MagicMock, call
 
 import pytest
+import requests
+from botocore.exceptions import ClientError
 
 import hyp3_floods
 
@@ -17,65 +21,83 @@ MOCK_ENV = {
 
 @patch('hyp3_floods.get_current_time_in_ms')
 @patch('hyp3_floods.process_active_hazard')
-@patch('hyp3_floods.get_active_hazards')
+@patch('hyp3_floods.PDCHazardsAPI')
 @patch('hyp3_floods.HyP3SubscriptionsAPI')
+@patch.dict(hyp3_floods._PDC_APIS, clear=True)
+@patch.dict(hyp3_floods._HYP3_APIS, clear=True)
 @patch.dict(os.environ, MOCK_ENV, clear=True)
 def test_lambda_handler(
         mock_hyp3_api_class: MagicMock,
-        mock_get_active_hazards: MagicMock,
+        mock_pdc_api_class: MagicMock,
         mock_process_active_hazard: MagicMock,
         mock_get_current_time_in_ms: MagicMock,
         ):
+    mock_pdc_api = NonCallableMock()
+    mock_pdc_api_class.return_value = mock_pdc_api
+
     mock_hyp3_api = NonCallableMock()
+    mock_hyp3_api.get_all_subscriptions.return_value = []
     mock_hyp3_api_class.return_value = mock_hyp3_api
 
     active_hazards = [
         {'uuid': '0',
+         'hazard_ID': 0,
          'category_ID': 'EVENT',
          'severity_ID': 'WARNING',
          'type_ID': 'FLOOD',
          'start_Date': 1653658144630},
         {'uuid': '1',
+         'hazard_ID': 1,
          'category_ID': 'EVENT',
          'severity_ID': 'WARNING',
          'type_ID': 'foo',
          'start_Date': 1653658144630},
         {'uuid': '2',
+         'hazard_ID': 2,
          'category_ID': 'EVENT',
          'severity_ID': 'WARNING',
          'type_ID': 'FLOOD',
          'start_Date': 1653658144640},
         {'uuid': '3',
+         'hazard_ID': 3,
          'category_ID': 'EVENT',
          'severity_ID': 'WARNING',
          'type_ID': 'bar',
          'start_Date': 1653658144640},
         {'uuid': '4',
+         'hazard_ID': 4,
          'category_ID': 'EVENT',
          'severity_ID': 'WARNING',
          'type_ID': 'FLOOD',
          'start_Date': 1653658144650},
         {'uuid': '5',
+         'hazard_ID': 5,
          'category_ID': 'EVENT',
          'severity_ID': 'WARNING',
          'type_ID': 'baz',
          'start_Date': 1653658144650},
     ]
-    mock_get_active_hazards.return_value = active_hazards
+    mock_pdc_api.iter_active_hazards.return_value = iter(active_hazards)
 
     mock_get_current_time_in_ms.return_value = 1653658144647
 
     hyp3_floods.lambda_handler(None, None)
 
-    mock_hyp3_api_class.assert_called_once_with('test-url', 'test-user', 'test-pass')
-    mock_get_active_hazards.assert_called_once_with('test-token')
+    mock_hyp3_api_class.assert_called_once_with('test-url', 'test-user', 'test-pass', cookie_location=None)
+    mock_pdc_api_class.assert_called_once_with('test-token', api_url=hyp3_floods.PDC_URL)
+    mock_pdc_api.iter_active_hazards.assert_called_once_with()
     mock_get_current_time_in_ms.assert_called_once_with()
 
     end = '2022-05-27T16:29:04Z'
-    assert mock_process_active_hazard.mock_calls == [
-        call('test-token', mock_hyp3_api, active_hazards[0], end, dry_run=False),
-        call('test-token', mock_hyp3_api, active_hazards[2], end, dry_run=False),
-    ]
+    assert mock_process_active_hazard.call_count == 2
+    mock_process_active_hazard.assert_has_calls([
+        call(mock_pdc_api, mock_hyp3_api, active_hazards[0], end, dry_run=False, subscription_index={}, aoi_cache=ANY,
+             end_date_refresh=timedelta(hours=1), snapshot=ANY, geometry=hyp3_floods.GeometryOptions(),
+             aoi=None, resolve_duplicates=True),
+        call(mock_pdc_api, mock_hyp3_api, active_hazards[2], end, dry_run=False, subscription_index={}, aoi_cache=ANY,
+             end_date_refresh=timedelta(hours=1), snapshot=ANY, geometry=hyp3_floods.GeometryOptions(),
+             aoi=None, resolve_duplicates=True),
+    ], any_order=True)
 
 
 @patch.dict(os.environ, {}, clear=True)
@@ -84,13 +106,160 @@ def test_lambda_handler_missing_env_var():
         hyp3_floods.lambda_handler(None, None)
 
 
-@patch('hyp3_floods.get_aoi')
-def test_process_active_hazard_submit(mock_get_aoi: MagicMock):
+@patch('hyp3_floods.process_active_hazard')
+def test_process_active_hazards_deadline(mock_process_active_hazard: MagicMock):
+    mock_process_active_hazard.return_value = 'updated'
+    hazards = [{'uuid': '0'}, {'uuid': '1'}]
+
+    results = hyp3_floods.process_active_hazards(
+        NonCallableMock(), NonCallableMock(), hazards, 'test-end-datetime', dry_run=False, deadline=time.monotonic()
+    )
+
+    assert results == [hyp3_floods.HazardResult('0', 'skipped'), hyp3_floods.HazardResult('1', 'skipped')]
+    mock_process_active_hazard.assert_not_called()
+
+
+def test_get_deadline():
+    mock_context = NonCallableMock()
+    mock_context.get_remaining_time_in_millis.return_value = 900_000
+
+    with patch('time.monotonic', return_value=100.0):
+        assert hyp3_floods.get_deadline(mock_context, margin=timedelta(seconds=60)) == 940.0
+
+
+@patch.dict(hyp3_floods._EARTHDATA_COOKIES, clear=True)
+def test_hyp3_api_session_reuse(tmp_path):
+    location = str(tmp_path / 'cookies.json')
+
+    def log_in(url, auth, timeout):
+        assert url == hyp3_floods.EARTHDATA_LOGIN_URL
+        assert timeout == hyp3_floods.HYP3_TIMEOUT
+        assert auth == ('test-user', 'test-pass')
+        session.cookies.set('asf-urs', 'test-cookie', domain='.asf.alaska.edu', expires=time.time() + 3600)
+        return MagicMock(status_code=200)
+
+    session = requests.Session()
+    with patch('requests.Session', return_value=session), patch.object(session, 'get', side_effect=log_in) as mock_get:
+        hyp3_floods.HyP3SubscriptionsAPI('test-url', 'test-user', 'test-pass', cookie_location=location)
+        hyp3_floods.HyP3SubscriptionsAPI('test-url', 'test-user', 'test-pass', cookie_location=location)
+        assert mock_get.call_count == 1
+
+        hyp3_floods._EARTHDATA_COOKIES.clear()
+        hyp3_floods.HyP3SubscriptionsAPI('test-url', 'test-user', 'test-pass', cookie_location=location)
+        assert mock_get.call_count == 1
+
+    cookies = hyp3_floods.get_cached_earthdata_cookies('test-user', location)
+    assert [(cookie['name'], cookie['value']) for cookie in cookies] == [('asf-urs', 'test-cookie')]
+    assert hyp3_floods.get_cached_earthdata_cookies('other-user', location) is None
+
+    hyp3_floods._EARTHDATA_COOKIES['test-user'][0]['expires'] = time.time() + 60
+    assert hyp3_floods.get_cached_earthdata_cookies('test-user', location) is None
+
+
+@patch.dict(hyp3_floods._PDC_APIS, clear=True)
+@patch.dict(hyp3_floods._HYP3_APIS, clear=True)
+@patch('hyp3_floods.HyP3SubscriptionsAPI._get_hyp3_api_session')
+def test_api_client_reuse(mock_get_hyp3_api_session: MagicMock):
+    pdc = hyp3_floods.get_pdc_api('test-token')
+    pdc.retries = 3
+    for _ in range(hyp3_floods.CIRCUIT_BREAKER_THRESHOLD):
+        pdc.circuit_breaker.record_failure()
+
+    assert hyp3_floods.get_pdc_api('test-token') is pdc
+    assert pdc.retries == 0
+    assert not pdc.circuit_breaker.is_open
+    assert hyp3_floods.get_pdc_api('other-token') is not pdc
+
+    hyp3 = hyp3_floods.get_hyp3_api('test-url', 'test-user', 'test-pass')
+    assert hyp3_floods.get_hyp3_api('test-url', 'test-user', 'test-pass') is hyp3
+    assert hyp3_floods.get_hyp3_api('test-url', 'other-user', 'test-pass') is not hyp3
+    assert mock_get_hyp3_api_session.call_count == 2
+
+
+def test_hyp3_api_reauthenticates_on_401():
+    stale_session, fresh_session = MagicMock(), MagicMock()
+    stale_session.get.return_value = MagicMock(status_code=401)
+    fresh_session.get.return_value = MagicMock(status_code=200)
+    fresh_session.get.return_value.json.return_value = {'subscriptions': []}
+
+    with patch('hyp3_floods.HyP3SubscriptionsAPI._get_hyp3_api_session', return_value=stale_session), \
+            patch('hyp3_floods.HyP3SubscriptionsAPI._log_in', return_value=fresh_session) as mock_log_in:
+        hyp3 = hyp3_floods.HyP3SubscriptionsAPI('test-url', 'test-user', 'test-pass')
+        assert hyp3.get_subscriptions_by_name('test-name') == {'subscriptions': []}
+
+    mock_log_in.assert_called_once_with('test-user', 'test-pass', None)
+    stale_session.get.assert_called_once_with(
+        'test-url/subscriptions', timeout=hyp3_floods.HYP3_TIMEOUT, params={'name': 'test-name'}
+    )
+    fresh_session.get.assert_called_once_with(
+        'test-url/subscriptions', timeout=hyp3_floods.HYP3_TIMEOUT, params={'name': 'test-name'}
+    )
+
+
+def test_hyp3_api_circuit_breaker():
+    mock_session = MagicMock()
+    mock_session.patch.return_value = MagicMock(status_code=503)
+    mock_session.patch.return_value.raise_for_status.side_effect = requests.HTTPError('503')
+
+    with patch('hyp3_floods.HyP3SubscriptionsAPI._get_hyp3_api_session', return_value=mock_session):
+        hyp3 = hyp3_floods.HyP3SubscriptionsAPI('test-url', 'test-user', 'test-pass')
+
+    for _ in range(hyp3_floods.CIRCUIT_BREAKER_THRESHOLD):
+        with pytest.raises(requests.HTTPError):
+            hyp3.update_subscription('test-subscription-id', enabled=True)
+
+    with pytest.raises(hyp3_floods.CircuitOpen):
+        hyp3.update_subscription('test-subscription-id', enabled=True)
+
+    assert mock_session.patch.call_count == hyp3_floods.CIRCUIT_BREAKER_THRESHOLD
+
+
+def test_circuit_breaker_reset():
+    circuit_breaker = hyp3_floods.CircuitBreaker('test', failure_threshold=2)
+
+    circuit_breaker.record_failure()
+    circuit_breaker.record_response(MagicMock(status_code=400))
+    circuit_breaker.record_failure()
+    circuit_breaker.check()
+
+    circuit_breaker.record_response(MagicMock(status_code=429))
+    assert circuit_breaker.is_open
+    with pytest.raises(hyp3_floods.CircuitOpen):
+        circuit_breaker.check()
+
+
+@patch('hyp3_floods.process_active_hazard')
+def test_process_active_hazards(mock_process_active_hazard: MagicMock):
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+    hazards = [{'uuid': str(i)} for i in range(10)]
+    error = requests.HTTPError('test-error')
+
+    def process_active_hazard(pdc, hyp3, hazard, end, **kwargs):
+        time.sleep(0.01 * (10 - int(hazard['uuid'])))
+        if hazard['uuid'] == '3':
+            raise error
+        return 'updated'
+
+    mock_process_active_hazard.side_effect = process_active_hazard
+
+    results = hyp3_floods.process_active_hazards(
+        NonCallableMock(), mock_hyp3, hazards, 'test-end-datetime', dry_run=False, max_workers=4
+    )
+
+    assert results == [
+        hyp3_floods.HazardResult(str(i), error=error) if i == 3 else hyp3_floods.HazardResult(str(i), 'updated')
+        for i in range(10)
+    ]
+    assert mock_process_active_hazard.call_count == 10
+
+
+def test_process_active_hazard_submit():
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
     mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
     mock_hyp3.get_subscriptions_by_name.return_value = {'subscriptions': []}
     mock_hyp3.submit_subscription.return_value = {'subscription': {'subscription_id': ''}}
 
-    mock_get_aoi.return_value = 'POLYGON((48.0 38.0))'
+    mock_pdc.get_aoi.return_value = 'POLYGON((48.0 38.0))'
 
     hazard = {
         'uuid': '123',
@@ -99,9 +268,9 @@ def test_process_active_hazard_submit(mock_get_aoi: MagicMock):
     }
     end = 'test-end-datetime'
 
-    hyp3_floods.process_active_hazard('test-token', mock_hyp3, hazard, end, dry_run=False)
+    hyp3_floods.process_active_hazard(mock_pdc, mock_hyp3, hazard, end, dry_run=False)
 
-    mock_get_aoi.assert_called_once_with('test-token', 789)
+    mock_pdc.get_aoi.assert_called_once_with(789)
 
     name = 'PDC-hazard-123'
     new_subscription = {
@@ -134,8 +303,8 @@ def test_process_active_hazard_submit(mock_get_aoi: MagicMock):
 
 
 @patch('builtins.print')
-@patch('hyp3_floods.get_aoi')
-def test_process_active_hazard_update(mock_get_aoi: MagicMock, mock_print: MagicMock):
+def test_process_active_hazard_update(mock_print: MagicMock):
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
     mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
     mock_hyp3.get_subscriptions_by_name.return_value = {
         'subscriptions': [
@@ -149,7 +318,7 @@ def test_process_active_hazard_update(mock_get_aoi: MagicMock, mock_print: Magic
         ]
     }
 
-    mock_get_aoi.return_value = 'POLYGON((2.0 1.0))'
+    mock_pdc.get_aoi.return_value = 'POLYGON((2.0 1.0))'
 
     hazard = {
         'uuid': '123',
@@ -157,9 +326,9 @@ def test_process_active_hazard_update(mock_get_aoi: MagicMock, mock_print: Magic
         'start_Date': '1655251200000',
     }
 
-    hyp3_floods.process_active_hazard('test-token', mock_hyp3, hazard, 'test-end-datetime', dry_run=False)
+    hyp3_floods.process_active_hazard(mock_pdc, mock_hyp3, hazard, 'test-end-datetime', dry_run=False)
 
-    mock_get_aoi.assert_called_once_with('test-token', 789)
+    mock_pdc.get_aoi.assert_called_once_with(789)
 
     mock_hyp3.get_subscriptions_by_name.assert_called_once_with('PDC-hazard-123')
 
@@ -182,8 +351,76 @@ def test_process_active_hazard_update(mock_get_aoi: MagicMock, mock_print: Magic
     ) in mock_print.mock_calls
 
 
-@patch('hyp3_floods.get_aoi')
-def test_process_active_hazard_duplicate_subscription_names(mock_get_aoi: MagicMock):
+def test_process_active_hazard_unchanged():
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+    mock_hyp3.get_subscriptions_by_name.return_value = {
+        'subscriptions': [
+            {
+                'subscription_id': 'test-subscription-id',
+                'search_parameters': {
+                    'start': '2022-06-14T23:00:00Z',
+                    'end': '2022-06-15T02:30:00Z',
+                    'intersectsWith': 'POLYGON((2.0 1.0))',
+                },
+                'enabled': True,
+            }
+        ]
+    }
+
+    mock_pdc.get_aoi.return_value = 'POLYGON((2.0 1.0))'
+
+    hazard = {
+        'uuid': '123',
+        'hazard_ID': 789,
+        'start_Date': '1655251200000',
+    }
+
+    assert hyp3_floods.process_active_hazard(
+        mock_pdc, mock_hyp3, hazard, '2022-06-15T03:00:00Z', dry_run=False, end_date_refresh=timedelta(hours=1)
+    ) == 'unchanged'
+    mock_hyp3.update_subscription.assert_not_called()
+
+    assert hyp3_floods.process_active_hazard(
+        mock_pdc, mock_hyp3, hazard, '2022-06-15T03:30:00Z', dry_run=False, end_date_refresh=timedelta(hours=1)
+    ) == 'updated'
+    mock_hyp3.update_subscription.assert_called_once()
+
+
+def test_subscription_needs_update():
+    subscription = {
+        'search_parameters': {
+            'start': '2022-06-14T23:00:00Z',
+            'end': '2022-06-15T02:00:00Z',
+            'intersectsWith': 'POLYGON((2.0 1.0))',
+        },
+        'enabled': True,
+    }
+    start, aoi, refresh = '2022-06-14T23:00:00Z', 'POLYGON((2.0 1.0))', timedelta(hours=1)
+
+    assert not hyp3_floods.subscription_needs_update(subscription, start, '2022-06-15T02:59:59Z', aoi, refresh)
+    assert hyp3_floods.subscription_needs_update(subscription, start, '2022-06-15T03:00:00Z', aoi, refresh)
+
+    assert hyp3_floods.subscription_needs_update(
+        subscription, '2022-06-14T22:00:00Z', '2022-06-15T02:00:00Z', aoi, refresh
+    )
+    assert hyp3_floods.subscription_needs_update(
+        subscription, start, '2022-06-15T02:00:00Z', 'POLYGON((3.0 1.0))', refresh
+    )
+    assert hyp3_floods.subscription_needs_update(
+        {**subscription, 'enabled': False}, start, '2022-06-15T02:00:00Z', aoi, refresh
+    )
+
+    assert not hyp3_floods.subscription_needs_update(
+        subscription, start, '2022-06-15T02:00:00Z', 'POLYGON ((2.0 1.0))', refresh, aoi_tolerance=1e-5
+    )
+    assert hyp3_floods.subscription_needs_update(
+        subscription, start, '2022-06-15T02:00:00Z', 'POLYGON ((2.0 1.0))', refresh
+    )
+
+
+def test_process_active_hazard_duplicate_subscription_names():
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
     mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
     mock_hyp3.get_subscriptions_by_name.return_value = {
         'subscriptions': [{'subscription_id': 'foo'}, {'subscription_id': 'bar'}]
@@ -192,14 +429,917 @@ def test_process_active_hazard_duplicate_subscription_names(mock_get_aoi: MagicM
     hazard = {'uuid': '123', 'hazard_ID': 789, 'start_Date': '1'}
 
     with pytest.raises(hyp3_floods.DuplicateSubscriptionNames):
-        hyp3_floods.process_active_hazard('test-token', mock_hyp3, hazard, 'test-end-datetime', dry_run=False)
+        hyp3_floods.process_active_hazard(mock_pdc, mock_hyp3, hazard, 'test-end-datetime', dry_run=False)
 
-    mock_get_aoi.assert_called_once_with('test-token', 789)
+    mock_pdc.get_aoi.assert_called_once_with(789)
 
     mock_hyp3.get_subscriptions_by_name.assert_called_once_with('PDC-hazard-123')
 
 
-def test_filter_hazards():
+def test_get_all_subscriptions():
+    mock_session = MagicMock()
+    mock_session.get.return_value.json.side_effect = [
+        {'subscriptions': [{'subscription_id': '0'}, {'subscription_id': '1'}], 'next': 'test-url/next-page'},
+        {'subscriptions': [{'subscription_id': '2'}]},
+    ]
+
+    with patch('hyp3_floods.HyP3SubscriptionsAPI._get_hyp3_api_session', return_value=mock_session):
+        hyp3 = hyp3_floods.HyP3SubscriptionsAPI('test-url', 'test-user', 'test-pass')
+
+    assert hyp3.get_all_subscriptions(enabled=True) == [
+        {'subscription_id': '0'}, {'subscription_id': '1'}, {'subscription_id': '2'}
+    ]
+    assert mock_session.get.call_args_list == [
+        call('test-url/subscriptions', timeout=hyp3_floods.HYP3_TIMEOUT, params={'enabled': True}),
+        call('test-url/next-page', timeout=hyp3_floods.HYP3_TIMEOUT, params=None),
+    ]
+
+
+def test_get_subscription_index():
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+    subscriptions = [
+        {'subscription_id': '0', 'job_specification': {'name': 'PDC-hazard-123'}},
+        {'subscription_id': '1', 'job_specification': {'name': 'foo'}},
+        {'subscription_id': '2', 'job_specification': {'name': 'PDC-hazard-456'}},
+        {'subscription_id': '3', 'job_specification': {'name': 'PDC-hazard-123'}},
+    ]
+    mock_hyp3.get_all_subscriptions.return_value = subscriptions
+
+    assert hyp3_floods.get_subscription_index(mock_hyp3) == {
+        'PDC-hazard-123': [subscriptions[0], subscriptions[3]],
+        'PDC-hazard-456': [subscriptions[2]],
+    }
+
+
+def test_get_existing_subscription_from_index():
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+    subscription_index = {
+        'PDC-hazard-123': [{'subscription_id': '0'}],
+        'PDC-hazard-456': [{'subscription_id': '1'}, {'subscription_id': '2'}],
+    }
+
+    assert hyp3_floods.get_existing_subscription(mock_hyp3, 'PDC-hazard-123', subscription_index) == \
+           {'subscription_id': '0'}
+    assert hyp3_floods.get_existing_subscription(mock_hyp3, 'PDC-hazard-789', subscription_index) is None
+
+    with pytest.raises(hyp3_floods.DuplicateSubscriptionNames):
+        hyp3_floods.get_existing_subscription(mock_hyp3, 'PDC-hazard-456', subscription_index)
+
+    mock_hyp3.get_subscriptions_by_name.assert_not_called()
+
+
+def test_resolve_duplicate_subscriptions():
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+    subscriptions = [
+        {'subscription_id': '0', 'creation_date': '2022-06-15T00:00:02Z', 'enabled': True},
+        {'subscription_id': '1', 'creation_date': '2022-06-15T00:00:01Z', 'enabled': True},
+        {'subscription_id': '2', 'creation_date': '2022-06-15T00:00:03Z', 'enabled': False},
+    ]
+    mock_hyp3.get_subscriptions_by_name.return_value = {'subscriptions': subscriptions}
+
+    assert hyp3_floods.resolve_duplicate_subscriptions(mock_hyp3, 'PDC-hazard-123', dry_run=False) == subscriptions[1]
+    mock_hyp3.update_subscription.assert_called_once_with(subscription_id='0', enabled=False)
+
+    subscriptions[0]['enabled'] = False
+    assert hyp3_floods.get_existing_subscription(mock_hyp3, 'PDC-hazard-123') == subscriptions[1]
+
+
+@patch('hyp3_floods.get_current_time_in_ms')
+@patch('hyp3_floods.process_active_hazard')
+@patch('hyp3_floods.get_api_clients')
+@patch.dict(os.environ, {}, clear=True)
+def test_hazard_event_handler(
+        mock_get_api_clients: MagicMock,
+        mock_process_active_hazard: MagicMock,
+        mock_get_current_time_in_ms: MagicMock,
+        capsys):
+    mock_pdc, mock_hyp3 = NonCallableMock(), NonCallableMock()
+    mock_get_api_clients.return_value = (mock_pdc, mock_hyp3)
+    mock_get_current_time_in_ms.return_value = 1653658144000
+    mock_process_active_hazard.side_effect = ['submitted', requests.HTTPError('test-error')]
+
+    def hazard(uuid, **kwargs):
+        return {'uuid': uuid, 'hazard_ID': 1, 'type_ID': 'FLOOD', 'category_ID': 'EVENT', 'severity_ID': 'WARNING',
+                'start_Date': '1653658143000', 'extra_field': 'foo', **kwargs}
+
+    event = {'Records': [
+        {'messageId': 'm0', 'body': json.dumps(hazard('0'))},
+        {'messageId': 'm1', 'body': json.dumps({'hazard': hazard('1', type_ID='DROUGHT')})},
+        {'messageId': 'm2', 'body': json.dumps({'uuid': '2'})},
+        {'messageId': 'm3', 'body': json.dumps(hazard('3'))},
+        {'messageId': 'm4', 'body': 'foo'},
+        {'messageId': 'm5', 'body': json.dumps({'hazard': [hazard('5')]})},
+        {'messageId': 'm6', 'body': json.dumps(hazard('6', start_Date='2022-06-01'))},
+    ]}
+    assert hyp3_floods.hazard_event_handler(event, None) == {'batchItemFailures': [
+        {'itemIdentifier': 'm3'}, {'itemIdentifier': 'm4'}, {'itemIdentifier': 'm5'}, {'itemIdentifier': 'm6'},
+    ]}
+    assert mock_process_active_hazard.call_count == 2
+
+    expected_hazard = hazard('0')
+    del expected_hazard['extra_field']
+    assert mock_process_active_hazard.call_args_list[0] == call(
+        mock_pdc, mock_hyp3, expected_hazard, '2022-05-27T16:29:04Z', dry_run=False, aoi_cache=ANY,
+        end_date_refresh=hyp3_floods.HAZARD_END_DATE_REFRESH, geometry=hyp3_floods.GeometryOptions(),
+        resolve_duplicates=True,
+    )
+
+    mock_process_active_hazard.side_effect = ['unchanged']
+    response = hyp3_floods.hazard_event_handler({'body': json.dumps(hazard('4'))}, None)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == [
+        {'uuid': '4', 'action': 'unchanged', 'error': None, 'unfinished': False}
+    ]
+
+    mock_process_active_hazard.reset_mock()
+    for invalid_event in (
+            {'body': '{'}, {'body': '[]'}, {'body': '!', 'isBase64Encoded': True},
+            {'body': json.dumps(hazard('7', start_Date='2022-06-01'))}):
+        assert hyp3_floods.hazard_event_handler(invalid_event, None)['statusCode'] == 400
+    mock_process_active_hazard.assert_not_called()
+
+    capsys.readouterr()
+    hyp3_floods.hazard_event_handler({'body': '{'}, None)
+    printed = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    assert printed == []
+
+    mock_process_active_hazard.side_effect = ['unchanged']
+    hyp3_floods.hazard_event_handler(hazard('8'), None)
+    printed = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    assert [document['Operation'] for document in printed] == ['phase:process']
+
+
+def test_sweep_subscriptions():
+    def subscription(subscription_id, uuid, end, enabled=True):
+        return {
+            'subscription_id': subscription_id,
+            'job_specification': {'name': f'PDC-hazard-{uuid}'},
+            'search_parameters': {'end': end},
+            'enabled': enabled,
+        }
+
+    subscriptions = [
+        subscription('0', 'active', '2022-06-01T00:00:00Z'),
+        subscription('1', 'inactive-1', '2022-06-13T00:00:00Z'),
+        subscription('2', 'inactive-2', '2022-06-12T00:00:00Z'),
+        subscription('3', 'inactive-3', '2022-06-14T12:00:00Z'),
+        subscription('4', 'inactive-4', '2022-06-01T00:00:00Z', enabled=False),
+        subscription('5', 'inactive-5', '2022-06-11T00:00:00Z'),
+    ]
+    subscription_index = {
+        subscription['job_specification']['name']: [subscription] for subscription in subscriptions
+    }
+    active_hazards = [{'uuid': 'active'}]
+    now = datetime(2022, 6, 15, tzinfo=timezone.utc)
+
+    assert hyp3_floods.find_stale_subscriptions(subscription_index, active_hazards, now) == [
+        subscriptions[5], subscriptions[2], subscriptions[1]
+    ]
+
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+    report = hyp3_floods.sweep_subscriptions(
+        mock_hyp3, subscription_index, active_hazards, now, dry_run=True, batch_size=2
+    )
+    assert report == {'stale': 3, 'deferred': 1, 'disabled': ['5', '2'], 'errors': {}}
+    mock_hyp3.update_subscription.assert_not_called()
+
+    mock_hyp3.update_subscription.side_effect = [None, requests.HTTPError('test-error'), None]
+    report = hyp3_floods.sweep_subscriptions(
+        mock_hyp3, subscription_index, active_hazards, now, dry_run=False, batch_size=3
+    )
+    assert report == {'stale': 3, 'deferred': 0, 'disabled': ['5', '1'], 'errors': {'2': 'test-error'}}
+    assert mock_hyp3.update_subscription.call_args_list == [
+        call(subscription_id=subscription_id, enabled=False) for subscription_id in ('5', '2', '1')
+    ]
+
+
+def test_metrics():
+    metrics = hyp3_floods.Metrics()
+
+    with patch('time.perf_counter', side_effect=[0.0, 0.005, 1.0, 1.2, 2.0, 62.0]):
+        with metrics.measure('test-operation'):
+            metrics.add_bytes(100)
+        with pytest.raises(ValueError):
+            with metrics.measure('test-operation'):
+                raise ValueError()
+        with metrics.measure('other-operation'):
+            pass
+    metrics.add_bytes(1000)
+
+    operations = metrics.get_operations()
+    assert operations['test-operation'].calls == 2
+    assert operations['test-operation'].errors == 1
+    assert operations['test-operation'].bytes == 100
+
+    other_operation, test_operation = metrics.to_emf(timestamp_ms=123)
+    assert other_operation['Operation'] == 'other-operation'
+    assert other_operation['Latency']['Values'] == [60000.0]
+    assert other_operation['Latency']['Counts'] == [1]
+    assert test_operation['Operation'] == 'test-operation'
+    assert test_operation['Latency']['Values'] == [10.0, 250.0]
+    assert test_operation['Latency']['Counts'] == [1, 1]
+    assert test_operation['_aws']['Timestamp'] == 123
+    assert (test_operation['Calls'], test_operation['Errors'], test_operation['Bytes']) == (2, 1, 100)
+
+
+def test_instrumented_generator():
+    @hyp3_floods.instrumented('test-generator')
+    def generate():
+        hyp3_floods.METRICS.add_bytes(10)
+        yield 1
+        hyp3_floods.METRICS.add_bytes(20)
+        yield 2
+
+    hyp3_floods.METRICS.reset()
+    assert list(generate()) == [1, 2]
+    metrics = hyp3_floods.METRICS.get_operations()['test-generator']
+    assert (metrics.calls, metrics.errors, metrics.bytes) == (1, 0, 30)
+
+
+def test_make_plan():
+    def hazard(uuid):
+        return {'uuid': uuid, 'hazard_ID': int(uuid), 'start_Date': '1655251200000'}
+
+    def subscription(subscription_id, uuid, start, end, aoi):
+        return {
+            'subscription_id': subscription_id,
+            'job_specification': {'name': f'PDC-hazard-{uuid}'},
+            'search_parameters': {'start': start, 'end': end, 'intersectsWith': aoi},
+            'enabled': True,
+        }
+
+    hazards = [hazard(str(i)) for i in range(4)]
+    start = '2022-06-14T23:00:00Z'
+    aoi = 'POLYGON ((0.0 0.0, 1.0 0.0, 1.0 1.0, 0.0 0.0))'
+    subscriptions = [
+        subscription('a', '1', start, '2022-06-15T03:00:00Z', aoi),
+        subscription('b', '2', start, '2022-06-15T00:00:00Z', aoi),
+        subscription('c', '3', start, '2022-06-15T03:00:00Z', aoi),
+        subscription('d', '9', start, '2022-06-01T00:00:00Z', aoi),
+    ]
+    run = hyp3_floods.PreparedRun(
+        active_hazards=hazards,
+        hazards_to_process=hazards[:3],
+        end='2022-06-15T03:00:00Z',
+        subscription_index={
+            subscription['job_specification']['name']: [subscription] for subscription in subscriptions
+        },
+        aoi_cache=hyp3_floods.AOICache(),
+        snapshot=hyp3_floods.HazardSnapshot(),
+        geometry=hyp3_floods.GeometryOptions(),
+        aois=None,
+    )
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
+    mock_pdc.get_aoi_if_modified.return_value = (aoi, None)
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+
+    plan = hyp3_floods.make_plan(mock_pdc, mock_hyp3, run, datetime(2022, 6, 15, tzinfo=timezone.utc))
+
+    assert plan['created'] == '2022-06-15T00:00:00Z'
+    changes = [
+        (change['action'], change.get('hazard_uuid'), change.get('subscription_id')) for change in plan['changes']
+    ]
+    assert changes == [
+        ('create', '0', None), ('noop', '1', 'a'), ('update', '2', 'b'), ('noop', '3', 'c'), ('disable', None, 'd')
+    ]
+    assert plan['changes'][0]['subscription'] == hyp3_floods.prepare_new_subscription(
+        start, run.end, aoi, 'PDC-hazard-0'
+    )
+    assert plan['changes'][2]['changes'] == {'start': start, 'end': run.end, 'intersectsWith': aoi, 'enabled': True}
+    assert plan['errors'] == {}
+    assert plan['validation'] == {'PDC-hazard-0': None}
+    assert json.loads(json.dumps(plan)) == plan
+
+    assert mock_pdc.get_aoi_if_modified.call_count == 3
+    mock_hyp3.submit_subscription.assert_called_once_with(plan['changes'][0]['subscription'], validate_only=True)
+    mock_hyp3.update_subscription.assert_not_called()
+
+
+def test_apply_plan():
+    plan = {
+        'created': '2022-06-15T00:00:00Z',
+        'changes': [
+            {'action': 'create', 'name': 'PDC-hazard-0', 'subscription': {'test': 'subscription'}},
+            {'action': 'create', 'name': 'PDC-hazard-1', 'subscription': {'test': 'subscription'}},
+            {'action': 'noop', 'subscription_id': 'a'},
+            {'action': 'update', 'subscription_id': 'a', 'changes': {'enabled': True}},
+            {'action': 'update', 'subscription_id': 'gone', 'changes': {'enabled': True}},
+            {'action': 'disable', 'subscription_id': 'b', 'name': 'PDC-hazard-9'},
+        ],
+    }
+    mock_hyp3 = NonCallableMock(hyp3_floods.HyP3SubscriptionsAPI)
+    mock_hyp3.get_all_subscriptions.return_value = [
+        {'subscription_id': 'a', 'job_specification': {'name': 'PDC-hazard-1'}},
+        {'subscription_id': 'b', 'job_specification': {'name': 'PDC-hazard-9'}},
+    ]
+    mock_hyp3.update_subscription.side_effect = [None, requests.HTTPError('test-error')]
+    now = datetime(2022, 6, 15, 0, 30, tzinfo=timezone.utc)
+
+    assert hyp3_floods.apply_plan(mock_hyp3, plan, now, dry_run=False) == {
+        'applied': {'create': 1, 'update': 1},
+        'skipped': {'create': 1, 'update': 1},
+        'error': {'disable': 1},
+    }
+    mock_hyp3.submit_subscription.assert_called_once_with({'test': 'subscription'})
+    assert mock_hyp3.update_subscription.call_args_list == [
+        call(subscription_id='a', enabled=True),
+        call(subscription_id='b', enabled=False),
+    ]
+
+    mock_hyp3.reset_mock()
+    assert hyp3_floods.apply_plan(mock_hyp3, plan, now, dry_run=True) == {
+        'would_apply': {'create': 1, 'update': 1, 'disable': 1},
+        'skipped': {'create': 1, 'update': 1},
+    }
+    mock_hyp3.submit_subscription.assert_not_called()
+    mock_hyp3.update_subscription.assert_not_called()
+
+    with pytest.raises(hyp3_floods.StalePlan):
+        hyp3_floods.apply_plan(mock_hyp3, plan, now + timedelta(hours=1), dry_run=False)
+
+
+def test_hazard_history(tmp_path):
+    location = str(tmp_path / 'history')
+
+    def hazard(uuid):
+        return {'uuid': uuid, 'hazard_ID': int(uuid), 'severity_ID': 'WARNING', 'start_Date': '1', 'update_Date': '2'}
+
+    runs = [
+        (datetime(2022, 6, 14, 23, 45, tzinfo=timezone.utc), [hazard('0'), hazard('1')],
+         {'0': 'submitted', '1': 'submitted'}, {'0': 'a', '1': 'b'}),
+        (datetime(2022, 6, 15, 0, 0, tzinfo=timezone.utc), [hazard('0'), hazard('1'), hazard('2')],
+         {'0': 'updated', '2': 'submitted'}, {'0': 'c', '2': 'd'}),
+        (datetime(2022, 6, 15, 6, 0, tzinfo=timezone.utc), [hazard('0')], {'0': 'updated'}, {'0': 'a'}),
+    ]
+    for run_time, hazards, actions, aoi_hashes in runs:
+        hyp3_floods.archive_run(location, run_time, hazards, actions, aoi_hashes)
+
+    assert sorted(os.listdir(location)) == ['date=2022-06-14', 'date=2022-06-15']
+
+    columns = list(hyp3_floods.iter_history(location, date(2022, 6, 15), date(2022, 6, 15)))
+    assert columns[0] == {
+        'run_time': ['2022-06-15T00:00:00Z'] * 3,
+        'uuid': ['0', '1', '2'],
+        'hazard_ID': [0, 1, 2],
+        'severity_ID': ['WARNING'] * 3,
+        'start_Date': ['1'] * 3,
+        'update_Date': ['2'] * 3,
+        'action': ['updated', None, 'submitted'],
+        'aoi_hash': ['c', None, 'd'],
+    }
+    assert len(columns) == 2
+
+    assert hyp3_floods.summarize_history(location, date(2022, 6, 1), date(2022, 6, 30)) == {
+        'runs': 3,
+        'hazards': 3,
+        'active_hours_median': 0.25,
+        'active_hours_max': 6.25,
+        'hazards_with_aoi_changes': 1,
+        'aoi_changes': 2,
+        'subscriptions_submitted_per_day': {'2022-06-14': 2, '2022-06-15': 1},
+    }
+
+    expected_columns = list(hyp3_floods.iter_history(location, date(2022, 6, 1), date(2022, 6, 30)))
+    assert hyp3_floods.compact_history(location, date(2022, 6, 15)) == f'{location}/date=2022-06-15/runs.json.gz'
+    assert os.listdir(f'{location}/date=2022-06-15') == ['runs.json.gz']
+    assert hyp3_floods.compact_history(location, date(2022, 6, 15)) is None
+    assert hyp3_floods.compact_history(location, date(2022, 6, 16)) is None
+
+    # A run archived after the compaction is read after the compacted runs
+    hyp3_floods.archive_run(location, datetime(2022, 6, 15, 12, 0, tzinfo=timezone.utc), [hazard('3')], {}, {})
+    columns = list(hyp3_floods.iter_history(location, date(2022, 6, 1), date(2022, 6, 30)))
+    assert columns[:3] == expected_columns
+    assert columns[3]['uuid'] == ['3']
+
+    # Run files left behind by an interrupted compaction are not read twice
+    hyp3_floods.compact_history(location, date(2022, 6, 15))
+    hyp3_floods.archive_run(location, *runs[2])
+    assert len(list(hyp3_floods.iter_history(location, date(2022, 6, 1), date(2022, 6, 30)))) == 4
+    hyp3_floods.compact_history(location, date(2022, 6, 15))
+    assert len(list(hyp3_floods.iter_history(location, date(2022, 6, 1), date(2022, 6, 30)))) == 4
+
+
+def test_aoi_cache(tmp_path):
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
+    mock_get_aoi_if_modified = mock_pdc.get_aoi_if_modified
+    location = str(tmp_path / 'aoi-cache.json')
+    aoi_cache = hyp3_floods.AOICache(location)
+
+    mock_get_aoi_if_modified.return_value = ('POLYGON((0.0 0.0))', 'etag-0')
+    assert aoi_cache.get_aoi(mock_pdc, {'hazard_ID': 1, 'update_Date': '100'}) == 'POLYGON((0.0 0.0))'
+    assert aoi_cache.get_aoi(mock_pdc, {'hazard_ID': 1, 'update_Date': '100'}) == 'POLYGON((0.0 0.0))'
+    mock_get_aoi_if_modified.assert_called_once_with(1, etag=None)
+
+    mock_get_aoi_if_modified.reset_mock()
+    mock_get_aoi_if_modified.return_value = (None, 'etag-0')
+    assert aoi_cache.get_aoi(mock_pdc, {'hazard_ID': 1, 'update_Date': '200'}) == 'POLYGON((0.0 0.0))'
+    mock_get_aoi_if_modified.assert_called_once_with(1, etag='etag-0')
+
+    mock_get_aoi_if_modified.return_value = ('POLYGON((1.0 1.0))', None)
+    assert aoi_cache.get_aoi(mock_pdc, {'hazard_ID': 2, 'update_Date': '100'}) == 'POLYGON((1.0 1.0))'
+
+    assert (aoi_cache.hits, aoi_cache.not_modified, aoi_cache.misses) == (1, 1, 2)
+
+    assert aoi_cache.evict({'2'}) == 1
+    aoi_cache.save()
+
+    mock_get_aoi_if_modified.reset_mock()
+    aoi_cache = hyp3_floods.AOICache(location)
+    assert aoi_cache.get_aoi(mock_pdc, {'hazard_ID': 2, 'update_Date': '100'}) == 'POLYGON((1.0 1.0))'
+    mock_get_aoi_if_modified.assert_not_called()
+
+
+@patch('time.sleep')
+def test_pdc_api_retries(mock_sleep: MagicMock):
+    responses = [
+        MagicMock(status_code=503, headers={}),
+        MagicMock(status_code=429, headers={'Retry-After': '2'}),
+        MagicMock(status_code=200, headers={}),
+    ]
+    responses[2].json.return_value = {'wkt': {'text': 'POLYGON((0.0 0.0))'}}
+
+    pdc = hyp3_floods.PDCHazardsAPI('test-token', api_url='test-url', max_retries=2)
+    with patch.object(pdc._session, 'get', side_effect=responses) as mock_get:
+        assert pdc.get_aoi(789) == 'POLYGON((0.0 0.0))'
+
+    assert mock_get.call_count == 3
+    mock_get.assert_called_with(
+        'test-url/hp_srv/services/hazard/789/alertGeography',
+        headers=None,
+        timeout=hyp3_floods.PDC_TIMEOUT,
+        stream=False,
+    )
+    assert pdc.retries == 2
+    responses[0].close.assert_called_once_with()
+    responses[1].close.assert_called_once_with()
+    responses[2].close.assert_not_called()
+    assert mock_sleep.call_args_list[1] == call(2.0)
+    assert 0 <= mock_sleep.call_args_list[0].args[0] <= hyp3_floods.PDC_BACKOFF_BASE
+
+
+@patch('time.sleep')
+def test_pdc_api_retries_exhausted(mock_sleep: MagicMock):
+    pdc = hyp3_floods.PDCHazardsAPI('test-token', api_url='test-url', max_retries=1)
+    with patch.object(pdc._session, 'get', side_effect=requests.Timeout('test-timeout')) as mock_get:
+        with pytest.raises(requests.Timeout):
+            pdc.get_aoi(789)
+
+    assert mock_get.call_count == 2
+    assert pdc.retries == 1
+
+
+@patch('time.sleep')
+def test_api_deadline(mock_sleep: MagicMock):
+    assert hyp3_floods.get_request_timeout((3.05, 30), None) == (3.05, 30)
+    with patch('time.monotonic', return_value=100.0):
+        assert hyp3_floods.get_request_timeout((3.05, 30), 110.0) == (3.05, 10.0)
+        assert hyp3_floods.get_request_timeout((3.05, 30), 102.0) == (2.0, 2.0)
+        with pytest.raises(hyp3_floods.DeadlineExceeded):
+            hyp3_floods.get_request_timeout((3.05, 30), 100.0)
+
+    # Retries stop once the backoff would reach past the deadline
+    pdc = hyp3_floods.PDCHazardsAPI('test-token', api_url='test-url', max_retries=3)
+    pdc.deadline = time.monotonic() + 0.5
+    response = MagicMock(status_code=503, headers={'Retry-After': '1'})
+    response.raise_for_status.side_effect = requests.HTTPError('503')
+    with patch.object(pdc._session, 'get', return_value=response) as mock_get:
+        with pytest.raises(requests.HTTPError):
+            pdc.get_aoi(789)
+    assert mock_get.call_count == 1
+    assert 0 < mock_get.call_args.kwargs['timeout'][1] <= 0.5
+    mock_sleep.assert_not_called()
+
+    mock_session = MagicMock()
+    with patch('hyp3_floods.HyP3SubscriptionsAPI._get_hyp3_api_session', return_value=mock_session):
+        hyp3 = hyp3_floods.HyP3SubscriptionsAPI('test-url', 'test-user', 'test-pass')
+    hyp3.deadline = time.monotonic()
+    with pytest.raises(hyp3_floods.DeadlineExceeded):
+        hyp3.update_subscription('test-subscription-id', enabled=False)
+    mock_session.patch.assert_not_called()
+
+
+def test_prioritize_hazards():
+    hazards = [{'uuid': str(i)} for i in range(5)]
+    subscription_index = {
+        'PDC-hazard-0': [{'search_parameters': {'end': '2022-06-15T03:00:00Z'}}],
+        'PDC-hazard-2': [{'search_parameters': {'end': '2022-06-15T01:00:00Z'}}],
+        'PDC-hazard-3': [{'search_parameters': {'end': '2022-06-15T02:00:00Z'}}],
+    }
+
+    assert hyp3_floods.prioritize_hazards(hazards, subscription_index, checkpoint=set()) == [
+        hazards[1], hazards[4], hazards[2], hazards[3], hazards[0]
+    ]
+    assert hyp3_floods.prioritize_hazards(hazards, subscription_index, checkpoint={'0', '4'}) == [
+        hazards[4], hazards[0], hazards[1], hazards[2], hazards[3]
+    ]
+
+
+def test_hazard_snapshot(tmp_path):
+    location = str(tmp_path / 'snapshot.json')
+    hazards = [
+        {'uuid': '0', 'start_Date': '1', 'update_Date': '10'},
+        {'uuid': '1', 'start_Date': '1', 'update_Date': '10'},
+        {'uuid': '2', 'start_Date': '1', 'update_Date': '10'},
+    ]
+
+    snapshot = hyp3_floods.HazardSnapshot(location)
+    assert snapshot.diff(hazards) == hyp3_floods.HazardDelta(new=hazards, changed=[], unchanged=[], disappeared=[])
+
+    snapshot.record(hazards[0], 'POLYGON((0.0 0.0))')
+    snapshot.record(hazards[1], 'POLYGON((1.0 1.0))')
+    snapshot.save(hazards)
+
+    snapshot = hyp3_floods.HazardSnapshot(location)
+    new_hazards = [
+        {'uuid': '1', 'start_Date': '1', 'update_Date': '20'},
+        {'uuid': '2', 'start_Date': '1', 'update_Date': '10'},
+        {'uuid': '3', 'start_Date': '1', 'update_Date': '10'},
+    ]
+    assert snapshot.diff(new_hazards) == hyp3_floods.HazardDelta(
+        new=[new_hazards[1], new_hazards[2]], changed=[new_hazards[0]], unchanged=[], disappeared=['0']
+    )
+
+    snapshot.record(new_hazards[1], 'POLYGON((2.0 2.0))')
+    snapshot.save(new_hazards)
+    assert snapshot.diff(new_hazards) == hyp3_floods.HazardDelta(
+        new=[new_hazards[2]], changed=[new_hazards[0]], unchanged=[new_hazards[1]], disappeared=[]
+    )
+
+    # A cached AOI that differs from the AOI last applied marks the hazard as changed, even if its dates are unchanged
+    aoi_cache = hyp3_floods.AOICache()
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
+    mock_pdc.get_aoi_if_modified.return_value = ('POLYGON((2.0 2.0))', None)
+    aoi_cache.get_aoi(mock_pdc, {**new_hazards[1], 'hazard_ID': 2})
+    hazards_with_ids = [{**hazard, 'hazard_ID': int(hazard['uuid'])} for hazard in new_hazards]
+    assert snapshot.diff(hazards_with_ids, aoi_cache).unchanged == [hazards_with_ids[1]]
+
+    mock_pdc.get_aoi_if_modified.return_value = ('POLYGON((3.0 3.0))', None)
+    aoi_cache = hyp3_floods.AOICache()
+    aoi_cache.get_aoi(mock_pdc, {**new_hazards[1], 'hazard_ID': 2})
+    assert snapshot.diff(hazards_with_ids, aoi_cache).changed == [hazards_with_ids[0], hazards_with_ids[1]]
+
+
+def test_select_hazards_to_process():
+    hazards = [{'uuid': str(i)} for i in range(4)]
+    delta = hyp3_floods.HazardDelta(new=[hazards[0]], changed=[], unchanged=hazards[1:], disappeared=[])
+    subscription_index = {
+        'PDC-hazard-1': [{'search_parameters': {'end': '2022-06-15T02:30:00Z'}, 'enabled': True}],
+        'PDC-hazard-2': [{'search_parameters': {'end': '2022-06-15T01:30:00Z'}, 'enabled': True}],
+    }
+
+    assert hyp3_floods.select_hazards_to_process(
+        hazards, delta, subscription_index, '2022-06-15T03:00:00Z', timedelta(hours=1)
+    ) == [hazards[0], hazards[2], hazards[3]]
+
+
+def test_checkpoint(tmp_path):
+    location = str(tmp_path / 'checkpoint.json')
+    assert hyp3_floods.load_checkpoint(location) == set()
+
+    results = [
+        hyp3_floods.HazardResult('0', 'updated'),
+        hyp3_floods.HazardResult('1', error=hyp3_floods.CircuitOpen()),
+        hyp3_floods.HazardResult('2', error=requests.HTTPError()),
+        hyp3_floods.HazardResult('3', 'skipped'),
+    ]
+    hyp3_floods.save_checkpoint(location, [result.uuid for result in results if result.unfinished])
+
+    assert hyp3_floods.load_checkpoint(location) == {'1', '3'}
+
+
+def test_shard_hazards():
+    hazards = [{'uuid': str(i)} for i in range(5)]
+    assert hyp3_floods.shard_hazards(hazards, shard_size=2) == [
+        [hazards[0], hazards[3]],
+        [hazards[1], hazards[4]],
+        [hazards[2]],
+    ]
+    assert hyp3_floods.shard_hazards(hazards, shard_size=5) == [hazards]
+    assert hyp3_floods.shard_hazards([], shard_size=5) == []
+
+
+@patch('hyp3_floods.process_active_hazard')
+@patch('hyp3_floods.prepare_run')
+@patch('hyp3_floods.get_api_clients')
+@patch.dict(os.environ, {}, clear=True)
+def test_coordinate(
+        mock_get_api_clients: MagicMock, mock_prepare_run: MagicMock, mock_process_active_hazard: MagicMock):
+    hazards = [{'uuid': str(i), 'hazard_ID': i, 'start_Date': '1655251200000'} for i in range(3)]
+    snapshot = hyp3_floods.HazardSnapshot()
+    mock_get_api_clients.return_value = (NonCallableMock(retries=0), NonCallableMock())
+    mock_prepare_run.return_value = hyp3_floods.PreparedRun(
+        active_hazards=hazards,
+        hazards_to_process=hazards,
+        end='test-end-datetime',
+        subscription_index={'PDC-hazard-1': [{'subscription_id': 'test-subscription-id'}]},
+        aoi_cache=hyp3_floods.AOICache(),
+        snapshot=snapshot,
+        geometry=hyp3_floods.GeometryOptions(),
+        aois=None,
+    )
+
+    def process_active_hazard(pdc, hyp3, hazard, end, **kwargs):
+        if hazard['uuid'] == '2':
+            raise hyp3_floods.CircuitOpen('test-error')
+        kwargs['snapshot'].record(hazard, 'test-aoi')
+        return 'submitted' if kwargs['subscription_index'] == {} else 'updated'
+
+    mock_process_active_hazard.side_effect = process_active_hazard
+
+    summary = hyp3_floods.coordinate(dry_run=True, queue=hyp3_floods.InProcessShardQueue(), shard_size=2)
+
+    assert summary == {
+        'shards': 2,
+        'pending_shards': 0,
+        'hazards': 3,
+        'actions': {'submitted': 1, 'updated': 1},
+        'errors': {'2': 'test-error'},
+        'unfinished': ['2'],
+        'late_shards': 0,
+    }
+    assert set(snapshot.get_updates()) == {'0', '1'}
+
+
+def _process_shard(shard: dict, deadline) -> dict:
+    return {'run_id': shard['run_id'], 'shard': shard['shard'], 'results': [], 'snapshot': {}}
+
+
+def test_multiprocessing_shard_queue():
+    shards = [{'run_id': 'test-run', 'shard': i, 'hazards': []} for i in range(3)]
+    queue = hyp3_floods.MultiprocessingShardQueue(processes=2, worker=_process_shard)
+    assert queue.dispatch(shards, deadline=None) == [_process_shard(shard, None) for shard in shards]
+
+
+@patch('boto3.client')
+def test_sqs_shard_queue(mock_boto3_client: MagicMock, tmp_path):
+    results_location = str(tmp_path / 'results')
+    shards = [
+        {'run_id': 'test-run', 'shard': 0, 'hazards': [], 'subscription_index': {}, 'aois': {}},
+        {'run_id': 'test-run', 'shard': 1, 'hazards': [], 'subscription_index': {'x': 'x' * 300_000}, 'aois': {}},
+        {'run_id': 'test-run', 'shard': 2, 'hazards': [], 'subscription_index': {}, 'aois': {'x': 'x' * 300_000}},
+        {'run_id': 'test-run', 'shard': 3, 'hazards': [{'x': 'x' * 300_000}], 'subscription_index': {}, 'aois': {}},
+        {'run_id': 'test-run', 'shard': 4, 'hazards': [], 'subscription_index': {}, 'aois': {}},
+    ]
+    results = [_process_shard(shard, None) for shard in shards]
+    for result in results:
+        hyp3_floods.save_state(
+            hyp3_floods.get_shard_result_location(results_location, 'test-run', result['shard']), result
+        )
+
+    mock_sqs = mock_boto3_client.return_value
+    mock_sqs.send_message.side_effect = [None, None, None, ClientError({'Error': {}}, 'SendMessage')]
+
+    queue = hyp3_floods.SQSShardQueue('test-queue-url', results_location, poll_interval=0)
+    assert queue.dispatch(shards, deadline=time.monotonic()) == results[:3]
+
+    assert [json.loads(c.kwargs['MessageBody']) for c in mock_sqs.send_message.call_args_list] == [
+        shards[0],
+        {**shards[1], 'subscription_index': None},
+        {**shards[2], 'subscription_index': None, 'aois': None},
+        shards[4],
+    ]
+
+    mock_sqs.send_message.side_effect = None
+    late_shards = [{**shard, 'run_id': 'late-run'} for shard in shards[:2]]
+    assert queue.dispatch(late_shards, deadline=time.monotonic()) == []
+    late_result = {**results[1], 'run_id': 'late-run'}
+    hyp3_floods.save_state(hyp3_floods.get_shard_result_location(results_location, 'late-run', 1), late_result)
+    assert queue.collect_late_results() == [late_result]
+
+
+@patch.dict(os.environ, {'SHARD_QUEUE_URL': 'test-queue-url'}, clear=True)
+def test_get_shard_queue():
+    assert isinstance(hyp3_floods.get_shard_queue('in-process'), hyp3_floods.InProcessShardQueue)
+    with pytest.raises(hyp3_floods.MissingEnvVar):
+        hyp3_floods.get_shard_queue('sqs')
+
+    os.environ['SHARD_RESULTS_LOCATION'] = 'test-location'
+    assert isinstance(hyp3_floods.get_shard_queue(), hyp3_floods.SQSShardQueue)
+
+
+@patch('hyp3_floods.process_shard')
+@patch.dict(os.environ, {}, clear=True)
+def test_worker_handler(mock_process_shard: MagicMock, tmp_path, capsys):
+    shard = {'run_id': 'test-run', 'shard': 3}
+    mock_process_shard.return_value = {'test-key': 'test-value'}
+    event = {'Records': [{'body': json.dumps(shard)}]}
+
+    with pytest.raises(hyp3_floods.MissingEnvVar):
+        hyp3_floods.worker_handler(event, None)
+    mock_process_shard.assert_not_called()
+
+    os.environ['SHARD_RESULTS_LOCATION'] = str(tmp_path)
+    with hyp3_floods.METRICS.measure('stale-operation'):
+        pass
+    hyp3_floods.worker_handler(event, None)
+    mock_process_shard.assert_called_once_with(shard, None)
+    assert hyp3_floods.load_state(str(tmp_path / 'test-run' / 'shard-3.json')) == {'test-key': 'test-value'}
+
+    printed = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [document['Operation'] for document in printed] == ['phase:process']
+
+
+@patch('boto3.client')
+@patch('hyp3_floods._S3_CLIENT', None)
+def test_get_s3_client(mock_boto3_client: MagicMock):
+    mock_s3 = mock_boto3_client.return_value
+    hyp3_floods.save_state('s3://test-bucket/state.json', {'a': 1})
+    hyp3_floods._write_bytes('s3://test-bucket/data', b'data')
+    mock_boto3_client.assert_called_once_with('s3')
+    assert mock_s3.put_object.call_args_list == [
+        call(Bucket='test-bucket', Key='state.json', Body=b'{"a": 1}'),
+        call(Bucket='test-bucket', Key='data', Body=b'data'),
+    ]
+
+
+def test_iter_json_array():
+    text = json.dumps([{'uuid': '0', 'nested': [1, {'a': 'b]'}]}, {'uuid': '1'}, 12345, {'uuid': '2'}])
+    for chunk_size in (1, 2, 7, len(text)):
+        chunks = (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+        assert list(hyp3_floods.iter_json_array(chunks)) == json.loads(text)
+
+    assert list(hyp3_floods.iter_json_array([' [ ', ' ] '])) == []
+
+    with pytest.raises(ValueError):
+        list(hyp3_floods.iter_json_array(['[{"uuid": "0"}, {"uuid"']))
+
+    with pytest.raises(ValueError):
+        list(hyp3_floods.iter_json_array(['{"uuid": "0"}']))
+
+
+def test_fetch_active_hazards():
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
+    mock_pdc.iter_active_hazards.return_value = iter([
+        {'uuid': '0', 'hazard_ID': 0, 'category_ID': 'EVENT', 'severity_ID': 'WARNING', 'type_ID': 'FLOOD',
+         'start_Date': '1', 'update_Date': '2', 'description': 'foo'},
+        {'uuid': '1', 'hazard_ID': 1, 'category_ID': 'EVENT', 'severity_ID': 'WARNING', 'type_ID': 'STORM',
+         'start_Date': '1', 'update_Date': '2', 'description': 'bar'},
+    ])
+
+    assert hyp3_floods.fetch_active_hazards(mock_pdc, current_time_in_ms=1) == [
+        {'uuid': '0', 'hazard_ID': 0, 'category_ID': 'EVENT', 'severity_ID': 'WARNING', 'type_ID': 'FLOOD',
+         'start_Date': '1', 'update_Date': '2'},
+    ]
+
+
+def test_parse_wkt():
+    assert hyp3_floods.parse_wkt('POLYGON((0 0, 1 0, 1 1, 0 0))') == [[[(0.0, 0.0), (1.0, 0.0), (1.0, 1.0)]]]
+    assert hyp3_floods.parse_wkt(
+        'MULTIPOLYGON (((0 0, 4 0, 4 4, 0 0), (1 1, 2 1, 2 2, 1 1)), ((5 5, 6 5, 6 6, 5 5)))'
+    ) == [
+        [[(0.0, 0.0), (4.0, 0.0), (4.0, 4.0)], [(1.0, 1.0), (2.0, 1.0), (2.0, 2.0)]],
+        [[(5.0, 5.0), (6.0, 5.0), (6.0, 6.0)]],
+    ]
+
+    for invalid in ('POINT (0 0)', 'POLYGON((0 0, 1 0, 1 1, 0 0)', 'POLYGON((0 0 0, 1 0 0))', 'POLYGON((a b))'):
+        with pytest.raises(hyp3_floods.InvalidGeometry):
+            hyp3_floods.parse_wkt(invalid)
+
+
+def test_normalize_wkt():
+    expected = 'POLYGON ((0.0 0.0, 1.0 0.0, 1.0 1.0, 0.0 0.0))'
+    assert hyp3_floods.normalize_wkt('POLYGON((0 0, 1 0, 1 1, 0 0))') == expected
+    assert hyp3_floods.normalize_wkt('POLYGON ((1 1, 1 0, 0 0, 1 1))') == expected
+    assert hyp3_floods.normalize_wkt('POLYGON((1.0000001 0, 1 1, 1 1, 0 0, 1 0))') == expected
+
+    assert hyp3_floods.normalize_wkt('MULTIPOLYGON (((5 5, 6 5, 6 6, 5 5)), ((0 0, 1 0, 1 1, 0 0)))') == \
+           'MULTIPOLYGON (((0.0 0.0, 1.0 0.0, 1.0 1.0, 0.0 0.0)), ((5.0 5.0, 6.0 5.0, 6.0 6.0, 5.0 5.0)))'
+
+
+def test_aois_equal():
+    assert hyp3_floods.aois_equal('POLYGON((0 0, 1 0, 1 1, 0 0))', 'POLYGON ((1 1, 0 0, 1 0, 1 1))')
+    assert hyp3_floods.aois_equal(
+        'POLYGON((0 0, 1 0, 1 1, 0 0))', 'POLYGON((0.001 0, 1 0, 1 1, 0.001 0))', tolerance=0.01
+    )
+    assert not hyp3_floods.aois_equal('POLYGON((0 0, 1 0, 1 1, 0 0))', 'POLYGON((0.001 0, 1 0, 1 1, 0.001 0))')
+    assert not hyp3_floods.aois_equal('POLYGON((0 0, 1 0, 1 1, 0 0))', 'POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))')
+    assert hyp3_floods.aois_equal(
+        'POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))', 'POLYGON ((0.000005 0, 10 0, 10 10, 0 10, 0.000005 0))'
+    )
+    assert hyp3_floods.aois_equal('POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))', 'POLYGON((0 0, 0.5 0, 1 0, 1 1, 0 1, 0 0))')
+    assert not hyp3_floods.aois_equal(
+        'POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))', 'POLYGON((0 0, 0.5 0.001, 1 0, 1 1, 0 1, 0 0))'
+    )
+    assert hyp3_floods.aois_equal(
+        'MULTIPOLYGON(((0 0, 1 0, 1 1, 0 0)), ((5 5, 6 5, 6 6, 5 5)))',
+        'MULTIPOLYGON(((6 6, 5 5, 6 5, 6 6)), ((0 0, 1 1, 1 0, 0 0)))',
+    )
+    assert not hyp3_floods.aois_equal(
+        'MULTIPOLYGON(((0 0, 1 0, 1 1, 0 0)), ((5 5, 6 5, 6 6, 5 5)))', 'POLYGON((0 0, 1 0, 1 1, 0 0))'
+    )
+    # Same vertices, different interiors
+    assert not hyp3_floods.aois_equal('POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))', 'POLYGON((0 0, 1 0, 0 1, 1 1, 0 0))')
+    assert not hyp3_floods.aois_equal(
+        'POLYGON((0 0, 4 0, 4 4, 0 4, 0 0))', 'POLYGON((0 0, 4 0, 4 4, 0 4, 0 0), (1 1, 1 3, 3 3, 3 1, 1 1))'
+    )
+    assert hyp3_floods.aois_equal('foo', 'foo')
+    assert not hyp3_floods.aois_equal('foo', 'POLYGON((0 0, 1 0, 1 1, 0 0))')
+
+
+def test_simplify_polygons():
+    polygons = [
+        [[(0.0, 0.0), (2.0, 1.0), (4.0, 0.0), (4.0, 4.0), (0.0, 4.0)], [(1.0, 2.0), (2.0, 2.0), (2.0, 3.0)]],
+        [[(10.0, 10.0), (11.0, 10.0), (11.0, 11.0)]],
+    ]
+    assert hyp3_floods.simplify_polygons(polygons, max_vertices=11) == polygons
+    assert hyp3_floods.simplify_polygons(polygons, max_vertices=8) == [polygons[0][:1], polygons[1]]
+    assert hyp3_floods.simplify_polygons(polygons, max_vertices=7) == [
+        [[(0.0, 0.0), (4.0, 0.0), (4.0, 4.0), (0.0, 4.0)]],
+        [[(10.0, 10.0), (11.0, 10.0), (11.0, 11.0)]],
+    ]
+    assert hyp3_floods.simplify_polygons(polygons, max_vertices=6) == [
+        [[(0.0, 0.0), (4.0, 0.0), (11.0, 10.0), (11.0, 11.0), (0.0, 4.0)]],
+    ]
+    assert hyp3_floods.simplify_polygons(polygons, max_vertices=4) == [
+        [[(0.0, 0.0), (11.0, 0.0), (11.0, 11.0), (0.0, 11.0)]],
+    ]
+    assert hyp3_floods.simplify_polygons(polygons, max_bytes=100) == [
+        [[(0.0, 0.0), (4.0, 0.0), (11.0, 10.0), (11.0, 11.0), (0.0, 4.0)]],
+    ]
+
+    # The hull of a C-shaped polygon would overlap the polygon in its notch, so both are replaced by a single hull
+    polygons = [
+        [[(0.0, 0.0), (3.0, 0.0), (3.0, 1.0), (1.0, 1.0), (1.0, 2.0), (3.0, 2.0), (3.0, 3.0), (0.0, 3.0)]],
+        [[(1.5, 1.2), (2.5, 1.2), (2.5, 1.8), (1.5, 1.8)]],
+    ]
+    assert hyp3_floods.simplify_polygons(polygons, max_vertices=10) == [
+        [[(0.0, 0.0), (3.0, 0.0), (3.0, 3.0), (0.0, 3.0)]],
+    ]
+
+
+def test_prepare_aoi():
+    options = hyp3_floods.GeometryOptions(max_vertices=4)
+    assert hyp3_floods.prepare_aoi('POLYGON ((1 1, 1 0, 0 0, 1 1))', options) == \
+           'POLYGON ((0.0 0.0, 1.0 0.0, 1.0 1.0, 0.0 0.0))'
+    assert hyp3_floods.prepare_aoi('POLYGON ((0 0, 2 1, 4 0, 4 4, 0 4, 0 0))', options) == \
+           'POLYGON ((0.0 0.0, 4.0 0.0, 4.0 4.0, 0.0 4.0, 0.0 0.0))'
+    assert hyp3_floods.prepare_aoi('foo', options) == 'foo'
+
+
+def test_strtree():
+    bboxes = [(float(i), float(j), i + 1.5, j + 1.5) for i in range(10) for j in range(10)]
+    tree = hyp3_floods.STRtree(bboxes, node_capacity=4)
+
+    for query in [(0.0, 0.0, 0.5, 0.5), (3.2, 4.2, 3.8, 4.8), (-1.0, -1.0, 20.0, 20.0), (30.0, 30.0, 31.0, 31.0)]:
+        assert tree.query(query) == [i for i, bbox in enumerate(bboxes) if hyp3_floods.bboxes_intersect(bbox, query)]
+
+    assert hyp3_floods.STRtree([]).query((0.0, 0.0, 1.0, 1.0)) == []
+
+
+def test_covered_fraction():
+    square = [[[(0.0, 0.0), (4.0, 0.0), (4.0, 4.0), (0.0, 4.0)]]]
+    left_half = [[[(0.0, 0.0), (2.0, 0.0), (2.0, 4.0), (0.0, 4.0)]]]
+    with_hole = [[[(0.0, 0.0), (4.0, 0.0), (4.0, 4.0), (0.0, 4.0)], [(0.0, 0.0), (2.0, 0.0), (2.0, 4.0), (0.0, 4.0)]]]
+
+    assert hyp3_floods.covered_fraction(left_half, square) == 1.0
+    assert hyp3_floods.covered_fraction(square, left_half) == 0.5
+    assert hyp3_floods.covered_fraction(left_half, with_hole) == 0.0
+
+
+def test_deduplicate_hazards():
+    hazards = [{'uuid': str(i)} for i in range(4)]
+    aois = {
+        '0': 'POLYGON ((1 1, 3 1, 3 3, 1 3, 1 1))',
+        '1': 'POLYGON ((0 0, 4 0, 4 4, 0 4, 0 0))',
+        '2': 'POLYGON ((3 0, 7 0, 7 4, 3 4, 3 0))',
+        '3': 'foo',
+    }
+
+    remaining, skip_aois, covered_by = hyp3_floods.deduplicate_hazards(hazards, aois, 'skip')
+    assert remaining == [hazards[1], hazards[2], hazards[3]]
+    assert skip_aois == aois
+    assert covered_by == {'0': '1'}
+
+    remaining, merge_aois, covered_by = hyp3_floods.deduplicate_hazards(hazards, aois, 'merge')
+    assert remaining == [hazards[1], hazards[2], hazards[3]]
+    assert merge_aois == aois
+    assert covered_by == {'0': '1'}
+
+    hazards = [{'uuid': str(i)} for i in range(2)]
+    aois = {
+        '0': 'POLYGON ((0 0, 4 0, 4 4, 0 4, 0 0))',
+        '1': 'POLYGON ((1 1, 5 1, 5 3, 1 3, 1 1))',
+    }
+    remaining, merge_aois, covered_by = hyp3_floods.deduplicate_hazards(hazards, aois, 'merge', threshold=0.5)
+    assert remaining == [hazards[0]]
+    assert merge_aois == {
+        **aois,
+        '0': 'POLYGON ((0.0 0.0, 4.0 0.0, 5.0 1.0, 5.0 3.0, 4.0 4.0, 0.0 4.0, 0.0 0.0))',
+    }
+    assert covered_by == {'1': '0'}
+
+    # Merging a hazard into a concave AOI would more than triple its area
+    aois = {
+        '0': 'POLYGON ((0 0, 10 0, 10 10, 9 10, 9 1, 1 1, 1 10, 0 10, 0 0))',
+        '1': 'POLYGON ((0 5, 1.1 5, 1.1 6, 0 6, 0 5))',
+    }
+    remaining, merge_aois, covered_by = hyp3_floods.deduplicate_hazards(hazards, aois, 'merge')
+    assert remaining == [hazards[0]]
+    assert merge_aois == aois
+    assert covered_by == {'1': '0'}
+
+
+def test_fetch_active_hazards_filters():
     hazards = [
         {'uuid': 0, 'category_ID': 'EVENT', 'severity_ID': 'WARNING', 'type_ID': 'FLOOD', 'start_Date': 1},
         {'uuid': 1, 'category_ID': 'EVENT', 'severity_ID': 'WARNING', 'type_ID': 'foo', 'start_Date': 1},
@@ -208,10 +1348,16 @@ def test_filter_hazards():
         {'uuid': 4, 'category_ID': 'EVENT', 'severity_ID': 'WARNING', 'type_ID': 'FLOOD', 'start_Date': 3},
         {'uuid': 5, 'category_ID': 'EVENT', 'severity_ID': 'WARNING', 'type_ID': 'baz', 'start_Date': 3},
     ]
-    assert hyp3_floods.filter_hazards(hazards, current_time_in_ms=0) == []
-    assert hyp3_floods.filter_hazards(hazards, current_time_in_ms=1) == [hazards[0]]
-    assert hyp3_floods.filter_hazards(hazards, current_time_in_ms=2) == [hazards[0], hazards[2]]
-    assert hyp3_floods.filter_hazards(hazards, current_time_in_ms=3) == [hazards[0], hazards[2], hazards[4]]
+    mock_pdc = NonCallableMock(hyp3_floods.PDCHazardsAPI)
+
+    def fetch(current_time_in_ms):
+        mock_pdc.iter_active_hazards.return_value = iter(hazards)
+        return hyp3_floods.fetch_active_hazards(mock_pdc, current_time_in_ms)
+
+    assert fetch(current_time_in_ms=0) == []
+    assert fetch(current_time_in_ms=1) == [hazards[0]]
+    assert fetch(current_time_in_ms=2) == [hazards[0], hazards[2]]
+    assert fetch(current_time_in_ms=3) == [hazards[0], hazards[2], hazards[4]]
 
 
 def test_is_valid_hazard():
@@ -1,9 +1,14 @@
+import gzip
+import json
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock, NonCallableMock, call, Mock
 
+import botocore.exceptions
 import hyp3_sdk
 import pytest
+import requests
 
 import transfer_products
 
@@ -80,27 +85,33 @@ EXPECTED_OBJECTS_TO_COPY = [
 
 @patch('transfer_products.copy_object')
 @patch('transfer_products.get_existing_objects')
+@patch('transfer_products.iter_jobs')
 @patch('transfer_products.EXTENSIONS', EXTENSIONS)
+@patch.dict(transfer_products._HYP3_CLIENTS, clear=True)
 @patch.dict(os.environ, MOCK_ENV, clear=True)
-def test_lambda_handler(mock_get_existing_objects: MagicMock, mock_copy_object: MagicMock):
+def test_lambda_handler(mock_iter_jobs: MagicMock, mock_get_existing_objects: MagicMock, mock_copy_object: MagicMock):
     mock_hyp3 = NonCallableMock(hyp3_sdk.HyP3)
-    mock_hyp3.find_jobs.return_value = JOBS
+    mock_iter_jobs.return_value = iter(JOBS)
 
     mock_hyp3_class = Mock()
     mock_hyp3_class.return_value = mock_hyp3
 
     mock_get_existing_objects.return_value = EXISTING_OBJECTS
+    mock_copy_object.return_value = 1024
 
     with patch('hyp3_sdk.HyP3', mock_hyp3_class):
         transfer_products.lambda_handler(None, None)
 
     mock_hyp3_class.assert_called_once_with(api_url='test-url', username='test-user', password='test-pass')
-    mock_hyp3.find_jobs.assert_called_once_with(status_code='SUCCEEDED')
+    mock_iter_jobs.assert_called_once_with(mock_hyp3, None)
     mock_get_existing_objects.assert_called_once_with('target-bucket', 'target-prefix')
 
-    assert mock_copy_object.mock_calls == [
-        call(obj.source_bucket, obj.source_key, 'target-bucket', obj.target_key) for obj in EXPECTED_OBJECTS_TO_COPY
-    ]
+    # Objects are copied concurrently, so in no particular order
+    assert mock_copy_object.call_count == len(EXPECTED_OBJECTS_TO_COPY)
+    mock_copy_object.assert_has_calls([
+        call(obj.source_bucket, obj.source_key, 'target-bucket', obj.target_key)
+        for obj in EXPECTED_OBJECTS_TO_COPY
+    ], any_order=True)
 
 
 @patch.dict(os.environ, {}, clear=True)
@@ -109,7 +120,285 @@ def test_lambda_handler_missing_env_var():
         transfer_products.lambda_handler(None, None)
 
 
+@patch.dict(transfer_products._HYP3_CLIENTS, clear=True)
+def test_get_hyp3_client():
+    mock_hyp3_class = Mock(side_effect=lambda **kwargs: NonCallableMock(session=requests.Session()))
+
+    with patch('hyp3_sdk.HyP3', mock_hyp3_class):
+        hyp3 = transfer_products.get_hyp3_client('test-url', 'test-user', 'test-pass')
+        assert transfer_products.get_hyp3_client('test-url', 'test-user', 'test-pass') is hyp3
+        mock_hyp3_class.assert_called_once_with(api_url='test-url', username='test-user', password='test-pass')
+
+        hyp3.session.cookies.set('asf-urs', 'test-cookie', expires=time.time() + 60)
+        assert transfer_products.get_hyp3_client('test-url', 'test-user', 'test-pass') is not hyp3
+        assert mock_hyp3_class.call_count == 2
+
+        hyp3 = transfer_products.get_hyp3_client('test-url', 'test-user', 'test-pass')
+        assert transfer_products.get_hyp3_client('test-url', 'test-user', 'test-pass', refresh=True) is not hyp3
+        assert mock_hyp3_class.call_count == 3
+
+
 def test_get_objects_to_copy():
-    assert transfer_products.get_objects_to_copy(
+    assert list(transfer_products.get_objects_to_copy(
         JOBS, EXISTING_OBJECTS, 'target-prefix', EXTENSIONS
-    ) == EXPECTED_OBJECTS_TO_COPY
+    )) == EXPECTED_OBJECTS_TO_COPY
+
+
+@patch('transfer_products.copy_object')
+def test_copy_objects(mock_copy_object: MagicMock):
+    def copy_object(source_bucket, source_key, target_bucket, target_key):
+        if source_key.endswith('.ext3'):
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'CopyObject')
+        return 100
+
+    mock_copy_object.side_effect = copy_object
+
+    progress = transfer_products.copy_objects(EXPECTED_OBJECTS_TO_COPY, 'target-bucket', dry_run=False, max_workers=4)
+    assert (progress.queued, progress.copied, progress.failed, progress.bytes_copied) == (4, 2, 2, 200)
+    assert mock_copy_object.call_count == 4
+
+    mock_copy_object.reset_mock()
+    progress = transfer_products.copy_objects(EXPECTED_OBJECTS_TO_COPY, 'target-bucket', dry_run=True)
+    assert (progress.queued, progress.copied, progress.failed) == (4, 0, 0)
+    mock_copy_object.assert_not_called()
+
+
+def test_get_part_size():
+    mib = 1024 * 1024
+    assert transfer_products.get_part_size(320 * mib) == 20 * mib
+    assert transfer_products.get_part_size(32 * mib) == 5 * mib
+    assert transfer_products.get_part_size(64 * 1024 * mib) == 512 * mib
+    assert transfer_products.get_part_size(5 * 1024 * 1024 * mib) == 5 * 1024 * 1024 * mib // 10_000 + 1
+
+
+@patch('transfer_products.S3_MIN_PART_SIZE', 10)
+@patch('transfer_products.COPY_OBJECT_MAX_SIZE', 100)
+@patch('transfer_products.get_s3_client')
+def test_copy_object(mock_get_s3_client: MagicMock):
+    s3 = mock_get_s3_client.return_value
+    s3.head_object.return_value = {'ContentLength': 100, 'ContentType': 'image/tiff'}
+    copy_source = {'Bucket': 'source-bucket', 'Key': 'source-key'}
+
+    assert transfer_products.copy_object('source-bucket', 'source-key', 'target-bucket', 'target-key') == 100
+    s3.head_object.assert_called_once_with(**copy_source)
+    s3.copy_object.assert_called_once_with(
+        CopySource=copy_source, Bucket='target-bucket', Key='target-key', TaggingDirective='REPLACE'
+    )
+    s3.create_multipart_upload.assert_not_called()
+
+    s3.reset_mock()
+    s3.head_object.return_value = {'ContentLength': 170, 'ContentType': 'image/tiff'}
+    s3.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+    s3.upload_part_copy.side_effect = lambda **kwargs: {'CopyPartResult': {'ETag': f'etag-{kwargs["PartNumber"]}'}}
+
+    assert transfer_products.copy_object('source-bucket', 'source-key', 'target-bucket', 'target-key') == 170
+    s3.head_object.assert_called_once_with(**copy_source)
+    s3.copy_object.assert_not_called()
+    s3.create_multipart_upload.assert_called_once_with(
+        Bucket='target-bucket', Key='target-key', ContentType='image/tiff'
+    )
+    assert sorted(
+        (kwargs['PartNumber'], kwargs['CopySourceRange']) for _, _, kwargs in s3.upload_part_copy.mock_calls
+    ) == [
+        (part_number, f'bytes={first_byte}-{min(first_byte + 10, 169)}')
+        for part_number, first_byte in enumerate(range(0, 170, 11), start=1)
+    ]
+    s3.complete_multipart_upload.assert_called_once_with(
+        Bucket='target-bucket',
+        Key='target-key',
+        UploadId='upload-id',
+        MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': f'etag-{n}'} for n in range(1, 17)]},
+    )
+    s3.abort_multipart_upload.assert_not_called()
+
+    s3.reset_mock()
+    s3.upload_part_copy.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'SlowDown'}}, 'UploadPartCopy')
+    with pytest.raises(botocore.exceptions.ClientError):
+        transfer_products.copy_object('source-bucket', 'source-key', 'target-bucket', 'target-key')
+    s3.complete_multipart_upload.assert_not_called()
+    s3.abort_multipart_upload.assert_called_once_with(Bucket='target-bucket', Key='target-key', UploadId='upload-id')
+
+
+def test_iter_jobs():
+    def job(job_id, request_time):
+        return {
+            'job_id': job_id, 'job_type': 'job-type', 'request_time': request_time, 'status_code': 'SUCCEEDED',
+            'user_id': 'user-id',
+        }
+
+    pages = {
+        'https://hyp3/jobs': {'jobs': [job('job-0', '2022-06-15T00:00:00+00:00')], 'next': 'https://hyp3/jobs?page=1'},
+        'https://hyp3/jobs?page=1': {'jobs': [job('job-1', '2022-06-15T01:00:00+00:00')]},
+    }
+    hyp3 = NonCallableMock(url='https://hyp3/')
+    hyp3.session.get.side_effect = lambda url, **kwargs: Mock(ok=True, json=Mock(return_value=pages[url]))
+
+    start = datetime(2022, 6, 14, tzinfo=timezone.utc)
+    jobs = transfer_products.iter_jobs(hyp3, start)
+    assert hyp3.session.get.mock_calls == [
+        call('https://hyp3/jobs', params={'status_code': 'SUCCEEDED', 'start': '2022-06-14T00:00:00+00:00'})
+    ]
+
+    stats = transfer_products.JobStats()
+    assert [job.job_id for job in stats.track(jobs)] == ['job-0', 'job-1']
+    assert hyp3.session.get.call_count == 2
+    assert stats.count == 2
+    assert stats.newest_request_time == datetime(2022, 6, 15, 1, tzinfo=timezone.utc)
+
+    hyp3.session.get.side_effect = None
+    hyp3.session.get.return_value = Mock(ok=False, status_code=401, json=Mock(return_value={'detail': 'expired'}))
+    with pytest.raises(hyp3_sdk.exceptions.HyP3Error, match='expired'):
+        transfer_products.iter_jobs(hyp3, start)
+
+    hyp3.session.get.return_value = Mock(ok=False, status_code=502, json=Mock(side_effect=ValueError), text='error')
+    with pytest.raises(hyp3_sdk.exceptions.ServerError, match='error'):
+        transfer_products.iter_jobs(hyp3, start)
+
+
+def test_copy_objects_streaming():
+    copied = []
+
+    def objects_to_copy():
+        for obj in EXPECTED_OBJECTS_TO_COPY:
+            # At most queue_size objects wait ahead of the copies
+            assert len(copied) >= EXPECTED_OBJECTS_TO_COPY.index(obj) - 2
+            yield obj
+
+    def copy_object(source_bucket, source_key, target_bucket, target_key):
+        copied.append(target_key)
+        return 1
+
+    with patch('transfer_products.copy_object', side_effect=copy_object):
+        progress = transfer_products.copy_objects(
+            objects_to_copy(), 'target-bucket', dry_run=False, max_workers=1, queue_size=1
+        )
+    assert (progress.queued, progress.copied, progress.bytes_copied) == (4, 4, 4)
+    assert copied == [obj.target_key for obj in EXPECTED_OBJECTS_TO_COPY]
+
+    def fail(*args):
+        raise ValueError('unexpected')
+
+    with patch('transfer_products.copy_object', side_effect=fail):
+        with pytest.raises(ValueError, match='unexpected'):
+            transfer_products.copy_objects(iter(EXPECTED_OBJECTS_TO_COPY), 'target-bucket', dry_run=False)
+
+
+def test_job_discovery(tmp_path):
+    location = str(tmp_path / 'jobs.json')
+    now = datetime(2022, 6, 15, tzinfo=timezone.utc)
+
+    assert transfer_products.load_state(location) is None
+    assert transfer_products.get_job_discovery_start(None, now, full_reconciliation=False) is None
+
+    state = transfer_products.get_job_discovery_state(None, now - timedelta(hours=1), None, now, complete=True)
+    assert state == {
+        'last_full_reconciliation': now.isoformat(), 'high_water_mark': (now - timedelta(hours=1)).isoformat(),
+    }
+    transfer_products.save_state(location, state)
+    assert transfer_products.load_state(location) == state
+
+    later = now + timedelta(hours=1)
+    start = transfer_products.get_job_discovery_start(state, later, full_reconciliation=False)
+    assert start == now - timedelta(hours=1) - transfer_products.JOB_DISCOVERY_OVERLAP
+    assert transfer_products.get_job_discovery_start(state, later, full_reconciliation=True) is None
+    assert transfer_products.get_job_discovery_start(
+        state, now + transfer_products.JOB_RECONCILIATION_INTERVAL, full_reconciliation=False
+    ) is None
+
+    # An incremental run advances the high-water mark, but not the last full reconciliation
+    assert transfer_products.get_job_discovery_state(state, later, start, later, complete=True) == {
+        'last_full_reconciliation': now.isoformat(), 'high_water_mark': later.isoformat(),
+    }
+    assert transfer_products.get_job_discovery_state(state, None, start, later, complete=True) == state
+
+    # A run with failed copies does not advance the high-water mark
+    assert transfer_products.get_job_discovery_state(state, later, start, later, complete=False) == state
+
+
+def test_archive_index(tmp_path):
+    location = str(tmp_path / 'index.gz')
+    assert transfer_products.ArchiveIndex.load(location) is None
+
+    index = transfer_products.ArchiveIndex(EXISTING_OBJECTS)
+    assert 'target-prefix/filename-5A87.ext2' in index
+    assert 'target-prefix/filename-5A87.ext1' not in index
+
+    index.add('target-prefix/filename-5A87.ext1')
+    index.add('target-prefix/filename-5A87.ext2')
+    assert 'target-prefix/filename-5A87.ext1' in index
+    assert len(index) == 3
+
+    index.save(location)
+    loaded = transfer_products.ArchiveIndex.load(location)
+    assert loaded.rebuilt is None
+    assert len(loaded) == 3
+    assert all(key in loaded for key in EXISTING_OBJECTS | {'target-prefix/filename-5A87.ext1'})
+    assert list(transfer_products.get_objects_to_copy(JOBS, loaded, 'target-prefix', EXTENSIONS)) == [
+        obj for obj in EXPECTED_OBJECTS_TO_COPY if obj.target_key != 'target-prefix/filename-5A87.ext1'
+    ]
+
+    rebuilt = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    transfer_products.ArchiveIndex(EXISTING_OBJECTS, rebuilt=rebuilt).save(location)
+    loaded = transfer_products.ArchiveIndex.load(location)
+    assert loaded.rebuilt == rebuilt
+    assert len(loaded) == 2
+    assert all(key in loaded for key in EXISTING_OBJECTS)
+
+
+@patch('transfer_products.get_existing_objects')
+@patch('transfer_products.read_bytes')
+def test_get_archive_index(mock_read_bytes: MagicMock, mock_get_existing_objects: MagicMock):
+    manifest = {
+        'destinationBucket': 'arn:aws:s3:::inventory-bucket',
+        'fileFormat': 'CSV',
+        'fileSchema': 'Bucket, Key, Size',
+        'files': [{'key': 'inventory/data/0.csv.gz'}, {'key': 'inventory/data/1.csv.gz'}],
+    }
+    objects = {
+        's3://inventory-bucket/manifest.json': json.dumps(manifest).encode(),
+        's3://inventory-bucket/inventory/data/0.csv.gz': gzip.compress(
+            b'"target-bucket","target-prefix/filename-5A87.ext2","10"\n"target-bucket","other-prefix/foo","10"\n'
+        ),
+        's3://inventory-bucket/inventory/data/1.csv.gz': gzip.compress(
+            b'"target-bucket","target-prefix/filename%20C054.ext1","10"\n'
+            b'"target-bucket","target-prefix/file+name%2BC054.ext2","10"\n'
+        ),
+    }
+    mock_read_bytes.side_effect = objects.get
+    mock_get_existing_objects.return_value = EXISTING_OBJECTS
+    now = datetime(2023, 1, 2, tzinfo=timezone.utc)
+
+    with patch.dict(os.environ, {'ARCHIVE_INVENTORY_MANIFEST': 's3://inventory-bucket/manifest.json'}, clear=True):
+        index = transfer_products.get_archive_index(
+            'index-location', 'target-bucket', 'target-prefix', rebuild=False, now=now
+        )
+        assert index.rebuilt == now
+        assert len(index) == 3
+        assert 'target-prefix/filename-5A87.ext2' in index
+        assert 'target-prefix/filename C054.ext1' in index
+        assert 'target-prefix/file name+C054.ext2' in index
+        mock_get_existing_objects.assert_not_called()
+
+        index = transfer_products.get_archive_index(
+            'index-location', 'target-bucket', 'target-prefix', rebuild=True, now=now
+        )
+        assert len(index) == 2
+        assert all(key in index for key in EXISTING_OBJECTS)
+        mock_get_existing_objects.assert_called_once_with('target-bucket', 'target-prefix')
+
+        mock_get_existing_objects.reset_mock()
+        objects['index-location'] = gzip.compress(b'# rebuilt 2023-01-01T12:00:00+00:00\ntarget-prefix/foo\n')
+        index = transfer_products.get_archive_index(
+            'index-location', 'target-bucket', 'target-prefix', rebuild=False, now=now
+        )
+        assert len(index) == 1
+        assert 'target-prefix/foo' in index
+        mock_get_existing_objects.assert_not_called()
+
+        # A stale index is rebuilt from a listing of the target prefix rather than from the S3 Inventory report
+        index = transfer_products.get_archive_index(
+            'index-location', 'target-bucket', 'target-prefix', rebuild=False, now=now + timedelta(days=1)
+        )
+        assert index.rebuilt == now + timedelta(days=1)
+        assert len(index) == 2
+        mock_get_existing_objects.assert_called_once_with('target-bucket', 'target-prefix')
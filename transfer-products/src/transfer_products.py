@@ -1,17 +1,77 @@
+from __future__ import annotations
+
 import argparse
+import bisect
+import csv
+import gzip
+import heapq
+import io
+import json
+import math
 import os
-from dataclasses import dataclass
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Container, Iterable, Iterator, Optional
+from urllib.parse import unquote_plus
 
-import boto3
 import botocore.exceptions
-import hyp3_sdk
-from boto3.s3.transfer import TransferConfig
 
-S3 = boto3.resource('s3')
+if TYPE_CHECKING:
+    import hyp3_sdk
+    import requests
 
 # TODO decide on appropriate extensions
 EXTENSIONS = ['_VV.tif', '_VH.tif', '_rgb.tif', '_WM.tif', '.README.md.txt']
 
+# Cached HyP3 sessions are discarded this long before their cookies expire.
+# This value was chosen arbitrarily.
+HYP3_COOKIE_EXPIRY_MARGIN = timedelta(minutes=5)
+
+# Maximum number of objects copied concurrently.
+# This value was chosen arbitrarily.
+COPY_MAX_WORKERS = 16
+
+# Maximum number of objects waiting to be copied. Jobs are fetched and objects queued only as fast as they are copied.
+# This value was chosen arbitrarily.
+COPY_QUEUE_SIZE = 2 * COPY_MAX_WORKERS
+
+# Objects up to this size are copied with a single CopyObject request; larger objects are copied in parts. S3 allows
+# CopyObject for objects up to 5 GiB, but parts are copied concurrently, so large objects copy faster in parts.
+# This value was chosen arbitrarily.
+COPY_OBJECT_MAX_SIZE = 256 * 1024 * 1024
+
+# Large objects are split into about this many parts, each between S3's minimum part size and COPY_MAX_PART_SIZE,
+# and at most COPY_MAX_PART_WORKERS parts of each object are copied concurrently.
+# These values were chosen arbitrarily.
+COPY_TARGET_PARTS = 16
+COPY_MAX_PART_SIZE = 512 * 1024 * 1024
+COPY_MAX_PART_WORKERS = 8
+
+# When JOB_STATE_LOCATION is set, each run only fetches jobs requested since the newest job seen by a previous run,
+# less JOB_DISCOVERY_OVERLAP to cover jobs that succeeded after newer jobs were requested. All jobs are fetched at least
+# once per JOB_RECONCILIATION_INTERVAL.
+# These values were chosen arbitrarily.
+JOB_DISCOVERY_OVERLAP = timedelta(days=2)
+JOB_RECONCILIATION_INTERVAL = timedelta(days=1)
+
+# When ARCHIVE_INDEX_LOCATION is set, the index is rebuilt from a listing of the target prefix at least once per
+# ARCHIVE_INDEX_REBUILD_INTERVAL, to pick up objects removed from the archive.
+# This value was chosen arbitrarily.
+ARCHIVE_INDEX_REBUILD_INTERVAL = timedelta(days=1)
+
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10_000
+
+# boto3 and hyp3_sdk are imported, and clients constructed, on first use rather than at import time, to reduce
+# Lambda cold start time. Clients are reused across warm Lambda invocations.
+_S3_CLIENT = None
+_HYP3_CLIENTS: dict[tuple[str, str], hyp3_sdk.HyP3] = {}
+
 
 @dataclass(frozen=True)
 class ObjectToCopy:
@@ -20,21 +80,313 @@ class ObjectToCopy:
     target_key: str
 
 
+@dataclass
+class CopyProgress:
+    """Aggregated progress of concurrent object copies."""
+    queued: int = 0
+    copied: int = 0
+    failed: int = 0
+    bytes_copied: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, obj: ObjectToCopy, target_bucket: str, bytes_copied: int = 0,
+               error: Optional[Exception] = None) -> None:
+        with self._lock:
+            if error is None:
+                self.copied += 1
+                self.bytes_copied += bytes_copied
+            else:
+                self.failed += 1
+            done = self.copied + self.failed
+            queued = self.queued
+            total_bytes = self.bytes_copied
+        if error is None:
+            print(
+                f'({done}/{queued}) Copied {obj.source_bucket}/{obj.source_key} to {target_bucket}/{obj.target_key}'
+                f' ({bytes_copied} bytes, {total_bytes} bytes total)'
+            )
+        else:
+            print(f'({done}/{queued}) Error copying {obj.source_bucket}/{obj.source_key}: {error}')
+
+
+@dataclass
+class JobStats:
+    """Number of jobs, and request time of the newest job, seen while streaming jobs."""
+    count: int = 0
+    newest_request_time: Optional[datetime] = None
+
+    def track(self, jobs: Iterable[hyp3_sdk.Job]) -> Iterator[hyp3_sdk.Job]:
+        for job in jobs:
+            self.count += 1
+            if self.newest_request_time is None or job.request_time > self.newest_request_time:
+                self.newest_request_time = job.request_time
+            yield job
+
+
+class ArchiveIndex:
+    """Sorted index of the keys of the archived objects, persisted as a gzipped file of one key per line, preceded by
+    a header line with the time the index was last rebuilt.
+
+    Keys added during a run are merged into the sorted keys when the index is saved.
+    """
+
+    HEADER_PREFIX = '# rebuilt '
+
+    def __init__(self, keys: Iterable[str], rebuilt: Optional[datetime] = None):
+        self.rebuilt = rebuilt
+        self._keys = sorted(set(keys))
+        self._added: set[str] = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: object) -> bool:
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return True
+        with self._lock:
+            return key in self._added
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._keys) + len(self._added)
+
+    def add(self, key: str) -> None:
+        if key not in self:
+            with self._lock:
+                self._added.add(key)
+
+    @classmethod
+    def load(cls, location: str) -> Optional[ArchiveIndex]:
+        data = read_bytes(location)
+        if data is None:
+            return None
+        lines = gzip.decompress(data).decode().splitlines()
+        index = cls([])
+        if lines and lines[0].startswith(cls.HEADER_PREFIX):
+            index.rebuilt = datetime.fromisoformat(lines.pop(0).removeprefix(cls.HEADER_PREFIX))
+        index._keys = lines
+        return index
+
+    def save(self, location: str) -> None:
+        with self._lock:
+            self._keys = list(heapq.merge(self._keys, sorted(self._added)))
+            self._added.clear()
+            header = [f'{self.HEADER_PREFIX}{self.rebuilt.isoformat()}'] if self.rebuilt is not None else []
+            data = gzip.compress(''.join(f'{line}\n' for line in [*header, *self._keys]).encode())
+        write_bytes(location, data)
+
+
 class MissingEnvVar(Exception):
     pass
 
 
+def get_s3_client():
+    """Returns the S3 client shared by all copy threads. Unlike boto3 resources, boto3 clients are thread-safe."""
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        import boto3
+        import botocore.config
+        config = botocore.config.Config(max_pool_connections=COPY_MAX_WORKERS * COPY_MAX_PART_WORKERS)
+        _S3_CLIENT = boto3.client('s3', config=config)
+    return _S3_CLIENT
+
+
+def get_hyp3_client(api_url: str, username: str, password: str, refresh: bool = False) -> hyp3_sdk.HyP3:
+    """Returns a HyP3 client for the user, reusing the authenticated session from a previous invocation if it has not
+    expired (or `refresh` is set).
+    """
+    import hyp3_sdk
+
+    key = (api_url, username)
+    hyp3 = _HYP3_CLIENTS.get(key)
+    if refresh or hyp3 is None or session_expired(hyp3.session):
+        hyp3 = hyp3_sdk.HyP3(api_url=api_url, username=username, password=password)
+        _HYP3_CLIENTS[key] = hyp3
+    else:
+        print('Reusing cached HyP3 session')
+    return hyp3
+
+
+def session_expired(session) -> bool:
+    expiry_threshold = time.time() + HYP3_COOKIE_EXPIRY_MARGIN.total_seconds()
+    return any(cookie.expires is not None and cookie.expires < expiry_threshold for cookie in session.cookies)
+
+
+def read_bytes(location: str) -> Optional[bytes]:
+    """Returns the contents of the local file or ``s3://bucket/key`` object, or None if it does not exist."""
+    if location.startswith('s3://'):
+        bucket, _, key = location.removeprefix('s3://').partition('/')
+        s3 = get_s3_client()
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key)
+        except s3.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+
+    if not os.path.exists(location):
+        return None
+    with open(location, 'rb') as f:
+        return f.read()
+
+
+def write_bytes(location: str, data: bytes) -> None:
+    if location.startswith('s3://'):
+        bucket, _, key = location.removeprefix('s3://').partition('/')
+        get_s3_client().put_object(Bucket=bucket, Key=key, Body=data)
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+    tmp_location = f'{location}.tmp'
+    with open(tmp_location, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_location, location)
+
+
+def load_state(location: str) -> Optional[dict]:
+    data = read_bytes(location)
+    return json.loads(data) if data is not None else None
+
+
+def save_state(location: str, state: dict) -> None:
+    write_bytes(location, json.dumps(state).encode())
+
+
+def get_job_discovery_start(state: Optional[dict], now: datetime, full_reconciliation: bool) -> Optional[datetime]:
+    """Returns the earliest request time of the jobs to fetch, or None to fetch all jobs."""
+    if full_reconciliation or not state or 'high_water_mark' not in state:
+        return None
+    last_full_reconciliation = state.get('last_full_reconciliation')
+    if last_full_reconciliation is None or \
+            datetime.fromisoformat(last_full_reconciliation) + JOB_RECONCILIATION_INTERVAL <= now:
+        return None
+    return datetime.fromisoformat(state['high_water_mark']) - JOB_DISCOVERY_OVERLAP
+
+
+def get_job_discovery_state(
+        state: Optional[dict],
+        newest_request_time: Optional[datetime],
+        start: Optional[datetime],
+        now: datetime,
+        complete: bool) -> dict:
+    """Returns the job discovery state after a run that fetched the jobs requested since `start`, the newest of which
+    was requested at `newest_request_time`. The high-water mark only advances if every object was copied
+    (`complete`), so that jobs with failed copies are fetched again.
+    """
+    state = dict(state or {})
+    if not complete:
+        return state
+
+    if start is None:
+        state['last_full_reconciliation'] = now.isoformat()
+    request_times = [newest_request_time] if newest_request_time is not None else []
+    if 'high_water_mark' in state:
+        request_times.append(datetime.fromisoformat(state['high_water_mark']))
+    if request_times:
+        state['high_water_mark'] = max(request_times).isoformat()
+    return state
+
+
+def iter_jobs(hyp3: hyp3_sdk.HyP3, start: Optional[datetime]) -> Iterator[hyp3_sdk.Job]:
+    """Yields the succeeded jobs requested since `start` page by page, as `HyP3.find_jobs` fetches them, rather than
+    after fetching every page. The first page is fetched before returning, so that an error (such as a rejected
+    session) is raised by this call rather than during iteration.
+
+    Pages are requested through the client's authenticated session, using only the public `HyP3.url` and
+    `HyP3.session` attributes of the SDK.
+    """
+    import hyp3_sdk
+
+    params = {'status_code': 'SUCCEEDED'}
+    if start is not None:
+        params['start'] = start.isoformat()
+
+    def get_page(url: str, **kwargs):
+        response = hyp3.session.get(url, **kwargs)
+        raise_for_hyp3_status(response)
+        return response.json()
+
+    first_page = get_page(f'{hyp3.url.rstrip("/")}/jobs', params=params)
+
+    def jobs(page: dict) -> Iterator[hyp3_sdk.Job]:
+        while True:
+            yield from (hyp3_sdk.Job.from_dict(job) for job in page['jobs'])
+            if 'next' not in page:
+                return
+            page = get_page(page['next'])
+
+    return jobs(first_page)
+
+
+def raise_for_hyp3_status(response: requests.Response) -> None:
+    """Raises `HyP3Error` for a client error response from the HyP3 API, or `ServerError` for any other error."""
+    import hyp3_sdk.exceptions
+
+    if response.ok:
+        return
+    try:
+        detail = response.json()['detail']
+    except (ValueError, KeyError, TypeError):
+        detail = response.text
+    if 400 <= response.status_code < 500:
+        raise hyp3_sdk.exceptions.HyP3Error(f'{response} {detail}')
+    raise hyp3_sdk.exceptions.ServerError(f'{response} {detail}')
+
+
 def get_existing_objects(target_bucket: str, target_prefix: str) -> frozenset[str]:
-    return frozenset(obj.key for obj in S3.Bucket(target_bucket).objects.filter(Prefix=f'{target_prefix}/'))
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    return frozenset(
+        obj['Key']
+        for page in paginator.paginate(Bucket=target_bucket, Prefix=f'{target_prefix}/')
+        for obj in page.get('Contents', [])
+    )
+
+
+def get_inventory_keys(manifest_location: str, target_prefix: str) -> list[str]:
+    """Returns the keys under the prefix listed in the CSV S3 Inventory report with the given ``manifest.json``."""
+    manifest = json.loads(read_bytes(manifest_location))
+    if manifest['fileFormat'] != 'CSV':
+        raise ValueError(f'Unsupported S3 Inventory format: {manifest["fileFormat"]}')
+
+    key_column = [column.strip() for column in manifest['fileSchema'].split(',')].index('Key')
+    bucket = manifest['destinationBucket'].removeprefix('arn:aws:s3:::')
+    keys = []
+    for file in manifest['files']:
+        data = gzip.decompress(read_bytes(f's3://{bucket}/{file["key"]}'))
+        for row in csv.reader(io.StringIO(data.decode())):
+            # S3 Inventory reports URL-encode keys, including spaces as '+'
+            key = unquote_plus(row[key_column])
+            if key.startswith(f'{target_prefix}/'):
+                keys.append(key)
+    return keys
+
+
+def get_archive_index(
+        location: str, target_bucket: str, target_prefix: str, rebuild: bool, now: datetime) -> ArchiveIndex:
+    """Loads the archive index, or builds it if it does not exist, was last rebuilt more than
+    ARCHIVE_INDEX_REBUILD_INTERVAL ago, or `rebuild` is set: from the S3 Inventory report at ARCHIVE_INVENTORY_MANIFEST
+    if set and the index does not exist, otherwise by listing the target prefix.
+    """
+    index = ArchiveIndex.load(location) if not rebuild else None
+    if index is not None:
+        if index.rebuilt is not None and index.rebuilt + ARCHIVE_INDEX_REBUILD_INTERVAL > now:
+            print(f'Loaded archive index from {location}')
+            return index
+        print(f'Archive index at {location} was last rebuilt {index.rebuilt.isoformat() if index.rebuilt else "never"}')
+
+    inventory_manifest = os.getenv('ARCHIVE_INVENTORY_MANIFEST')
+    if inventory_manifest and index is None and not rebuild:
+        print(f'Building archive index from S3 Inventory report {inventory_manifest}')
+        return ArchiveIndex(get_inventory_keys(inventory_manifest, target_prefix), rebuilt=now)
+
+    print('Building archive index from a listing of the target prefix')
+    return ArchiveIndex(get_existing_objects(target_bucket, target_prefix), rebuilt=now)
 
 
 def get_objects_to_copy(
-        jobs: hyp3_sdk.Batch,
-        existing_objects: frozenset[str],
+        jobs: Iterable[hyp3_sdk.Job],
+        existing_objects: Container[str],
         target_prefix: str,
-        extensions: list[str]) -> list[ObjectToCopy]:
+        extensions: list[str]) -> Iterator[ObjectToCopy]:
 
-    objects_to_copy = []
     for job in jobs:
         if job.expired():
             continue
@@ -49,36 +401,137 @@ def get_objects_to_copy(
             target_key = f'{target_prefix}/{source_key.split("/")[-1]}'
 
             if target_key not in existing_objects:
-                objects_to_copy.append(
-                    ObjectToCopy(
-                        source_bucket=job.files[0]['s3']['bucket'],
-                        source_key=source_key,
-                        target_key=target_key,
-                    )
+                yield ObjectToCopy(
+                    source_bucket=job.files[0]['s3']['bucket'],
+                    source_key=source_key,
+                    target_key=target_key,
                 )
 
-    return objects_to_copy
 
-
-def copy_objects(objects_to_copy: list[ObjectToCopy], target_bucket: str, dry_run: bool) -> None:
-    for count, obj in enumerate(objects_to_copy, start=1):
-        print(
-            f'({count}/{len(objects_to_copy)}) '
-            f'Copying {obj.source_bucket}/{obj.source_key} to {target_bucket}/{obj.target_key}'
-        )
-        if not dry_run:
+def copy_objects(
+        objects_to_copy: Iterable[ObjectToCopy],
+        target_bucket: str,
+        dry_run: bool,
+        max_workers: int = COPY_MAX_WORKERS,
+        archive_index: Optional[ArchiveIndex] = None,
+        queue_size: int = COPY_QUEUE_SIZE) -> CopyProgress:
+    """Copies the objects concurrently through `max_workers` threads, adding each copied object to the
+    `archive_index`. An error copying one object does not affect any of the others.
+
+    Objects are consumed from `objects_to_copy` through a queue of at most `queue_size` objects, so copying starts as
+    soon as the first object is available, and `objects_to_copy` is only advanced as fast as objects are copied.
+    """
+    progress = CopyProgress()
+    if dry_run:
+        for obj in objects_to_copy:
+            progress.queued += 1
+            print(
+                f'({progress.queued}) Copying {obj.source_bucket}/{obj.source_key} to {target_bucket}/{obj.target_key}'
+            )
+        return progress
+
+    work: queue.Queue[Optional[ObjectToCopy]] = queue.Queue(maxsize=queue_size)
+    unexpected_errors: list[Exception] = []
+
+    def copy(obj: ObjectToCopy) -> None:
+        try:
+            bytes_copied = copy_object(obj.source_bucket, obj.source_key, target_bucket, obj.target_key)
+        except botocore.exceptions.ClientError as e:
+            progress.record(obj, target_bucket, error=e)
+        else:
+            progress.record(obj, target_bucket, bytes_copied=bytes_copied)
+            if archive_index is not None:
+                archive_index.add(obj.target_key)
+
+    def worker() -> None:
+        while (obj := work.get()) is not None:
+            # After an unexpected error, the remaining queued objects are discarded
+            if unexpected_errors:
+                continue
             try:
-                copy_object(obj.source_bucket, obj.source_key, target_bucket, obj.target_key)
-            except botocore.exceptions.ClientError as e:
-                print(f'Error copying object: {e}')
+                copy(obj)
+            except Exception as e:
+                unexpected_errors.append(e)
+
+    workers = [threading.Thread(target=worker) for _ in range(max_workers)]
+    for thread in workers:
+        thread.start()
+    try:
+        for obj in objects_to_copy:
+            if unexpected_errors:
+                break
+            with progress._lock:
+                progress.queued += 1
+            work.put(obj)
+    finally:
+        for _ in workers:
+            work.put(None)
+        for thread in workers:
+            thread.join()
+
+    if unexpected_errors:
+        raise unexpected_errors[0]
+
+    print(f'Copied {progress.copied} objects ({progress.bytes_copied} bytes) with {progress.failed} errors')
+    return progress
+
+
+def copy_object(source_bucket: str, source_key: str, target_bucket: str, target_key: str) -> int:
+    """Copies the object server-side and returns its size in bytes.
+
+    The source object is looked up with one HEAD request, whose size selects the copy strategy and whose content type
+    is reused by a multipart copy. The HyP3 jobs do not list the sizes of the product files, and the role is not
+    allowed to list the source bucket.
+    """
+    s3 = get_s3_client()
+    copy_source = {'Bucket': source_bucket, 'Key': source_key}
+    head = s3.head_object(**copy_source)
+    size = head['ContentLength']
 
+    if size <= COPY_OBJECT_MAX_SIZE:
+        s3.copy_object(CopySource=copy_source, Bucket=target_bucket, Key=target_key, TaggingDirective='REPLACE')
+    else:
+        copy_object_in_parts(copy_source, target_bucket, target_key, size, head['ContentType'])
+    return size
 
-def copy_object(source_bucket, source_key, target_bucket, target_key, chunk_size=104857600):
-    bucket = S3.Bucket(target_bucket)
-    copy_source = {'Bucket': source_bucket, 'Key': source_key}
-    transfer_config = TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size)
-    extra_args = {'TaggingDirective': 'REPLACE'}
-    bucket.copy(CopySource=copy_source, Key=target_key, Config=transfer_config, ExtraArgs=extra_args)
+
+def get_part_size(size: int) -> int:
+    part_size = min(max(math.ceil(size / COPY_TARGET_PARTS), S3_MIN_PART_SIZE), COPY_MAX_PART_SIZE)
+    return max(part_size, math.ceil(size / S3_MAX_PARTS))
+
+
+def copy_object_in_parts(copy_source: dict, target_bucket: str, target_key: str, size: int, content_type: str) -> None:
+    """Copies the object with a multipart upload, copying up to COPY_MAX_PART_WORKERS parts concurrently."""
+    s3 = get_s3_client()
+    part_size = get_part_size(size)
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+    upload_id = s3.create_multipart_upload(Bucket=target_bucket, Key=target_key, ContentType=content_type)['UploadId']
+
+    def copy_part(part_number: int, first_byte: int, last_byte: int) -> dict:
+        response = s3.upload_part_copy(
+            CopySource=copy_source,
+            CopySourceRange=f'bytes={first_byte}-{last_byte}',
+            Bucket=target_bucket,
+            Key=target_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+        )
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(len(ranges), COPY_MAX_PART_WORKERS)) as executor:
+            futures = [
+                executor.submit(copy_part, part_number, first_byte, last_byte)
+                for part_number, (first_byte, last_byte) in enumerate(ranges, start=1)
+            ]
+            parts = [future.result() for future in futures]
+        s3.complete_multipart_upload(
+            Bucket=target_bucket, Key=target_key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=target_bucket, Key=target_key, UploadId=upload_id)
+        raise
 
 
 def get_env_var(name: str) -> str:
@@ -92,10 +545,14 @@ def lambda_handler(event, context) -> None:
     main(dry_run=False)
 
 
-def main(dry_run: bool) -> None:
+def main(dry_run: bool, full_reconciliation: bool = False) -> None:
+    import hyp3_sdk.exceptions
+
     if dry_run:
         print('(DRY RUN)')
 
+    now = datetime.now(tz=timezone.utc)
+
     hyp3_url = get_env_var('HYP3_URL')
     earthdata_username = get_env_var('EARTHDATA_USERNAME')
     earthdata_password = get_env_var('EARTHDATA_PASSWORD')
@@ -105,18 +562,48 @@ def main(dry_run: bool) -> None:
     print(f'HyP3 API URL: {hyp3_url}')
     print(f'Earthdata user: {earthdata_username}')
 
-    hyp3 = hyp3_sdk.HyP3(api_url=hyp3_url, username=earthdata_username, password=earthdata_password)
-
-    jobs = hyp3.find_jobs(status_code='SUCCEEDED')
-    print(f'Jobs: {len(jobs)}')
-
-    existing_objects = get_existing_objects(target_bucket, target_prefix)
+    job_state_location = os.getenv('JOB_STATE_LOCATION')
+    job_state = load_state(job_state_location) if job_state_location else None
+    start = get_job_discovery_start(job_state, now, full_reconciliation)
+    print(f'Fetching jobs requested since {start.isoformat()}' if start else 'Fetching all jobs')
+
+    cached_hyp3 = _HYP3_CLIENTS.get((hyp3_url, earthdata_username))
+    hyp3 = get_hyp3_client(hyp3_url, earthdata_username, earthdata_password)
+
+    try:
+        jobs = iter_jobs(hyp3, start)
+    except hyp3_sdk.exceptions.HyP3Error as e:
+        if hyp3 is not cached_hyp3:
+            raise
+        print(f'Cached HyP3 session was rejected ({e}); logging in again')
+        hyp3 = get_hyp3_client(hyp3_url, earthdata_username, earthdata_password, refresh=True)
+        jobs = iter_jobs(hyp3, start)
+
+    archive_index_location = os.getenv('ARCHIVE_INDEX_LOCATION')
+    if archive_index_location:
+        # The index is also rebuilt along with each full job reconciliation, to pick up objects removed from the archive
+        rebuild = full_reconciliation or (job_state is not None and start is None)
+        archive_index = get_archive_index(archive_index_location, target_bucket, target_prefix, rebuild, now)
+        existing_objects = archive_index
+    else:
+        archive_index = None
+        existing_objects = get_existing_objects(target_bucket, target_prefix)
     print(f'Existing objects: {len(existing_objects)}')
 
-    objects_to_copy = get_objects_to_copy(jobs, existing_objects, target_prefix, EXTENSIONS)
-    print(f'Objects to copy: {len(objects_to_copy)}')
+    # Jobs are fetched, and objects to copy found, only as fast as objects are copied
+    job_stats = JobStats()
+    objects_to_copy = get_objects_to_copy(job_stats.track(jobs), existing_objects, target_prefix, EXTENSIONS)
+    progress = copy_objects(objects_to_copy, target_bucket, dry_run=dry_run, archive_index=archive_index)
+    print(f'Jobs: {job_stats.count}')
+    print(f'Objects to copy: {progress.queued}')
+
+    if archive_index is not None and not dry_run:
+        archive_index.save(archive_index_location)
 
-    copy_objects(objects_to_copy, target_bucket, dry_run=dry_run)
+    if job_state_location and not dry_run:
+        save_state(job_state_location, get_job_discovery_state(
+            job_state, job_stats.newest_request_time, start, now, progress.failed == 0
+        ))
 
 
 if __name__ == '__main__':
@@ -125,7 +612,10 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('dotenv_path')
     parser.add_argument('--no-dry-run', action='store_true')
+    parser.add_argument(
+        '--full-reconciliation', action='store_true', help='Fetch all jobs rather than only jobs since the last run'
+    )
     args = parser.parse_args()
 
     load_dotenv(dotenv_path=args.dotenv_path)
-    main(dry_run=(not args.no_dry_run))
+    main(dry_run=(not args.no_dry_run), full_reconciliation=args.full_reconciliation)